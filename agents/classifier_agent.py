@@ -1,21 +1,36 @@
 # File: /multi_agent_system/agents/classifier_agent.py
-import json
-from typing import Union, Dict, Any
+import asyncio
+from typing import Union, Any, Dict, List, Optional
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.output_parsers import PydanticOutputParser
 from pydantic import ValidationError
 # REMOVED: from core.memory import memory
 from agents.models import ClassificationResult
-from dotenv import load_dotenv 
+from core.prompts import CompiledPrompt
+from core.llm_gateway import PRIORITY_CLASSIFIER
+from core.sniffing import FormatSniffer, SniffResult
+from core import telemetry
 import os
-load_dotenv()  # Load environment variables from .env file
 
 google_api_key = os.getenv("GOOGLE_API_KEY")
 class ClassifierAgent:
-    def __init__(self, memory_instance, model_name: str = "gemini-2.0-flash"): # ADDED memory_instance
+    def __init__(self, memory_instance, model_name: str = "gemini-2.0-flash", result_cache_instance=None, llm_gateway_instance=None,
+                 schema_registry_instance=None, format_sniffer_instance=None, near_duplicate_index_instance=None): # ADDED memory_instance
         self.memory = memory_instance # Store the memory instance
-        self.llm = ChatGoogleGenerativeAI(model=model_name, temperature=0.0,google_api_key = os.getenv("GOOGLE_API_KEY"))
+        self.result_cache = result_cache_instance
+        # Edited copies of earlier documents reuse their classification (exact copies hit result_cache first).
+        self.near_duplicates = near_duplicate_index_instance
+        # Shared with main.py, which sniffs each document once and passes the result in.
+        self.sniffer = format_sniffer_instance or FormatSniffer.default()
+        # JSON payloads with a registered event_type are classified from the registry, without the LLM.
+        self.schema_registry = schema_registry_instance
+        self.model_name = model_name
+        self.llm_gateway = llm_gateway_instance
+        if llm_gateway_instance:
+            self.llm = llm_gateway_instance.client(model_name)
+        else:
+            self.llm = ChatGoogleGenerativeAI(model=model_name, temperature=0.0,google_api_key = os.getenv("GOOGLE_API_KEY"))
         self.parser = PydanticOutputParser(pydantic_object=ClassificationResult)
         self.format_instruction = self.parser.get_format_instructions()
 
@@ -35,7 +50,16 @@ class ClassifierAgent:
             ("human", "Here are some examples:\n{examples}\nNow classify the following:\nContent: {input_content}"),
         ])
 
-        self.chain = self.prompt | self.llm | self.parser
+        # Examples and format instructions are bound once; only the (budget-trimmed) content varies per call.
+        self.compiled = CompiledPrompt(
+            self.prompt, self.llm, self.parser, input_key="input_content",
+            token_budget=int(os.getenv("CLASSIFIER_TOKEN_BUDGET", "1000")), agent="classifier",
+            gateway=llm_gateway_instance, model_name=model_name, priority=PRIORITY_CLASSIFIER,
+            examples=self._prepare_examples(), format_instructions=self.format_instruction
+        )
+        self.chain = self.compiled.chain
+        # Any change to the prompt, few-shot examples or output schema yields a new cache namespace.
+        self.cache_version = self.compiled.version
 
     def _prepare_examples(self):
         example_str = ""
@@ -44,67 +68,146 @@ class ClassifierAgent:
         return example_str
 
     def classify_format_heuristic(self, content: Union[str, bytes]) -> str:
+        """The agent format the sniffer routes `content` to; only a bounded prefix is examined."""
+        return self.sniffer.sniff(content).route
+
+    def _trace_input(self, content: Union[str, bytes], sniffed: SniffResult, size: Optional[int]) -> Dict[str, Any]:
+        # content_length is the whole document's size; the classifier itself only sees `prefix_length` of it.
+        return {"content_length": len(content) if size is None else size, "prefix_length": len(content),
+                "content_type": type(content).__name__, "sniffed": sniffed._asdict()}
+
+    def _preview_content(self, content: Union[str, bytes], heuristic_format: str) -> str:
         if isinstance(content, bytes):
-            if content.startswith(b"%PDF"):
-                return "PDF"
+            if heuristic_format == "PDF":
+                return content[:2048].decode('latin-1', errors='ignore')
             try:
-                decoded_content = content.decode('utf-8')
-            except UnicodeDecodeError:
-                return "Unknown"
-        else:
-            decoded_content = content
+                return content.decode('utf-8', errors='ignore')
+            except:
+                return str(content)
+        return content
 
-        if "From:" in decoded_content and "Subject:" in decoded_content and "@" in decoded_content:
-            return "Email"
-        
-        if decoded_content.strip().startswith("{") and decoded_content.strip().endswith("}"):
-            try:
-                json.loads(decoded_content)
-                return "JSON"
-            except json.JSONDecodeError:
-                pass
-        
-        if "PDF" in decoded_content[:100]:
-            return "PDF"
+    async def _ainvoke_llm(self, process_id: str, preview_content: str, llm_input: str) -> ClassificationResult:
+        result, usage = await self.compiled.ainvoke(llm_input)
+        await self.memory.aadd_entry(process_id, "classifier_agent_tokens", {**usage, "input_chars": len(preview_content), "sent_chars": len(llm_input)})
+        if isinstance(result, Exception):
+            raise result
+        return result
 
-        return "Unknown"
+    def _matches_near_duplicates(self, heuristic_format: str) -> bool:
+        # A PDF preview is the start of the raw file, mostly generator boilerplate shared by unrelated PDFs.
+        return self.near_duplicates is not None and heuristic_format != "PDF"
 
-    def process(self, process_id: str, content: Union[str, bytes]) -> ClassificationResult:
-        self.memory.add_entry(process_id, "classifier_agent_input", {"content_length": len(content), "content_type": type(content).__name__}) # Changed: Use self.memory
-        
-        heuristic_format = self.classify_format_heuristic(content)
+    async def _aclassify(self, process_id: str, preview_content: str, llm_input: str, heuristic_format: str) -> ClassificationResult:
+        if not self._matches_near_duplicates(heuristic_format):
+            return await self._ainvoke_llm(process_id, preview_content, llm_input)
+        return await self.near_duplicates.aget_or_compute(
+            process_id, "classifier_agent", llm_input, self.model_name, self.cache_version,
+            ClassificationResult, lambda: self._ainvoke_llm(process_id, preview_content, llm_input))
 
-        if isinstance(content, bytes):
-            if heuristic_format == "PDF":
-                preview_content = content[:2048].decode('latin-1', errors='ignore')
-            else:
-                try:
-                    preview_content = content.decode('utf-8', errors='ignore')
-                except:
-                    preview_content = str(content)
+    async def _afinalize(self, process_id: str, result: Union[ClassificationResult, Exception], heuristic_format: str) -> ClassificationResult:
+        if isinstance(result, ValidationError):
+            print(f"Classifier Agent: Pydantic validation error: {result}")
+            result = ClassificationResult(format=heuristic_format, intent="Unknown", confidence=0.0)
+        elif isinstance(result, Exception):
+            print(f"Classifier Agent: An error occurred during classification: {result}")
+            result = ClassificationResult(format=heuristic_format, intent="Unknown", confidence=0.0)
         else:
-            preview_content = content
-
-        try:
-            result = self.chain.invoke({
-                "input_content": preview_content,
-                "examples": self._prepare_examples(),
-                "format_instructions": self.format_instruction
-            })
-            
             if heuristic_format != "Unknown":
                 result.format = heuristic_format
-            
-            self.memory.add_entry(process_id, "classifier_agent_output", result.model_dump()) # Changed: Use self.memory
             print(f"Classifier Agent: Format={result.format}, Intent={result.intent}")
-            return result
-        except ValidationError as e:
-            print(f"Classifier Agent: Pydantic validation error: {e}")
-            result = ClassificationResult(format=heuristic_format, intent="Unknown", confidence=0.0)
-            self.memory.add_entry(process_id, "classifier_agent_output", result.model_dump()) # Changed: Use self.memory
-            return result
+
+        await self.memory.aadd_entry(process_id, "classifier_agent_output", result.model_dump())
+        return result
+
+    def _match_schema(self, payload: Optional[Dict[str, Any]]):
+        if self.schema_registry is None or payload is None:
+            return None
+        return self.schema_registry.match(payload)
+
+    async def _afinalize_schema_match(self, process_id: str, schema) -> ClassificationResult:
+        result = ClassificationResult(format="JSON", intent=schema.intent, confidence=1.0)
+        print(f"Classifier Agent: Format=JSON, Intent={result.intent} (registered event_type '{schema.event_type}', LLM skipped)")
+        await self.memory.aadd_entry(process_id, "classifier_agent_output", {**result.model_dump(), "source": "schema_registry", "event_type": schema.event_type})
+        return result
+
+    async def aprocess(self, process_id: str, content: Union[str, bytes], payload: Optional[Dict[str, Any]] = None,
+                       sniffed: Optional[SniffResult] = None, size: Optional[int] = None) -> ClassificationResult:
+        """
+        `payload` is the content already parsed as a JSON object, if it is one (it is not parsed again),
+        `sniffed` the document's format as already sniffed by the caller (sniffed from `content` when missing),
+        and `size` the whole document's size in bytes when `content` is only its prefix.
+        """
+        with telemetry.span("sniff", "classifier"):
+            if sniffed is None:
+                sniffed = self.sniffer.sniff(content)
+            schema = self._match_schema(payload)
+            if schema is None:
+                heuristic_format = "JSON" if payload is not None else sniffed.route
+                preview_content = self._preview_content(content, heuristic_format)
+                llm_input = self.compiled.trim(preview_content)
+        await self.memory.aadd_entry(process_id, "classifier_agent_input", self._trace_input(content, sniffed, size)) # Changed: Use self.memory
+        if schema is not None:
+            return await self._afinalize_schema_match(process_id, schema)
+
+        try:
+            if self.result_cache:
+                result = await self.result_cache.aget_or_compute(
+                    process_id, "classifier_agent", llm_input, self.model_name, self.cache_version,
+                    ClassificationResult, lambda: self._aclassify(process_id, preview_content, llm_input, heuristic_format))
+            else:
+                result = await self._aclassify(process_id, preview_content, llm_input, heuristic_format)
         except Exception as e:
-            print(f"Classifier Agent: An error occurred during classification: {e}")
-            result = ClassificationResult(format=heuristic_format, intent="Unknown", confidence=0.0)
-            self.memory.add_entry(process_id, "classifier_agent_output", result.model_dump()) # Changed: Use self.memory
-            return result
+            result = e
+        return await self._afinalize(process_id, result, heuristic_format)
+
+    async def aprocess_batch(self, process_ids: List[str], contents: List[Union[str, bytes]], max_concurrency: int = 16,
+                             payloads: Optional[List[Optional[Dict[str, Any]]]] = None,
+                             sniffed: Optional[List[SniffResult]] = None, sizes: Optional[List[int]] = None) -> List[ClassificationResult]:
+        """Classifies many documents with a single `abatch` call (cache hits, near-duplicates and registered JSON webhooks are skipped)."""
+        payloads = payloads or [None] * len(contents)
+        sniffed = sniffed or [self.sniffer.sniff(content) for content in contents]
+        sizes = sizes or [None] * len(contents)
+        matches = [self._match_schema(payload) for payload in payloads]
+        pending = [i for i, schema in enumerate(matches) if schema is None]
+        heuristic_formats = {}
+        previews = {}
+        llm_inputs = {}
+        for i, (process_id, content) in enumerate(zip(process_ids, contents)):
+            await self.memory.aadd_entry(process_id, "classifier_agent_input", self._trace_input(content, sniffed[i], sizes[i]))
+            if matches[i] is None:
+                heuristic_formats[i] = "JSON" if payloads[i] is not None else sniffed[i].route
+                previews[i] = self._preview_content(content, heuristic_formats[i])
+                llm_inputs[i] = self.compiled.trim(previews[i])
+
+        async def classify(positions: List[int]) -> List[Any]:
+            indices = [pending[p] for p in positions]
+            outcomes = await self.compiled.abatch([llm_inputs[i] for i in indices], max_concurrency)
+            for i, (_, usage) in zip(indices, outcomes):
+                await self.memory.aadd_entry(process_ids[i], "classifier_agent_tokens", {**usage, "input_chars": len(previews[i]), "sent_chars": len(llm_inputs[i])})
+            return [result for result, _ in outcomes]
+
+        async def classify_new(positions: List[int]) -> List[Any]:
+            if self.near_duplicates is None:
+                return await classify(positions)
+            return await self.near_duplicates.aget_or_compute_many(
+                [process_ids[pending[p]] for p in positions], "classifier_agent",
+                [llm_inputs[pending[p]] if self._matches_near_duplicates(heuristic_formats[pending[p]]) else None for p in positions],
+                self.model_name, self.cache_version, ClassificationResult,
+                lambda subset: classify([positions[s] for s in subset]))
+
+        results: List[Any] = [None] * len(contents)
+        if pending:
+            if self.result_cache:
+                computed = await self.result_cache.aget_or_compute_many(
+                    [process_ids[i] for i in pending], "classifier_agent", [llm_inputs[i] for i in pending],
+                    self.model_name, self.cache_version, ClassificationResult, classify_new)
+            else:
+                computed = await classify_new(list(range(len(pending))))
+            for i, result in zip(pending, computed):
+                results[i] = result
+
+        return await asyncio.gather(*(
+            self._afinalize_schema_match(process_id, schema) if schema is not None
+            else self._afinalize(process_id, results[i], heuristic_formats[i])
+            for i, (process_id, schema) in enumerate(zip(process_ids, matches))
+        ))
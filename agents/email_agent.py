@@ -1,4 +1,8 @@
 # File: /multi_agent_system/agents/email_agent.py
+import asyncio
+import time
+import uuid
+from typing import Any, Dict, List, Tuple, Union
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.output_parsers import PydanticOutputParser
@@ -6,16 +10,30 @@ from pydantic import ValidationError
 # REMOVED: from core.memory import memory
 # REMOVED: from core.action_router import action_router
 from agents.models import EmailContent
-from dotenv import load_dotenv 
-load_dotenv()  # Load environment variables from .env file
+from core.prompts import CompiledPrompt
+from core.llm_gateway import PRIORITY_EXTRACTION
+from core.mime import ParsedEmail, parse_email
+from core import telemetry
 import os
 
 google_api_key = os.getenv("GOOGLE_API_KEY")
 class EmailAgent:
-    def __init__(self, memory_instance, action_router_instance, model_name: str = "gemini-2.0-flash"): # ADDED memory_instance
+    # Emails longer than this are parsed in a worker thread.
+    PARSE_INLINE_MAX_CHARS = 256 * 1024
+
+    def __init__(self, memory_instance, action_router_instance, model_name: str = "gemini-2.0-flash", result_cache_instance=None, llm_gateway_instance=None,
+                 pdf_agent_instance=None): # ADDED memory_instance
         self.memory = memory_instance # Store the memory instance
         self.action_router = action_router_instance # Store the action router instance
-        self.llm = ChatGoogleGenerativeAI(model=model_name, temperature=0.0,google_api_key =os.getenv("GOOGLE_API_KEY"))
+        self.result_cache = result_cache_instance
+        # PDF attachments are processed by this agent as child processes of the email (skipped without one).
+        self.pdf_agent = pdf_agent_instance
+        self.model_name = model_name
+        self.llm_gateway = llm_gateway_instance
+        if llm_gateway_instance:
+            self.llm = llm_gateway_instance.client(model_name)
+        else:
+            self.llm = ChatGoogleGenerativeAI(model=model_name, temperature=0.0,google_api_key =os.getenv("GOOGLE_API_KEY"))
         self.parser = PydanticOutputParser(pydantic_object=EmailContent)
         self.format_instruction = self.parser.get_format_instructions()
 
@@ -35,7 +53,16 @@ class EmailAgent:
             ("human", "Here are some examples:\n{examples}\nNow process the following email:\n{email_content}"),
         ])
 
-        self.chain = self.prompt | self.llm | self.parser
+        # Emails are parsed locally first (see core/mime.py); the main headers and the cleaned body are
+        # then cut to as many leading paragraphs as fit the budget.
+        self.compiled = CompiledPrompt(
+            self.prompt, self.llm, self.parser, input_key="email_content",
+            token_budget=int(os.getenv("EMAIL_TOKEN_BUDGET", "2000")), agent="email",
+            gateway=llm_gateway_instance, model_name=model_name, priority=PRIORITY_EXTRACTION,
+            examples=self._prepare_examples(), format_instructions=self.format_instruction
+        )
+        self.chain = self.compiled.chain
+        self.cache_version = self.compiled.version
 
     def _prepare_examples(self):
         example_str = ""
@@ -45,34 +72,134 @@ class EmailAgent:
                             f"issue_request='{ex['issue_request']}', tone='{ex['tone']}'\n\n")
         return example_str
 
-    def process(self, process_id: str, email_content: str) -> EmailContent:
-        self.memory.add_entry(process_id, "email_agent_input", {"content": email_content[:200] + "..." if len(email_content) > 200 else email_content}) # Changed: Use self.memory
-        
-        try:
-            parsed_email = self.chain.invoke({
-                "email_content": email_content,
-                "examples": self._prepare_examples(),
-                "format_instructions": self.format_instruction
-            })
-            
-            self.memory.add_entry(process_id, "email_agent_output", parsed_email.model_dump()) # Changed: Use self.memory
-            print(f"Email Agent: Sender={parsed_email.sender}, Urgency={parsed_email.urgency}, Tone={parsed_email.tone}")
-
-            if parsed_email.tone == "Escalation" and parsed_email.urgency == "High":
-                self.action_router.trigger_crm_escalation(process_id, parsed_email.model_dump())
-            elif parsed_email.tone == "Threatening":
-                self.action_router.trigger_risk_alert(process_id, parsed_email.model_dump())
+    async def _aparse(self, process_id: str, email_content: str) -> Tuple[ParsedEmail, str]:
+        """Splits the email locally into headers, a cleaned body and attachments, and returns it with the LLM input."""
+        with telemetry.span("parse", "email"):
+            if len(email_content) > self.PARSE_INLINE_MAX_CHARS:
+                # Decoding big attachments would stall the event loop.
+                parsed = await asyncio.to_thread(parse_email, email_content)
             else:
-                self.action_router.trigger_logging_and_close(process_id, parsed_email.model_dump())
+                parsed = parse_email(email_content)
+            llm_input = self.compiled.trim(parsed.llm_input())
+        await self.memory.aadd_entry(process_id, "email_agent_parsed", parsed.summary())
+        return parsed, llm_input
+
+    async def _aprocess_attachment(self, parent_id: str, filename: str, data: bytes) -> Dict[str, Any]:
+        child_id = str(uuid.uuid4())
+        start_time = time.time()
+        await self.memory.aadd_entry(child_id, "input_metadata", {
+            "process_id": child_id,
+            "parent_process_id": parent_id,
+            "timestamp": start_time,
+            "source_type": "email_attachment",
+            "original_filename": filename,
+            "input_type_hint": "PDF"
+        })
+        with telemetry.span("attachment", "pdf") as span:
+            try:
+                await self.pdf_agent.aprocess(child_id, data)
+                status = "PDF processed"
+            except Exception as e:
+                print(f"Email Agent: Attachment {filename} of {parent_id} failed: {e}")
+                await self.memory.aadd_entry(child_id, "agent_processing_error", {"error": str(e)})
+                status = f"Agent processing failed: {e}"
+                span["outcome"] = "error"
+        await self.memory.aadd_entry(child_id, "processing_summary", {"status": status, "duration_seconds": time.time() - start_time})
+        return {"process_id": child_id, "filename": filename, "size": len(data), "status": status, "trace_url": f"/trace/{child_id}"}
+
+    async def _afan_out_attachments(self, process_id: str, parsed: ParsedEmail):
+        """Runs every PDF attachment through the PDF agent concurrently and links the child traces in the parent's."""
+        if self.pdf_agent is None or not parsed.attachments:
+            return
+        children = await asyncio.gather(*(
+            self._aprocess_attachment(process_id, attachment.filename or f"attachment-{i + 1}.pdf", attachment.data)
+            for i, attachment in enumerate(parsed.attachments)
+        ))
+        await self.memory.aadd_entry(process_id, "email_attachments", {"children": children})
+
+    async def _ainvoke_llm(self, process_id: str, email_content: str, llm_input: str) -> EmailContent:
+        parsed_email, usage = await self.compiled.ainvoke(llm_input)
+        await self.memory.aadd_entry(process_id, "email_agent_tokens", {**usage, "input_chars": len(email_content), "sent_chars": len(llm_input)})
+        if isinstance(parsed_email, Exception):
+            raise parsed_email
+        return parsed_email
 
-            return parsed_email
-        except ValidationError as e:
-            print(f"Email Agent: Pydantic validation error: {e}")
-            self.memory.add_entry(process_id, "email_agent_error", {"error": str(e), "content": email_content[:100]}) # Changed: Use self.memory
-            self.action_router.trigger_logging_and_close(process_id, {"error": "Email parsing failed", "details": str(e)})
+    async def _afinalize(self, process_id: str, email_content: str, parsed_email: Union[EmailContent, Exception],
+                         parsed: ParsedEmail) -> EmailContent:
+        if isinstance(parsed_email, ValidationError):
+            print(f"Email Agent: Pydantic validation error: {parsed_email}")
+            await self.memory.aadd_entry(process_id, "email_agent_error", {"error": str(parsed_email), "content": email_content[:100]})
+            await self.action_router.atrigger_logging_and_close(process_id, {"error": "Email parsing failed", "details": str(parsed_email)})
             return EmailContent(sender="Unknown", urgency="Unknown", issue_request="Parsing failed", tone="Unknown")
-        except Exception as e:
-            print(f"Email Agent: An error occurred: {e}")
-            self.memory.add_entry(process_id, "email_agent_error", {"error": str(e), "content": email_content[:100]}) # Changed: Use self.memory
-            self.action_router.trigger_logging_and_close(process_id, {"error": "Email processing failed", "details": str(e)})
+        if isinstance(parsed_email, Exception):
+            print(f"Email Agent: An error occurred: {parsed_email}")
+            await self.memory.aadd_entry(process_id, "email_agent_error", {"error": str(parsed_email), "content": email_content[:100]})
+            await self.action_router.atrigger_logging_and_close(process_id, {"error": "Email processing failed", "details": str(parsed_email)})
             return EmailContent(sender="Unknown", urgency="Unknown", issue_request="Processing failed", tone="Unknown")
+
+        # The From header is authoritative; the model's reading of it is only used without one.
+        if parsed.sender:
+            parsed_email.sender = parsed.sender
+        await self.memory.aadd_entry(process_id, "email_agent_output", parsed_email.model_dump())
+        print(f"Email Agent: Sender={parsed_email.sender}, Urgency={parsed_email.urgency}, Tone={parsed_email.tone}")
+
+        if parsed_email.tone == "Escalation" and parsed_email.urgency == "High":
+            await self.action_router.atrigger_crm_escalation(process_id, parsed_email.model_dump())
+        elif parsed_email.tone == "Threatening":
+            await self.action_router.atrigger_risk_alert(process_id, parsed_email.model_dump())
+        else:
+            await self.action_router.atrigger_logging_and_close(process_id, parsed_email.model_dump())
+
+        return parsed_email
+
+    async def aprocess(self, process_id: str, email_content: str) -> EmailContent:
+        await self.memory.aadd_entry(process_id, "email_agent_input", {"content": email_content[:200] + "..." if len(email_content) > 200 else email_content}) # Changed: Use self.memory
+        
+        parsed, llm_input = await self._aparse(process_id, email_content)
+
+        async def extract() -> Union[EmailContent, Exception]:
+            try:
+                if self.result_cache:
+                    return await self.result_cache.aget_or_compute(
+                        process_id, "email_agent", llm_input, self.model_name, self.cache_version,
+                        EmailContent, lambda: self._ainvoke_llm(process_id, email_content, llm_input))
+                return await self._ainvoke_llm(process_id, email_content, llm_input)
+            except Exception as e:
+                return e
+
+        parsed_email, _ = await asyncio.gather(extract(), self._afan_out_attachments(process_id, parsed))
+        return await self._afinalize(process_id, email_content, parsed_email, parsed)
+
+    async def aprocess_batch(self, process_ids: List[str], email_contents: List[str], max_concurrency: int = 16) -> List[EmailContent]:
+        """Extracts many emails with a single `abatch` call, then triggers each email's action concurrently."""
+        for process_id, email_content in zip(process_ids, email_contents):
+            await self.memory.aadd_entry(process_id, "email_agent_input", {"content": email_content[:200] + "..." if len(email_content) > 200 else email_content})
+        prepared = [await self._aparse(process_id, email_content) for process_id, email_content in zip(process_ids, email_contents)]
+        parsed = [p for p, _ in prepared]
+        llm_inputs = [llm_input for _, llm_input in prepared]
+
+        async def extract(indices: List[int]) -> List[Any]:
+            outcomes = await self.compiled.abatch([llm_inputs[i] for i in indices], max_concurrency)
+            for i, (_, usage) in zip(indices, outcomes):
+                await self.memory.aadd_entry(process_ids[i], "email_agent_tokens", {**usage, "input_chars": len(email_contents[i]), "sent_chars": len(llm_inputs[i])})
+            return [parsed_email for parsed_email, _ in outcomes]
+
+        async def extract_all() -> List[Any]:
+            if self.result_cache:
+                return await self.result_cache.aget_or_compute_many(
+                    process_ids, "email_agent", llm_inputs, self.model_name, self.cache_version,
+                    EmailContent, extract)
+            return await extract(list(range(len(email_contents))))
+
+        parsed_emails, *_ = await asyncio.gather(extract_all(), *(
+            self._afan_out_attachments(process_id, p) for process_id, p in zip(process_ids, parsed)))
+
+        slots = asyncio.Semaphore(max_concurrency)
+
+        async def finalize(process_id: str, email_content: str, parsed_email: Any, parsed: ParsedEmail) -> EmailContent:
+            async with slots:
+                return await self._afinalize(process_id, email_content, parsed_email, parsed)
+
+        return await asyncio.gather(*(
+            finalize(*item) for item in zip(process_ids, email_contents, parsed_emails, parsed)
+        ))
@@ -1,42 +1,60 @@
 # File: /multi_agent_system/agents/json_agent.py
 import json
 from pydantic import ValidationError
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 # REMOVED: from core.memory import memory
 # REMOVED: from core.action_router import action_router
-from agents.models import WebhookData, JsonProcessingResult
-from dotenv import load_dotenv
+from agents.models import WebhookData, JsonProcessingResult, WEBHOOK_SCHEMAS
+from core import schemas, telemetry
+from core.schemas import SchemaRegistry
 
 class JsonAgent:
-    def __init__(self, memory_instance, action_router_instance): # ADDED memory_instance
+    def __init__(self, memory_instance, action_router_instance, schema_registry_instance=None): # ADDED memory_instance
         self.memory = memory_instance # Store the memory instance
         self.action_router = action_router_instance # Store the action router instance
+        self.schema_registry = schema_registry_instance or SchemaRegistry(WEBHOOK_SCHEMAS)
 
-    def process(self, process_id: str, json_content: str) -> JsonProcessingResult:
-        self.memory.add_entry(process_id, "json_agent_input", {"content": json_content[:200] + "..." if len(json_content) > 200 else json_content}) # Changed: Use self.memory
+    async def aprocess(self, process_id: str, json_content: str, payload: Optional[Dict[str, Any]] = None) -> JsonProcessingResult:
+        """`payload` is `json_content` already parsed (e.g. by the classifier stage); it is only parsed here when missing."""
+        await self.memory.aadd_entry(process_id, "json_agent_input", {"content": json_content[:200] + "..." if len(json_content) > 200 else json_content}) # Changed: Use self.memory
         
         parsed_data = None
         is_valid_schema = True
         anomalies = []
 
         try:
-            data = json.loads(json_content)
+            if payload is not None:
+                data = payload
+            else:
+                with telemetry.span("parse", "json"):
+                    data = schemas.loads(json_content)
             parsed_data = data
         except json.JSONDecodeError as e:
             is_valid_schema = False
             anomalies.append(f"JSON Decode Error: {e}")
             print(f"JSON Agent: JSON decoding failed: {e}")
             result = JsonProcessingResult(is_valid_schema=is_valid_schema, anomalies=anomalies, parsed_data=None)
-            self.memory.add_entry(process_id, "json_agent_output", result.model_dump()) # Changed: Use self.memory
-            self.action_router.trigger_anomaly_alert(process_id, {"reason": "JSON_Decode_Error", "details": str(e)})
+            await self.memory.aadd_entry(process_id, "json_agent_output", result.model_dump()) # Changed: Use self.memory
+            await self.action_router.atrigger_anomaly_alert(process_id, {"reason": "JSON_Decode_Error", "details": str(e)})
+            return result
+
+        if not isinstance(data, dict):
+            # A top-level array (or scalar) is valid JSON but not a webhook event; it is kept under "items".
+            anomalies.append(f"Expected a JSON object, got a top-level {type(data).__name__}.")
+            print(f"JSON Agent: Payload is a {type(data).__name__}, not an object.")
+            result = JsonProcessingResult(is_valid_schema=False, anomalies=anomalies, parsed_data={"items": data})
+            await self.memory.aadd_entry(process_id, "json_agent_output", result.model_dump())
+            await self.action_router.atrigger_anomaly_alert(process_id, {"reason": "JSON_Not_An_Object", "anomalies": anomalies, "data_preview": json_content[:200]})
             return result
 
         try:
-            webhook_event = WebhookData(**data)
+            with telemetry.span("validate", "json"):
+                schema = self.schema_registry.match(data)
+                webhook_event = schema.validate(data) if schema is not None else WebhookData.model_validate(data)
             parsed_data = webhook_event.model_dump()
-            print("JSON Agent: Data successfully validated against WebhookData schema.")
+            print(f"JSON Agent: Data successfully validated against {type(webhook_event).__name__} schema.")
 
-            if webhook_event.event_type not in ["order_created", "user_signed_up", "payment_failed"]:
+            if schema is None:
                 anomalies.append(f"Unexpected event_type: {webhook_event.event_type}")
                 is_valid_schema = False
             if not webhook_event.timestamp:
@@ -53,11 +71,11 @@ class JsonAgent:
             print(f"JSON Agent: Unexpected error: {e}")
 
         result = JsonProcessingResult(is_valid_schema=is_valid_schema, anomalies=anomalies, parsed_data=parsed_data)
-        self.memory.add_entry(process_id, "json_agent_output", result.model_dump()) # Changed: Use self.memory
+        await self.memory.aadd_entry(process_id, "json_agent_output", result.model_dump()) # Changed: Use self.memory
 
         if not is_valid_schema:
-            self.action_router.trigger_anomaly_alert(process_id, {"reason": "JSON_Schema_Mismatch", "anomalies": anomalies, "data_preview": json_content[:200]})
+            await self.action_router.atrigger_anomaly_alert(process_id, {"reason": "JSON_Schema_Mismatch", "anomalies": anomalies, "data_preview": json_content[:200]})
         else:
-            self.action_router.trigger_logging_and_close(process_id, {"message": "JSON processed successfully", "data": parsed_data})
+            await self.action_router.atrigger_logging_and_close(process_id, {"message": "JSON processed successfully", "data": parsed_data})
 
         return result
\ No newline at end of file
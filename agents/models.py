@@ -1,5 +1,5 @@
 # File: /multi_agent_system/agents/models.py
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import List, Literal, Optional, Dict, Any
 
 # --- Classifier Agent Models ---
@@ -30,6 +30,50 @@ class WebhookData(BaseModel):
     data: Dict[str, Any] = Field(..., description="Payload data of the webhook event.")
     source_app: Optional[str] = Field(None, description="The application that sent the webhook.")
 
+# Payloads of the registered webhook event types (see core/schemas.py). Unknown extra fields are kept.
+class OrderItem(BaseModel):
+    model_config = ConfigDict(extra="allow")
+    product_id: str
+    quantity: int
+    price: float
+
+class OrderCreatedData(BaseModel):
+    model_config = ConfigDict(extra="allow")
+    order_id: str
+    customer_id: str
+    total_amount: float
+    currency: str
+    items: List[OrderItem] = Field(default_factory=list)
+
+class UserSignedUpData(BaseModel):
+    model_config = ConfigDict(extra="allow")
+    user_id: str
+    email: Optional[str] = None
+
+class PaymentFailedData(BaseModel):
+    model_config = ConfigDict(extra="allow")
+    payment_id: Optional[str] = None
+    order_id: Optional[str] = None
+    amount: Optional[float] = None
+    currency: Optional[str] = None
+    reason: Optional[str] = None
+
+class OrderCreatedWebhook(WebhookData):
+    data: OrderCreatedData
+
+class UserSignedUpWebhook(WebhookData):
+    data: UserSignedUpData
+
+class PaymentFailedWebhook(WebhookData):
+    data: PaymentFailedData
+
+# event_type -> (envelope model, intent); registered with core.schemas.SchemaRegistry.
+WEBHOOK_SCHEMAS = {
+    "order_created": (OrderCreatedWebhook, "Unknown"),
+    "user_signed_up": (UserSignedUpWebhook, "Unknown"),
+    "payment_failed": (PaymentFailedWebhook, "Unknown"),
+}
+
 class JsonProcessingResult(BaseModel):
     is_valid_schema: bool = Field(..., description="True if the JSON validates against the expected schema.")
     anomalies: List[str] = Field(..., description="List of detected anomalies or schema validation errors.")
@@ -55,6 +99,14 @@ class PolicyData(BaseModel):
     keywords_found: List[str]
     summary: str
 
+# Tagged union for PDFs whose type could not be decided locally: one call decides and extracts.
+class PdfExtraction(BaseModel):
+    document_type: Literal["Invoice", "Policy", "Other"] = Field(
+        ..., description="Type of document: 'Invoice', 'Policy' or 'Other'. Decides which of the data fields is filled."
+    )
+    invoice_data: Optional[InvoiceData] = Field(None, description="Invoice details; only when document_type is 'Invoice'.")
+    policy_data: Optional[PolicyData] = Field(None, description="Policy details; only when document_type is 'Policy'.")
+
 class PdfProcessingResult(BaseModel):
     document_type: Literal["Invoice", "Policy", "Other"] = Field(
         ..., description="Type of document identified in the PDF."
@@ -1,27 +1,58 @@
 # File: /multi_agent_system/agents/pdf_agent.py
-import io
+import asyncio
+import hashlib
 import json
-import PyPDF2
-from typing import List, Union, Dict, Any
+import multiprocessing
+import re
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Union, Dict, Any, Optional
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.output_parsers import PydanticOutputParser
 from pydantic import ValidationError
 # REMOVED: from core.memory import memory
 # REMOVED: from core.action_router import action_router
-from agents.models import PdfProcessingResult, InvoiceData, PolicyData, InvoiceLineItem
-from dotenv import load_dotenv
-load_dotenv()  # Load environment variables from .env file
+from agents.models import PdfProcessingResult, PdfExtraction, InvoiceData, PolicyData, InvoiceLineItem
+from agents.pdf_text import extract_pdf_text, report_worker_pid
+from core.result_cache import LRUTTLCache
+from core.prompts import CompiledPrompt
+from core.llm_gateway import PRIORITY_EXTRACTION
+from core import telemetry
 import os
 google_api_key = os.getenv("GOOGLE_API_KEY")
 
+# Weighted keyword signals for routing a PDF before extraction. Each pattern counts at most
+# three times so one repeated word cannot dominate the score.
+INVOICE_SIGNALS = [(re.compile(pattern, re.IGNORECASE), weight) for pattern, weight in [
+    (r"\binvoice\b", 3), (r"\bbill(?:ed)? to\b|\bbill no\b", 2), (r"\b(?:total|amount|balance) due\b", 3),
+    (r"\bgrand total\b|\bsubtotal\b", 2), (r"\bunit price\b", 2), (r"\bqty\b|\bquantity\b", 1),
+    (r"\bpayment terms\b", 2), (r"\bdue date\b", 1), (r"\btax\b", 1), (r"[$€£]\s?\d", 1),
+]]
+POLICY_SIGNALS = [(re.compile(pattern, re.IGNORECASE), weight) for pattern, weight in [
+    (r"\bpolic(?:y|ies)\b", 3), (r"\bregulations?\b", 2), (r"\bcomplian(?:ce|t)\b", 2),
+    (r"\b(?:gdpr|hipaa|ccpa|fda|pci dss)\b", 3), (r"\bguidelines?\b", 2), (r"\bdata protection\b", 2),
+    (r"\beffective (?:date|from)\b", 1), (r"\bshall\b", 1), (r"\bscope\b", 1), (r"\bprocedures?\b", 1),
+]]
+
 class PdfAgent:
-    def __init__(self, memory_instance, action_router_instance, model_name: str = "gemini-2.0-flash"): # ADDED memory_instance
+    def __init__(self, memory_instance, action_router_instance, model_name: str = "gemini-2.0-flash", result_cache_instance=None, llm_gateway_instance=None,
+                 near_duplicate_index_instance=None): # ADDED memory_instance
         self.memory = memory_instance # Store the memory instance
         self.action_router = action_router_instance # Store the action router instance
-        self.llm = ChatGoogleGenerativeAI(model=model_name, temperature=0.0,google_api_key =os.getenv("GOOGLE_API_KEY"))
+        self.result_cache = result_cache_instance
+        # Only the document type of a near-copy is reused: its extracted fields (numbers, names) differ.
+        self.near_duplicates = near_duplicate_index_instance
+        self.model_name = model_name
+        self.llm_gateway = llm_gateway_instance
+        if llm_gateway_instance:
+            self.llm = llm_gateway_instance.client(model_name)
+        else:
+            self.llm = ChatGoogleGenerativeAI(model=model_name, temperature=0.0,google_api_key =os.getenv("GOOGLE_API_KEY"))
         self.invoice_parser = PydanticOutputParser(pydantic_object=InvoiceData)
         self.policy_parser = PydanticOutputParser(pydantic_object=PolicyData)
+        self.combined_parser = PydanticOutputParser(pydantic_object=PdfExtraction)
 
         self.invoice_examples = [
             {"text": "Invoice # INV-2023-001\nDate: 2023-10-26\nTotal Due: $1250.00\nItem: Consulting, Qty: 1, Price: 1000.00\nItem: Training, Qty: 1, Price: 250.00",
@@ -45,6 +76,33 @@ class PdfAgent:
             ("human", "Here are some examples:\n{examples}\n\nNow process the following PDF content:\n{pdf_content}"),
         ])
 
+        # One compiled prompt per extraction schema; PDF text over the budget keeps its first pages.
+        token_budget = int(os.getenv("PDF_TOKEN_BUDGET", "2000"))
+        self.invoice_prompt = CompiledPrompt(
+            self.prompt_template, self.llm, self.invoice_parser, input_key="pdf_content", token_budget=token_budget,
+            trim_strategy="head", agent="pdf", stage="llm_invoice", gateway=llm_gateway_instance, model_name=model_name,
+            priority=PRIORITY_EXTRACTION, examples=self._prepare_invoice_examples(), format_instructions=self.invoice_parser.get_format_instructions())
+        self.policy_prompt = CompiledPrompt(
+            self.prompt_template, self.llm, self.policy_parser, input_key="pdf_content", token_budget=token_budget,
+            trim_strategy="head", agent="pdf", stage="llm_policy", gateway=llm_gateway_instance, model_name=model_name,
+            priority=PRIORITY_EXTRACTION, examples=self._prepare_policy_examples(), format_instructions=self.policy_parser.get_format_instructions())
+        self.combined_prompt = CompiledPrompt(
+            self.prompt_template, self.llm, self.combined_parser, input_key="pdf_content", token_budget=token_budget,
+            trim_strategy="head", agent="pdf", stage="llm_combined", gateway=llm_gateway_instance, model_name=model_name,
+            priority=PRIORITY_EXTRACTION, examples=self._prepare_combined_examples(), format_instructions=self.combined_parser.get_format_instructions())
+
+        # Text extraction: pages are parsed only until the character budget sent to the LLM is filled.
+        # The CPU-bound parsing runs in a process pool (0 workers = a thread on this process instead).
+        self.max_text_chars = int(os.getenv("PDF_MAX_TEXT_CHARS", "8000"))
+        self.extraction_workers = int(os.getenv("PDF_EXTRACTION_WORKERS", str(os.cpu_count() or 1)))
+        self.extraction_timeout = float(os.getenv("PDF_EXTRACTION_TIMEOUT_SECONDS", "30"))
+        self.text_cache = LRUTTLCache(max_entries=int(os.getenv("PDF_TEXT_CACHE_ENTRIES", "256")), ttl_seconds=3600)
+        self._extraction_pool = None
+        self._worker_pids = None
+
+        # Below this keyword-scorer confidence the type is decided by the LLM in a single combined call.
+        self.routing_min_confidence = float(os.getenv("PDF_ROUTING_MIN_CONFIDENCE", "0.7"))
+
     def _prepare_invoice_examples(self):
         example_str = ""
         for ex in self.invoice_examples:
@@ -57,84 +115,222 @@ class PdfAgent:
             example_str += f"Content:\n{ex['text']}\nOutput: {json.dumps(ex['output'])}\n\n"
         return example_str
 
-    def _extract_text_from_pdf(self, pdf_bytes: bytes) -> str:
-        text = ""
+    def _prepare_combined_examples(self):
+        example_str = ""
+        for ex in self.invoice_examples:
+            output = PdfExtraction(document_type="Invoice", invoice_data=ex["output"]).model_dump()
+            example_str += f"Content:\n{ex['text']}\nOutput: {json.dumps(output)}\n\n"
+        for ex in self.policy_examples:
+            output = PdfExtraction(document_type="Policy", policy_data=ex["output"]).model_dump()
+            example_str += f"Content:\n{ex['text']}\nOutput: {json.dumps(output)}\n\n"
+        return example_str
+
+    @staticmethod
+    def _score_signals(text: str, signals) -> int:
+        return sum(weight * min(len(pattern.findall(text)), 3) for pattern, weight in signals)
+
+    def _route_document_type(self, text: str) -> Dict[str, Any]:
+        """Cheap local decision on the document type, so extraction needs a single LLM call."""
+        invoice_score = self._score_signals(text, INVOICE_SIGNALS)
+        policy_score = self._score_signals(text, POLICY_SIGNALS)
+        total = invoice_score + policy_score
+        confidence = max(invoice_score, policy_score) / total if total else 0.0
+        if total < 3 or confidence < self.routing_min_confidence:
+            document_type, method = None, "combined_llm"
+        else:
+            document_type = "Invoice" if invoice_score >= policy_score else "Policy"
+            method = "keyword_scorer"
+        return {
+            "document_type": document_type,
+            "method": method,
+            "confidence": round(confidence, 3),
+            "scores": {"Invoice": invoice_score, "Policy": policy_score},
+        }
+
+    async def _aroute_near_duplicate(self, process_id: str, text: str, route: Dict[str, Any]) -> Optional[bytes]:
+        """
+        When the keyword scorer is unsure, routes by the document type the combined extraction decided
+        for a near-copy of `text`. Returns the text's signature when the type is still undecided, so it
+        can be indexed once the combined extraction decides it.
+        """
+        signature = self.near_duplicates.signature(text)
+        if signature is None:
+            return None
+        match = await self.near_duplicates.alookup("pdf_agent_routing", self.model_name, self.combined_prompt.version, signature)
+        previous = self.near_duplicates.parse_match("pdf_agent_routing", match, PdfExtraction)
+        if previous is None or previous.document_type not in ("Invoice", "Policy"):
+            return signature
+        route["document_type"] = previous.document_type
+        route["method"] = "near_duplicate"
+        await self.memory.aadd_entry(process_id, "pdf_agent_routing_near_duplicate", self.near_duplicates.trace_entry(match))
+        return None
+
+    async def _ainvoke_llm(self, process_id: str, compiled: CompiledPrompt, text: str, llm_text: str):
+        result, usage = await compiled.ainvoke(llm_text)
+        await self.memory.aadd_entry(process_id, "pdf_agent_tokens", {**usage, "input_chars": len(text), "sent_chars": len(llm_text)})
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def _aextract(self, process_id: str, namespace: str, compiled: CompiledPrompt, model_cls, text: str):
+        llm_text = compiled.trim(text)
+        if self.result_cache:
+            return await self.result_cache.aget_or_compute(
+                process_id, namespace, llm_text, self.model_name, compiled.version,
+                model_cls, lambda: self._ainvoke_llm(process_id, compiled, text, llm_text))
+        return await self._ainvoke_llm(process_id, compiled, text, llm_text)
+
+    def _get_extraction_pool(self) -> ProcessPoolExecutor:
+        if self._extraction_pool is None:
+            # spawn: workers import only agents.pdf_text instead of inheriting the whole app via fork.
+            context = multiprocessing.get_context("spawn")
+            # Each worker reports its PID as it starts, so a hung parse can be terminated (see below).
+            self._worker_pids = context.SimpleQueue()
+            self._extraction_pool = ProcessPoolExecutor(
+                max_workers=self.extraction_workers,
+                mp_context=context,
+                initializer=report_worker_pid,
+                initargs=(self._worker_pids,)
+            )
+        return self._extraction_pool
+
+    def _reset_extraction_pool(self):
+        pool, self._extraction_pool = self._extraction_pool, None
+        pids, self._worker_pids = self._worker_pids, None
+        if pool is None:
+            return
+        # A timed-out parse keeps running inside its worker, so the workers are terminated outright.
+        # Other extractions in flight on this pool fail and are reported as extraction failures.
+        while not pids.empty():
+            try:
+                os.kill(pids.get(), signal.SIGTERM)
+            except (ProcessLookupError, PermissionError):
+                pass
+        pids.close()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _content_hash(pdf_source: Union[bytes, str]) -> str:
+        if isinstance(pdf_source, bytes):
+            return hashlib.sha256(pdf_source).hexdigest()
+        # Chunked rather than hashlib.file_digest, which needs Python 3.11 (the image runs 3.9).
+        digest = hashlib.sha256()
+        with open(pdf_source, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    async def _aextract_text(self, pdf_source: Union[bytes, str]) -> Dict[str, Any]:
+        """Returns the (budget-bounded) text for a PDF plus how it was obtained, for the trace.
+
+        `pdf_source` is the PDF bytes or a path to the PDF; paths let large uploads reach the
+        extraction workers without an in-memory copy.
+        """
+        content_hash = await asyncio.to_thread(self._content_hash, pdf_source)
+        cache_key = f"{content_hash}:{self.max_text_chars}"
+        cached = self.text_cache.get(cache_key)
+        if cached is not None:
+            return {"text": cached, "cache_hit": True, "timed_out": False, "duration_seconds": 0.0}
+
+        start = time.perf_counter()
+        timed_out = False
         try:
-            reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
-            for page in reader.pages:
-                text += page.extract_text() or ""
-            return text
-        except PyPDF2.errors.PdfReadError as e:
-            print(f"PDF Agent: Could not read PDF: {e}")
-            return ""
+            if self.extraction_workers > 0:
+                loop = asyncio.get_running_loop()
+                future = loop.run_in_executor(self._get_extraction_pool(), extract_pdf_text, pdf_source, self.max_text_chars)
+            else:
+                future = asyncio.to_thread(extract_pdf_text, pdf_source, self.max_text_chars)
+            text = await asyncio.wait_for(future, timeout=self.extraction_timeout)
+        except asyncio.TimeoutError:
+            print(f"PDF Agent: Text extraction timed out after {self.extraction_timeout}s")
+            timed_out = True
+            text = ""
+            if self.extraction_workers > 0:
+                self._reset_extraction_pool()
         except Exception as e:
-            print(f"PDF Agent: An unexpected error occurred during PDF text extraction: {e}")
-            return ""
+            print(f"PDF Agent: Text extraction worker failed: {e}")
+            text = ""
+
+        if text:
+            self.text_cache.set(cache_key, text)
+        return {"text": text, "cache_hit": False, "timed_out": timed_out, "duration_seconds": time.perf_counter() - start}
 
-    def process(self, process_id: str, pdf_bytes: bytes) -> PdfProcessingResult:
-        self.memory.add_entry(process_id, "pdf_agent_input", {"content_size": len(pdf_bytes)}) # Changed: Use self.memory
+    def close(self):
+        if self._extraction_pool is not None:
+            self._extraction_pool.shutdown(wait=False, cancel_futures=True)
+            self._extraction_pool = None
+
+    async def aprocess(self, process_id: str, pdf_source: Union[bytes, str]) -> PdfProcessingResult:
+        content_size = len(pdf_source) if isinstance(pdf_source, bytes) else os.path.getsize(pdf_source)
+        await self.memory.aadd_entry(process_id, "pdf_agent_input", {"content_size": content_size})
         
-        extracted_text = self._extract_text_from_pdf(pdf_bytes)
+        with telemetry.span("text_extraction", "pdf") as span:
+            extraction = await self._aextract_text(pdf_source)
+            if not extraction["text"]:
+                span["outcome"] = "timeout" if extraction["timed_out"] else "error"
+        extracted_text = extraction.pop("text")
+        await self.memory.aadd_entry(process_id, "pdf_text_extraction", {**extraction, "chars": len(extracted_text)})
         if not extracted_text:
             result = PdfProcessingResult(document_type="Other", flags=["PDF_Extraction_Failed"], invoice_data=None, policy_data=None)
-            self.memory.add_entry(process_id, "pdf_agent_output", result.model_dump()) # Changed: Use self.memory
-            self.action_router.trigger_anomaly_alert(process_id, {"reason": "PDF_Extraction_Failed"})
+            await self.memory.aadd_entry(process_id, "pdf_agent_output", result.model_dump()) # Changed: Use self.memory
+            await self.action_router.atrigger_anomaly_alert(process_id, {"reason": "PDF_Extraction_Failed"})
             return result
 
-        llm_text = extracted_text[:8000]
+        llm_text = extracted_text
 
         document_type = "Other"
         invoice_data = None
         policy_data = None
         flags = []
 
+        with telemetry.span("route", "pdf"):
+            route = self._route_document_type(llm_text)
+        signature = None
+        if route["document_type"] is None and self.near_duplicates is not None:
+            signature = await self._aroute_near_duplicate(process_id, llm_text, route)
         try:
-            invoice_chain = self.prompt_template | self.llm | self.invoice_parser
-            parsed_invoice = invoice_chain.invoke({
-                "pdf_content": llm_text,
-                "examples": self._prepare_invoice_examples(),
-                "format_instructions": self.invoice_parser.get_format_instructions()
-            })
-            invoice_data = parsed_invoice
+            if route["document_type"] == "Invoice":
+                invoice_data = await self._aextract(process_id, "pdf_agent_invoice", self.invoice_prompt, InvoiceData, llm_text)
+            elif route["document_type"] == "Policy":
+                policy_data = await self._aextract(process_id, "pdf_agent_policy", self.policy_prompt, PolicyData, llm_text)
+            else:
+                extraction = await self._aextract(process_id, "pdf_agent_combined", self.combined_prompt, PdfExtraction, llm_text)
+                route["document_type"] = extraction.document_type
+                if signature is not None and extraction.document_type in ("Invoice", "Policy"):
+                    await self.near_duplicates.aadd("pdf_agent_routing", self.model_name, self.combined_prompt.version, signature,
+                                                    process_id, PdfExtraction(document_type=extraction.document_type))
+                if extraction.document_type == "Invoice":
+                    invoice_data = extraction.invoice_data
+                elif extraction.document_type == "Policy":
+                    policy_data = extraction.policy_data
+        except ValidationError as e:
+            print(f"PDF Agent: Validation failed for {route['document_type'] or 'combined'} extraction: {e}")
+        except Exception as e:
+            print(f"PDF Agent: Error extracting {route['document_type'] or 'combined'} data: {e}")
+        await self.memory.aadd_entry(process_id, "pdf_agent_routing", route)
+
+        if invoice_data:
             document_type = "Invoice"
             print(f"PDF Agent: Identified as Invoice, Total: {invoice_data.total_amount}")
             if invoice_data.total_amount > 10000:
                 flags.append("Invoice_Total_High")
-                self.action_router.trigger_risk_alert(process_id, {"reason": "HighValueInvoice", "total": invoice_data.total_amount, "invoice_num": invoice_data.invoice_number})
+                await self.action_router.atrigger_risk_alert(process_id, {"reason": "HighValueInvoice", "total": invoice_data.total_amount, "invoice_num": invoice_data.invoice_number})
+        elif policy_data:
+            document_type = "Policy"
+            print(f"PDF Agent: Identified as Policy, Keywords: {policy_data.keywords_found}")
+            if any(kw.lower() in [s.lower() for s in policy_data.keywords_found] for kw in ["gdpr", "fda", "hipaa", "ccpa", "pci dss"]):
+                flags.append("Compliance_Relevant_Keywords")
+                await self.action_router.atrigger_compliance_flag(process_id, {"reason": "ComplianceKeywordsFound", "keywords": policy_data.keywords_found, "policy_title": policy_data.policy_title})
 
-        except ValidationError as e:
-            print(f"PDF Agent: Not an Invoice or validation failed for invoice: {e}")
-        except Exception as e:
-            print(f"PDF Agent: Error processing as invoice: {e}")
-
-        if document_type == "Other":
-            try:
-                policy_chain = self.prompt_template | self.llm | self.policy_parser
-                parsed_policy = policy_chain.invoke({
-                    "pdf_content": llm_text,
-                    "examples": self._prepare_policy_examples(),
-                    "format_instructions": self.policy_parser.get_format_instructions()
-                })
-                policy_data = parsed_policy
-                document_type = "Policy"
-                print(f"PDF Agent: Identified as Policy, Keywords: {policy_data.keywords_found}")
-                if any(kw.lower() in [s.lower() for s in policy_data.keywords_found] for kw in ["gdpr", "fda", "hipaa", "ccpa", "pci dss"]):
-                    flags.append("Compliance_Relevant_Keywords")
-                    self.action_router.trigger_compliance_flag(process_id, {"reason": "ComplianceKeywordsFound", "keywords": policy_data.keywords_found, "policy_title": policy_data.policy_title})
-            except ValidationError as e:
-                print(f"PDF Agent: Not a Policy or validation failed for policy: {e}")
-            except Exception as e:
-                print(f"PDF Agent: Error processing as policy: {e}")
-        
         result = PdfProcessingResult(
             document_type=document_type,
             invoice_data=invoice_data,
             policy_data=policy_data,
             flags=flags
         )
-        self.memory.add_entry(process_id, "pdf_agent_output", result.model_dump()) # Changed: Use self.memory
+        await self.memory.aadd_entry(process_id, "pdf_agent_output", result.model_dump()) # Changed: Use self.memory
         
         if not flags:
-             self.action_router.trigger_logging_and_close(process_id, {"message": f"PDF processed as {document_type}", "summary": result.model_dump()})
+             await self.action_router.atrigger_logging_and_close(process_id, {"message": f"PDF processed as {document_type}", "summary": result.model_dump()})
 
         return result
@@ -0,0 +1,37 @@
+# File: /multi_agent_system/agents/pdf_text.py
+# Kept free of LangChain/FastAPI imports: this module is loaded by every PDF extraction worker process.
+import io
+import os
+from typing import Union
+
+import PyPDF2
+
+
+def extract_pdf_text(source: Union[bytes, str], max_chars: int) -> str:
+    """
+    Extracts text page by page and stops as soon as `max_chars` characters are collected, so long
+    documents only pay for the pages that are actually sent to the LLM.
+    `source` is either the raw PDF bytes or a path to the PDF file.
+    """
+    parts = []
+    collected = 0
+    try:
+        reader = PyPDF2.PdfReader(io.BytesIO(source) if isinstance(source, bytes) else source)
+        for page in reader.pages:
+            page_text = page.extract_text() or ""
+            parts.append(page_text)
+            collected += len(page_text)
+            if collected >= max_chars:
+                break
+        return "".join(parts)[:max_chars]
+    except PyPDF2.errors.PdfReadError as e:
+        print(f"PDF Agent: Could not read PDF: {e}")
+        return ""
+    except Exception as e:
+        print(f"PDF Agent: An unexpected error occurred during PDF text extraction: {e}")
+        return ""
+
+
+def report_worker_pid(pids) -> None:
+    """Extraction pool initializer: puts the worker's PID on `pids`, so the pool owner can terminate it."""
+    pids.put(os.getpid())
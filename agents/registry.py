@@ -0,0 +1,93 @@
+# File: /multi_agent_system/agents/registry.py
+import asyncio
+import importlib
+import threading
+from typing import Any, Callable, Dict
+
+# The agent modules pull in LangChain, the Gemini SDK and PyPDF2, so they are only imported when an
+# agent is first built (or by `preload_modules`).
+AGENT_MODULES = ("agents.json_agent", "agents.pdf_agent", "agents.email_agent", "agents.classifier_agent")
+
+
+class AgentRegistry:
+    """
+    Builds each agent on first use from the shared dependencies it was given, so importing the app costs
+    neither the agents' imports nor their LLM clients and compiled prompts.
+
+    `aget` builds a missing agent in a worker thread, so the event loop keeps serving (health checks,
+    traces) meanwhile; concurrent first uses wait for one build. `awarm_up` builds all of them up front.
+    `preload_modules` only imports the agent modules without building any client, which is safe before
+    forking workers (gunicorn --preload): the imported code is then shared copy-on-write between them.
+    """
+
+    def __init__(self, memory_instance, action_router_instance, result_cache_instance=None, llm_gateway_instance=None,
+                 schema_registry_instance=None, format_sniffer_instance=None, near_duplicate_index_instance=None):
+        self.memory = memory_instance
+        self.action_router = action_router_instance
+        self.result_cache = result_cache_instance
+        self.llm_gateway = llm_gateway_instance
+        self.schema_registry = schema_registry_instance
+        self.format_sniffer = format_sniffer_instance
+        self.near_duplicates = near_duplicate_index_instance
+        self._agents: Dict[str, Any] = {}
+        self._lock = threading.RLock()
+        self._factories: Dict[str, Callable[[], Any]] = {
+            "classifier": self._build_classifier,
+            "email": self._build_email,
+            "json": self._build_json,
+            "pdf": self._build_pdf,
+        }
+
+    @staticmethod
+    def preload_modules():
+        for module in AGENT_MODULES:
+            importlib.import_module(module)
+
+    def _build_classifier(self):
+        from agents.classifier_agent import ClassifierAgent
+        return ClassifierAgent(memory_instance=self.memory, result_cache_instance=self.result_cache, llm_gateway_instance=self.llm_gateway,
+                               schema_registry_instance=self.schema_registry, format_sniffer_instance=self.format_sniffer,
+                               near_duplicate_index_instance=self.near_duplicates)
+
+    def _build_pdf(self):
+        from agents.pdf_agent import PdfAgent
+        return PdfAgent(memory_instance=self.memory, action_router_instance=self.action_router, result_cache_instance=self.result_cache,
+                        llm_gateway_instance=self.llm_gateway, near_duplicate_index_instance=self.near_duplicates)
+
+    def _build_email(self):
+        from agents.email_agent import EmailAgent
+        # PDF attachments of emails are fanned out to the PDF agent as child processes
+        return EmailAgent(memory_instance=self.memory, action_router_instance=self.action_router, result_cache_instance=self.result_cache,
+                          llm_gateway_instance=self.llm_gateway, pdf_agent_instance=self.get("pdf"))
+
+    def _build_json(self):
+        from agents.json_agent import JsonAgent
+        return JsonAgent(memory_instance=self.memory, action_router_instance=self.action_router, schema_registry_instance=self.schema_registry)
+
+    def get(self, name: str):
+        """The agent called `name` ("classifier", "email", "json" or "pdf"), built now if needed (blocking)."""
+        agent = self._agents.get(name)
+        if agent is None:
+            with self._lock:
+                agent = self._agents.get(name)
+                if agent is None:
+                    agent = self._agents[name] = self._factories[name]()
+        return agent
+
+    async def aget(self, name: str):
+        agent = self._agents.get(name)
+        if agent is not None:
+            return agent
+        return await asyncio.to_thread(self.get, name)
+
+    async def awarm_up(self):
+        """Builds every agent (in a worker thread)."""
+        await asyncio.to_thread(lambda: [self.get(name) for name in self._factories])
+
+    def built(self):
+        return sorted(self._agents)
+
+    def close(self):
+        pdf_agent = self._agents.get("pdf")
+        if pdf_agent is not None:
+            pdf_agent.close()
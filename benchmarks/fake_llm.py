@@ -0,0 +1,125 @@
+# File: /multi_agent_system/benchmarks/fake_llm.py
+import asyncio
+import random
+import re
+import time
+from typing import Any, ClassVar, Dict, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from agents.models import ClassificationResult, EmailContent, InvoiceData, InvoiceLineItem, PdfExtraction, PolicyData
+
+
+def estimate_tokens(text: str) -> int:
+    # Same ~4 characters per token as core.prompts, which is not imported here: the runner must install
+    # this model before anything binds `ChatGoogleGenerativeAI` (the agent modules do on import).
+    return max(1, len(text) // 4)
+
+
+class FakeLLMError(Exception):
+    """Stands in for a transient provider failure (e.g. a 503)."""
+
+    code = 503
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Drop-in replacement for ChatGoogleGenerativeAI in benchmarks: sleeps for a configurable latency
+    (plus jitter), fails at a configurable rate, and answers with a schema-valid JSON document for
+    whichever agent prompt it receives. Reports usage metadata like a real provider would.
+    """
+
+    model: str = "fake"
+    temperature: float = 0.0
+    google_api_key: Optional[str] = None
+    max_retries: int = 6
+    timeout: Optional[float] = None
+
+    # Shared by every instance the agents create; set once by the benchmark runner via `configure`.
+    settings: ClassVar[Dict[str, float]] = {"latency": 0.2, "jitter": 0.05, "error_rate": 0.0}
+    rng: ClassVar[random.Random] = random.Random(0)
+    calls: ClassVar[int] = 0
+
+    @classmethod
+    def configure(cls, latency: float, jitter: float, error_rate: float, seed: int):
+        cls.settings = {"latency": latency, "jitter": jitter, "error_rate": error_rate}
+        cls.rng = random.Random(seed)
+        FakeChatModel.calls = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "benchmark-fake"
+
+    def _delay(self) -> float:
+        jitter = self.settings["jitter"]
+        return max(0.0, self.settings["latency"] + self.rng.uniform(-jitter, jitter))
+
+    def _result(self, messages: List[BaseMessage]) -> ChatResult:
+        FakeChatModel.calls += 1
+        if self.rng.random() < self.settings["error_rate"]:
+            raise FakeLLMError("503 Simulated provider error (UNAVAILABLE)")
+        system = str(messages[0].content)
+        content = str(messages[-1].content)
+        text = answer(system, content)
+        prompt_tokens = sum(estimate_tokens(str(m.content)) for m in messages)
+        message = AIMessage(content=text, usage_metadata={
+            "input_tokens": prompt_tokens, "output_tokens": estimate_tokens(text), "total_tokens": prompt_tokens + estimate_tokens(text)})
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self._delay())
+        return self._result(messages)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self._delay())
+        return self._result(messages)
+
+
+def _intent(text: str) -> str:
+    lowered = text.lower()
+    for intent, words in [("RFQ", ("quotation", "quote", "rfq")), ("Fraud Risk", ("fraud",)),
+                          ("Invoice", ("invoice", "total due")), ("Regulation", ("gdpr", "regulation", "policy", "compliance")),
+                          ("Complaint", ("complaint", "unacceptable", "urgent"))]:
+        if any(word in lowered for word in words):
+            return intent
+    return "Unknown"
+
+
+def answer(system: str, content: str) -> str:
+    """A schema-valid answer for the agent prompt identified by its system message."""
+    # The document is the last part of the human message, after the few-shot examples.
+    document = re.split(r"Now (?:classify|process) the following[^\n]*\n", content)[-1]
+    if "document classifier" in system:
+        snippet = re.sub(r"^Content:\s*", "", document).lstrip()
+        if snippet.startswith("%PDF"):
+            fmt = "PDF"
+        elif snippet.startswith(("{", "[")):
+            fmt = "JSON"
+        elif "From:" in snippet or "Subject:" in snippet:
+            fmt = "Email"
+        else:
+            fmt = "Unknown"
+        return ClassificationResult(format=fmt, intent=_intent(document), confidence=0.9).model_dump_json()
+    if "email processing agent" in system:
+        sender = re.search(r"From:\s*(\S+)", document)
+        escalation = _intent(document) == "Complaint"
+        return EmailContent(
+            sender=sender.group(1) if sender else "Unknown",
+            urgency="High" if escalation else "Low",
+            issue_request=document.strip().splitlines()[1][:80] if len(document.strip().splitlines()) > 1 else "Unknown",
+            tone="Escalation" if escalation else "Polite",
+        ).model_dump_json()
+
+    invoice = InvoiceData(invoice_number="BENCH-001", date="2023-11-27", total_amount=1250.0, currency="USD",
+                          line_items=[InvoiceLineItem(description="Consulting", quantity=1, unit_price=1250.0, total=1250.0)])
+    policy = PolicyData(policy_title="Data Protection Policy", policy_id="POL-001", keywords_found=["GDPR"], summary="Benchmark policy.")
+    # The PDF prompts differ only in their format instructions (the JSON schema of the expected output).
+    if '"document_type"' in system:
+        if _intent(document) == "Invoice":
+            return PdfExtraction(document_type="Invoice", invoice_data=invoice).model_dump_json()
+        return PdfExtraction(document_type="Policy", policy_data=policy).model_dump_json()
+    if '"policy_id"' in system:
+        return policy.model_dump_json()
+    return invoice.model_dump_json()
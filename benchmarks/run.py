@@ -0,0 +1,346 @@
+# File: /multi_agent_system/benchmarks/run.py
+# Load and latency benchmark for /process_input with a stubbed LLM. The app runs in-process (ASGI transport,
+# full lifespan), so results depend only on this code, the Redis backend and the configured fake latency:
+#
+#     python -m benchmarks.run --requests 200 --concurrency 16 --redis none
+#     python -m benchmarks.run --redis fake --baseline benchmarks/baseline.json   # exits 1 on regression
+#
+# Reports p50/p95/p99 latency, throughput, Redis round trips and LLM calls per request, and peak RSS,
+# overall and per input format.
+import argparse
+import asyncio
+import contextlib
+import contextvars
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+from benchmarks.workloads import build_workload, load_samples
+
+# Format of the request being served; Redis round trips and LLM calls made outside any request
+# (action workers, queue consumers) are attributed to "background".
+_current_format: contextvars.ContextVar = contextvars.ContextVar("bench_format", default="background")
+_counters: Dict[str, Dict[str, int]] = defaultdict(lambda: {"redis_round_trips": 0, "llm_calls": 0})
+# Set around the benchmark's own Redis traffic (queue-mode polling, fakeredis block emulation), which is not counted.
+_uncounted: contextvars.ContextVar = contextvars.ContextVar("bench_uncounted", default=False)
+
+# Metrics compared against the baseline: (name, worse when higher?).
+COMPARED_METRICS = [("p95_ms", True), ("p50_ms", True), ("redis_round_trips_per_request", True),
+                    ("llm_calls_per_request", True), ("throughput_rps", False)]
+
+
+def _select_backend(mode: str):
+    """Must run before `main` is imported: SharedMemory creates its clients at import time (and connects at startup)."""
+    import redis
+
+    if mode == "none":
+        import redis.asyncio
+
+        class Unavailable(redis.asyncio.Redis):
+            async def ping(self, *args, **kwargs):
+                raise redis.exceptions.ConnectionError("Redis disabled for this benchmark run")
+        redis.asyncio.Redis = Unavailable
+    elif mode == "fake":
+        try:
+            import fakeredis
+        except ImportError:
+            sys.exit("--redis fake requires the fakeredis package (pip install fakeredis).")
+        import redis.asyncio
+
+        server = fakeredis.FakeServer()
+
+        class FakeSync(fakeredis.FakeRedis):
+            def __init__(self, *args, host=None, port=None, db=None, **kwargs):
+                super().__init__(server=server, **kwargs)
+
+        class FakeAsync(fakeredis.aioredis.FakeRedis):
+            def __init__(self, *args, host=None, port=None, db=None, **kwargs):
+                super().__init__(server=server, **kwargs)
+
+            async def xreadgroup(self, *args, block=None, **kwargs):
+                # fakeredis returns immediately instead of blocking, which would turn idle consumers into busy loops.
+                # Counted as the single round trip a real blocking read costs.
+                deadline = time.monotonic() + (block or 0) / 1000
+                response = await super().xreadgroup(*args, **kwargs)
+                token = _uncounted.set(True)
+                try:
+                    while not (response and response[0][1]) and time.monotonic() < deadline:
+                        await asyncio.sleep(0.01)
+                        response = await super().xreadgroup(*args, **kwargs)
+                finally:
+                    _uncounted.reset(token)
+                return response
+
+        redis.Redis = FakeSync
+        redis.asyncio.Redis = FakeAsync
+
+
+def _count_round_trips():
+    """Counts every command and every pipeline execution as one round trip."""
+    import redis
+    import redis.asyncio
+    import redis.asyncio.client
+
+    def count():
+        if _uncounted.get():
+            return
+        _counters[_current_format.get()]["redis_round_trips"] += 1
+
+    async_execute_command = redis.asyncio.Redis.execute_command
+    async_pipeline_execute = redis.asyncio.client.Pipeline.execute
+    sync_execute_command = redis.Redis.execute_command
+
+    async def execute_command(self, *args, **kwargs):
+        count()
+        return await async_execute_command(self, *args, **kwargs)
+
+    async def pipeline_execute(self, *args, **kwargs):
+        if len(self):
+            count()
+        return await async_pipeline_execute(self, *args, **kwargs)
+
+    def sync_command(self, *args, **kwargs):
+        count()
+        return sync_execute_command(self, *args, **kwargs)
+
+    # Pipelines override execute_command to buffer commands, so only their execute() is counted.
+    redis.asyncio.Redis.execute_command = execute_command
+    redis.asyncio.client.Pipeline.execute = pipeline_execute
+    redis.Redis.execute_command = sync_command
+
+
+def _install_fake_llm(args):
+    import langchain_google_genai
+    from benchmarks import fake_llm
+
+    fake_llm.FakeChatModel.configure(args.llm_latency, args.llm_jitter, args.llm_error_rate, args.seed)
+    original = fake_llm.FakeChatModel._result
+
+    def counted(self, messages):
+        _counters[_current_format.get()]["llm_calls"] += 1
+        return original(self, messages)
+
+    fake_llm.FakeChatModel._result = counted
+    langchain_google_genai.ChatGoogleGenerativeAI = fake_llm.FakeChatModel
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def _summarize(latencies: List[float], errors: int, elapsed: float, round_trips: int, llm_calls: int) -> Dict[str, Any]:
+    count = len(latencies) + errors
+    return {
+        "requests": count,
+        "errors": errors,
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 1),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 1) if latencies else 0.0,
+        "throughput_rps": round(count / elapsed, 2) if elapsed else 0.0,
+        "redis_round_trips_per_request": round(round_trips / count, 2) if count else 0.0,
+        "llm_calls_per_request": round(llm_calls / count, 2) if count else 0.0,
+    }
+
+
+async def _run(args) -> Dict[str, Any]:
+    import httpx
+    import main
+
+    workload = build_workload(load_samples(args.formats), args.requests, args.seed, unique=not args.cache)
+    slots = asyncio.Semaphore(args.concurrency)
+    results: List[Dict[str, Any]] = []
+    failures: List[str] = []
+
+    async def submit(client: httpx.AsyncClient, item: Dict[str, Any]):
+        async with slots:
+            _current_format.set(item["format"])
+            started = time.perf_counter()
+            try:
+                response = await client.post("/process_input", files={"file": (item["name"], item["data"])})
+                if response.status_code == 202:
+                    # Queue mode: the request is done once a consumer wrote the processing summary.
+                    process_id = response.json()["process_id"]
+                    deadline = time.monotonic() + args.request_timeout
+                    while True:
+                        token = _uncounted.set(True)
+                        try:
+                            trace = await client.get(f"/trace/{process_id}")
+                        finally:
+                            _uncounted.reset(token)
+                        if trace.status_code == 200 and "processing_summary" in trace.json()["trace"]:
+                            status = trace.json()["trace"]["processing_summary"]["status"]
+                            break
+                        if time.monotonic() > deadline:
+                            raise TimeoutError(f"not processed within {args.request_timeout}s")
+                        await asyncio.sleep(args.poll_interval)
+                elif response.status_code == 200:
+                    status = response.json()["status"]
+                else:
+                    raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+                ok = "failed" not in status.lower()
+            except Exception as e:
+                failures.append(f"request {item['index']} ({item['name']}): {e}")
+                ok = False
+            results.append({"format": item["format"], "latency": time.perf_counter() - started, "ok": ok})
+
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            # Warm-up requests load templates, pools and lazy clients; they are excluded from the results.
+            for item in build_workload(load_samples(args.formats), args.warmup, args.seed + 1):
+                await submit(client, {**item, "index": f"warmup-{item['index']}"})
+            results.clear()
+            failures.clear()
+            _counters.clear()
+
+            started = time.perf_counter()
+            await asyncio.gather(*(submit(client, item) for item in workload))
+            elapsed = time.perf_counter() - started
+            # Let queued actions finish so their Redis writes are part of the measured cost.
+            await asyncio.sleep(args.settle)
+        redis_backed = main.memory.is_redis_backed
+        startup = main.startup.summary()
+
+    background = _counters.get("background", {"redis_round_trips": 0, "llm_calls": 0})
+    report = {
+        "config": {
+            "requests": args.requests, "concurrency": args.concurrency, "seed": args.seed,
+            "redis": args.redis, "redis_backed": redis_backed, "processing_mode": main.PROCESSING_MODE,
+            "cache": args.cache, "llm_latency": args.llm_latency, "llm_jitter": args.llm_jitter,
+            "llm_error_rate": args.llm_error_rate, "python": platform.python_version(),
+        },
+        "overall": _summarize(
+            [r["latency"] for r in results if r["ok"]], sum(not r["ok"] for r in results), elapsed,
+            sum(c["redis_round_trips"] for c in _counters.values()), sum(c["llm_calls"] for c in _counters.values())),
+        "formats": {},
+        "failures": failures[:10],
+        "background": dict(background),
+        "startup": startup,
+        # ru_maxrss is in KiB on Linux (bytes on macOS); children are the PDF extraction processes.
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1),
+        "peak_rss_children_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1),
+    }
+    for fmt in sorted({r["format"] for r in results}):
+        subset = [r for r in results if r["format"] == fmt]
+        report["formats"][fmt] = _summarize(
+            [r["latency"] for r in subset if r["ok"]], sum(not r["ok"] for r in subset), elapsed,
+            _counters[fmt]["redis_round_trips"], _counters[fmt]["llm_calls"])
+        # Throughput is a whole-run figure; per format it would only restate the mix.
+        del report["formats"][fmt]["throughput_rps"]
+    return report
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Returns one message per metric that is worse than the baseline by more than `tolerance`."""
+    regressions = []
+    sections = [("overall", report["overall"], baseline.get("overall", {}))]
+    sections += [(f"formats.{fmt}", stats, baseline.get("formats", {}).get(fmt, {})) for fmt, stats in report["formats"].items()]
+    for name, current, previous in sections:
+        for metric, higher_is_worse in COMPARED_METRICS:
+            if metric not in current or not previous.get(metric):
+                continue
+            change = (current[metric] - previous[metric]) / previous[metric]
+            if (change if higher_is_worse else -change) > tolerance:
+                regressions.append(f"{name}.{metric}: {previous[metric]} -> {current[metric]} ({change:+.0%})")
+    return regressions
+
+
+def _print_report(report: Dict[str, Any]):
+    config = report["config"]
+    print(f"\nrequests={config['requests']} concurrency={config['concurrency']} redis={config['redis']} "
+          f"(backed={config['redis_backed']}) mode={config['processing_mode']} llm_latency={config['llm_latency']}s")
+    header = f"{'':<10}{'reqs':>6}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'rps':>8}{'redis/req':>11}{'llm/req':>9}"
+    print(header)
+    for name, stats in [("overall", report["overall"])] + sorted(report["formats"].items()):
+        print(f"{name:<10}{stats['requests']:>6}{stats['errors']:>8}{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}"
+              f"{stats.get('throughput_rps', ''):>8}{stats['redis_round_trips_per_request']:>11}{stats['llm_calls_per_request']:>9}")
+    print(f"background: {report['background']['redis_round_trips']} Redis round trips, {report['background']['llm_calls']} LLM calls")
+    for failure in report["failures"]:
+        print(f"failed: {failure}")
+    print(f"peak RSS: {report['peak_rss_mb']} MB (children {report['peak_rss_children_mb']} MB)")
+    startup = report["startup"]
+    print(f"startup: ready after {startup['ready_after_seconds']}s, phases {startup['phases_seconds']}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Load/latency benchmark for /process_input with a stubbed LLM.")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--formats", nargs="*", choices=["email", "json", "pdf"], help="Restrict the mix to these formats.")
+    parser.add_argument("--redis", choices=["auto", "none", "fake"], default="auto",
+                        help="auto: REDIS_HOST (falls back if unreachable); none: in-memory store; fake: fakeredis.")
+    parser.add_argument("--mode", choices=["inline", "queue"], help="PROCESSING_MODE for the run (default: environment).")
+    parser.add_argument("--cache", action="store_true", help="Keep RESULT_CACHE_ENABLED and NEAR_DUPLICATE_ENABLED and repeat identical inputs (cache hits and idempotent replays).")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Seconds per fake LLM call.")
+    parser.add_argument("--llm-jitter", type=float, default=0.05)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--poll-interval", type=float, default=0.05, help="Queue mode: seconds between trace polls.")
+    parser.add_argument("--request-timeout", type=float, default=60.0, help="Queue mode: seconds to wait for a job.")
+    parser.add_argument("--settle", type=float, default=0.5, help="Seconds to let queued actions finish after the run.")
+    parser.add_argument("--verbose", action="store_true", help="Show the application's own output during the run.")
+    parser.add_argument("--json", dest="json_path", help="Write the report to this file.")
+    parser.add_argument("--baseline", help="Compare against this report; exit 1 on regression.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative regression (0.25 = 25%%).")
+    parser.add_argument("--save-baseline", action="store_true", help="Write the report to --baseline instead of comparing.")
+    args = parser.parse_args(argv)
+
+    # Everything below configures the app before it is imported, since its settings are read at import time.
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    if not args.cache:
+        # Unique markers keep inputs distinct, but the samples stay near-copies of each other.
+        os.environ["RESULT_CACHE_ENABLED"] = "false"
+        os.environ["NEAR_DUPLICATE_ENABLED"] = "false"
+    if args.mode:
+        os.environ["PROCESSING_MODE"] = args.mode
+    # Queue mode is measured end to end in this process, so the API process also consumes the job stream.
+    os.environ["RUN_JOB_WORKER"] = "true"
+    _select_backend(args.redis)
+    _count_round_trips()
+    _install_fake_llm(args)
+
+    # The agents print per request; silenced by default so the report is readable.
+    with contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w")):
+        report = asyncio.run(_run(args))
+    _print_report(report)
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+    elif args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        mismatched = [key for key in ("requests", "concurrency", "redis", "processing_mode", "llm_latency", "cache")
+                      if baseline.get("config", {}).get(key) != report["config"][key]]
+        if mismatched:
+            print(f"\nWarning: run differs from the baseline in {', '.join(mismatched)}; the comparison is not like for like.")
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\nRegressions beyond {args.tolerance:.0%} of {args.baseline}:")
+            for message in regressions:
+                print(f"  {message}")
+            return 1
+        print(f"\nNo regressions beyond {args.tolerance:.0%} of {args.baseline}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
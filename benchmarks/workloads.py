@@ -0,0 +1,60 @@
+# File: /multi_agent_system/benchmarks/workloads.py
+import os
+import random
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+SAMPLES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "samples")
+
+
+@dataclass
+class Sample:
+    name: str
+    format: str  # "email", "json" or "pdf"; the per-format breakdown in the report
+    weight: float
+    data: bytes
+
+
+# (file, format, weight): the default mix is mostly emails and webhooks, with fewer, heavier PDFs.
+DEFAULT_MIX = [
+    ("complaint_email.txt", "email", 3),
+    ("rfq_email.txt", "email", 2),
+    ("webhook_data.json", "json", 4),
+    ("invoice.pdf", "pdf", 1),
+    ("regulation.pdf", "pdf", 1),
+]
+
+
+def load_samples(formats: Optional[List[str]] = None) -> List[Sample]:
+    samples = []
+    for filename, fmt, weight in DEFAULT_MIX:
+        if formats and fmt not in formats:
+            continue
+        with open(os.path.join(SAMPLES_DIR, filename), "rb") as f:
+            samples.append(Sample(filename, fmt, weight, f.read()))
+    return samples
+
+
+def make_unique(sample: Sample, index: int) -> bytes:
+    """
+    Returns the sample with a per-request marker, so result/text caches and request dedup never turn a
+    run into cache hits (pass --cache to measure the cached path instead).
+    """
+    if sample.format == "pdf":
+        # Bytes after %%EOF are ignored by PDF readers but change the content hash.
+        return sample.data + f"\n% bench-{index}\n".encode()
+    if sample.format == "json":
+        body = sample.data.strip()
+        return body[:-1].rstrip() + f',\n  "bench_ref": "bench-{index}"\n}}'.encode()
+    return sample.data.rstrip() + f"\n\nRef: bench-{index}\n".encode()
+
+
+def build_workload(samples: List[Sample], requests: int, seed: int, unique: bool = True) -> List[Dict]:
+    """A deterministic, weighted sequence of `requests` inputs."""
+    rng = random.Random(seed)
+    picks = rng.choices(samples, weights=[sample.weight for sample in samples], k=requests)
+    return [
+        {"index": i, "name": sample.name, "format": sample.format,
+         "data": make_unique(sample, i) if unique else sample.data}
+        for i, sample in enumerate(picks)
+    ]
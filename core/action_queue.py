@@ -0,0 +1,266 @@
+# File: /multi_agent_system/core/action_queue.py
+import asyncio
+import json
+import os
+import socket
+import time
+import uuid
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from core import telemetry
+
+# handler(action_type, actions) -> one result dict per action; called once per same-type batch.
+BatchHandler = Callable[[str, List[Dict[str, Any]]], Awaitable[List[Dict[str, Any]]]]
+
+# Actions collected inside `ActionQueue.batched()`, appended to the outbox together on exit.
+_pending_actions: ContextVar[Optional[List[Dict[str, Any]]]] = ContextVar("pending_actions", default=None)
+
+
+def _parse_limits(spec: str) -> Dict[str, int]:
+    """Parses "CRM_Escalation=2,Risk_Alert=4" into {"CRM_Escalation": 2, "Risk_Alert": 4}."""
+    limits = {}
+    for item in spec.split(","):
+        if "=" in item:
+            action_type, limit = item.split("=", 1)
+            limits[action_type.strip()] = int(limit)
+    return limits
+
+
+class ActionQueue:
+    """
+    Outbox for follow-up actions, drained by a pool of worker tasks.
+
+    Actions are appended to a Redis Stream (consumed through a consumer group, acknowledged only after
+    they finish, and reclaimed from dead consumers) or, without Redis, to an in-process asyncio queue.
+    Workers read actions in batches, group them by type, run each group under that type's concurrency
+    limit with retries, and write the final status to the process trace as `action_triggered:{type}`.
+    """
+
+    STREAM_KEY = "actions:outbox"
+    GROUP_NAME = "action-workers"
+
+    def __init__(self, memory_instance, handler: BatchHandler):
+        self.memory = memory_instance
+        self.handler = handler
+        self.workers = int(os.getenv("ACTION_WORKERS", "4"))
+        self.batch_size = int(os.getenv("ACTION_BATCH_SIZE", "16"))
+        self.max_attempts = int(os.getenv("ACTION_MAX_ATTEMPTS", "3"))
+        self.retry_backoff = float(os.getenv("ACTION_RETRY_BACKOFF_SECONDS", "0.5"))
+        self.claim_idle_ms = int(os.getenv("ACTION_CLAIM_IDLE_MS", "60000"))
+        self.stream_maxlen = int(os.getenv("ACTION_STREAM_MAXLEN", "100000"))
+        self.drain_timeout = float(os.getenv("ACTION_DRAIN_TIMEOUT_SECONDS", "5"))
+        self.default_concurrency = int(os.getenv("ACTION_DEFAULT_CONCURRENCY", "4"))
+        self.type_concurrency = _parse_limits(os.getenv("ACTION_TYPE_CONCURRENCY", ""))
+        self.consumer_name = f"{socket.gethostname()}-{os.getpid()}"
+        self._limits: Dict[str, asyncio.Semaphore] = {}
+        self._local_queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+        self.counters = {"enqueued": 0, "completed": 0, "failed": 0, "retried": 0, "batches": 0}
+
+    @property
+    def redis(self):
+        return self.memory.async_redis_client
+
+    def _limit(self, action_type: str) -> asyncio.Semaphore:
+        if action_type not in self._limits:
+            self._limits[action_type] = asyncio.Semaphore(self.type_concurrency.get(action_type, self.default_concurrency))
+        return self._limits[action_type]
+
+    def _queue(self) -> asyncio.Queue:
+        if self._local_queue is None:
+            self._local_queue = asyncio.Queue()
+        return self._local_queue
+
+    async def aenqueue(self, process_id: str, action_type: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Appends the action to the outbox and records it as `action_queued:{type}` in the trace.
+
+        The queued record uses its own key because request-scoped trace writes are flushed after the
+        handler returns, possibly after a worker has already written the completed status.
+        """
+        action = {
+            "action_id": uuid.uuid4().hex,
+            "process_id": process_id,
+            "action_type": action_type,
+            "payload": payload,
+            "enqueued_at": time.time(),
+        }
+        status = {"action_id": action["action_id"], "status": "queued", "enqueued_at": action["enqueued_at"]}
+        pending = _pending_actions.get()
+        if pending is not None:
+            pending.append(action)
+            await self.memory.aadd_entry(process_id, f"action_queued:{action_type}", status)
+            return status
+        try:
+            with telemetry.span("action_enqueue", "actions"):
+                if self.redis:
+                    fields = {key: json.dumps(value) for key, value in action.items()}
+                    await self.redis.xadd(self.STREAM_KEY, fields, maxlen=self.stream_maxlen, approximate=True)
+                else:
+                    self._queue().put_nowait(action)
+            self.counters["enqueued"] += 1
+        except Exception as e:
+            print(f"ActionQueue: Could not enqueue {action_type} for {process_id}: {e}")
+            status = {**status, "status": "enqueue_failed", "error": str(e)}
+        await self.memory.aadd_entry(process_id, f"action_queued:{action_type}", status)
+        return status
+
+    @asynccontextmanager
+    async def batched(self):
+        """
+        Collects the actions enqueued inside the block (by this task and the tasks it spawns) and
+        appends them in one pipeline on exit. Their trace entries say "queued" right away; any that
+        cannot be appended are rewritten as "enqueue_failed". Use inside `SharedMemory.buffered()`
+        so those corrections are flushed with the rest of the trace.
+        """
+        actions: List[Dict[str, Any]] = []
+        token = _pending_actions.set(actions)
+        try:
+            yield
+        finally:
+            _pending_actions.reset(token)
+            if actions:
+                await self._aenqueue_many(actions)
+
+    async def _aenqueue_many(self, actions: List[Dict[str, Any]]):
+        try:
+            with telemetry.span("action_enqueue_batch", "actions"):
+                if self.redis:
+                    pipe = self.redis.pipeline(transaction=False)
+                    for action in actions:
+                        pipe.xadd(self.STREAM_KEY, {key: json.dumps(value) for key, value in action.items()},
+                                  maxlen=self.stream_maxlen, approximate=True)
+                    await pipe.execute()
+                else:
+                    for action in actions:
+                        self._queue().put_nowait(action)
+            self.counters["enqueued"] += len(actions)
+        except Exception as e:
+            print(f"ActionQueue: Could not enqueue a batch of {len(actions)} action(s): {e}")
+            for action in actions:
+                await self.memory.aadd_entry(action["process_id"], f"action_queued:{action['action_type']}", {
+                    "action_id": action["action_id"], "status": "enqueue_failed", "enqueued_at": action["enqueued_at"], "error": str(e)})
+
+    # --- Workers ---
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._stopping = False
+        if self.redis:
+            try:
+                await self.redis.xgroup_create(self.STREAM_KEY, self.GROUP_NAME, id="0", mkstream=True)
+            except Exception as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Stops the workers. The in-process queue is drained first (bounded by ACTION_DRAIN_TIMEOUT_SECONDS);
+        unacknowledged Redis entries stay pending and are reclaimed by the next consumer."""
+        if not self.redis and self._local_queue is not None:
+            try:
+                await asyncio.wait_for(self._local_queue.join(), timeout=self.drain_timeout)
+            except asyncio.TimeoutError:
+                print(f"ActionQueue: {self._local_queue.qsize()} queued action(s) dropped at shutdown")
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _read_batch(self) -> List[tuple]:
+        """Returns [(message_id, action)], waiting up to a second for the first action."""
+        if not self.redis:
+            queue = self._queue()
+            try:
+                actions = [await asyncio.wait_for(queue.get(), timeout=1.0)]
+            except asyncio.TimeoutError:
+                return []
+            while len(actions) < self.batch_size and not queue.empty():
+                actions.append(queue.get_nowait())
+            return [(None, action) for action in actions]
+
+        response = await self.redis.xreadgroup(
+            self.GROUP_NAME, self.consumer_name, {self.STREAM_KEY: ">"}, count=self.batch_size, block=1000)
+        messages = response[0][1] if response else []
+        if not messages:
+            # Idle: take over entries a crashed or restarted consumer left unacknowledged.
+            claimed = await self.redis.xautoclaim(
+                self.STREAM_KEY, self.GROUP_NAME, self.consumer_name, self.claim_idle_ms, start_id="0-0", count=self.batch_size)
+            messages = claimed[1]
+        return [(message_id, {key: json.loads(value) for key, value in fields.items()})
+                for message_id, fields in messages if fields]
+
+    async def _worker(self):
+        while not self._stopping:
+            try:
+                batch = await self._read_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"ActionQueue: Failed to read actions: {e}")
+                await asyncio.sleep(1.0)
+                continue
+            if not batch:
+                continue
+
+            by_type = defaultdict(list)
+            for message_id, action in batch:
+                by_type[action["action_type"]].append(action)
+            # Groups never raise (failures are recorded per action), so the batch is acknowledged
+            # only once every action in it reached a final status.
+            await asyncio.gather(*(self._run_group(action_type, actions) for action_type, actions in by_type.items()))
+            if not self.redis:
+                for _ in batch:
+                    self._local_queue.task_done()
+                continue
+            try:
+                await self.redis.xack(self.STREAM_KEY, self.GROUP_NAME, *[message_id for message_id, _ in batch])
+            except Exception as e:
+                print(f"ActionQueue: Failed to acknowledge {len(batch)} action(s): {e}")
+
+    async def _run_group(self, action_type: str, actions: List[Dict[str, Any]]):
+        self.counters["batches"] += 1
+        error = None
+        async with self._limit(action_type):
+            started = time.perf_counter()
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    results = await self.handler(action_type, actions)
+                    break
+                except Exception as e:
+                    error = e
+                    if attempt < self.max_attempts:
+                        self.counters["retried"] += 1
+                        await asyncio.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            else:
+                print(f"ActionQueue: {action_type} failed after {self.max_attempts} attempts: {error}")
+                results = None
+            telemetry.record_action(action_type, "failed" if results is None else "completed", time.perf_counter() - started, len(actions))
+
+        for i, action in enumerate(actions):
+            entry = {
+                "action_id": action["action_id"],
+                "payload": action["payload"],
+                "attempts": attempt,
+                "latency_seconds": round(time.time() - action["enqueued_at"], 3),
+            }
+            if results is None:
+                entry.update(status="failed", error=str(error))
+                self.counters["failed"] += 1
+            else:
+                entry.update(status="completed", result=results[i])
+                self.counters["completed"] += 1
+            await self.memory.aadd_entry(action["process_id"], f"action_triggered:{action_type}", entry)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "redis_stream" if self.redis else "in_process",
+            "workers": len(self._tasks),
+            "local_depth": self._local_queue.qsize() if self._local_queue is not None else 0,
+            **self.counters,
+        }
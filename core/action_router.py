@@ -1,32 +1,43 @@
 # File: /multi_agent_system/core/action_router.py
-import time
-from typing import Dict, Any
+import asyncio
+from typing import Dict, Any, List
+from core.action_queue import ActionQueue
 
 class ActionRouter:
     def __init__(self, memory_instance): # Now requires memory_instance to be passed
         self.memory = memory_instance
+        # Triggers only enqueue; the queue's workers call the downstream APIs and record the outcome.
+        self.queue = ActionQueue(memory_instance, handler=self._simulate_api_calls)
 
-    def _simulate_api_call(self, process_id: str, action_type: str, payload: Dict[str, Any]):
-        print(f"ActionRouter: Simulating {action_type} call with payload: {payload}")
-        time.sleep(0.1)
-        result = {"status": "success", "message": f"{action_type} triggered successfully"}
-        self.memory.add_entry(process_id, f"action_triggered:{action_type}", {"payload": payload, "result": result})
-        return result
+    async def _simulate_api_calls(self, action_type: str, actions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # One downstream call per batch of same-type actions.
+        print(f"ActionRouter: Simulating {action_type} call for {len(actions)} action(s) with payloads: {[action['payload'] for action in actions]}")
+        await asyncio.sleep(0.1)
+        return [{"status": "success", "message": f"{action_type} triggered successfully"} for _ in actions]
 
-    def trigger_crm_escalation(self, process_id: str, issue_details: Dict[str, Any]):
-        return self._simulate_api_call(process_id, "CRM_Escalation", issue_details)
+    async def _dispatch(self, process_id: str, action_type: str, payload: Dict[str, Any]):
+        return await self.queue.aenqueue(process_id, action_type, payload)
 
-    def trigger_risk_alert(self, process_id: str, risk_details: Dict[str, Any]):
-        return self._simulate_api_call(process_id, "Risk_Alert", risk_details)
+    async def start(self):
+        await self.queue.start()
 
-    def trigger_compliance_flag(self, process_id: str, compliance_details: Dict[str, Any]):
-        return self._simulate_api_call(process_id, "Compliance_Flag", compliance_details)
+    async def stop(self):
+        await self.queue.stop()
 
-    def trigger_summary_generation(self, process_id: str, summary_data: Dict[str, Any]):
-        return self._simulate_api_call(process_id, "Summary_Generation", summary_data)
+    async def atrigger_crm_escalation(self, process_id: str, issue_details: Dict[str, Any]):
+        return await self._dispatch(process_id, "CRM_Escalation", issue_details)
 
-    def trigger_logging_and_close(self, process_id: str, log_data: Dict[str, Any]):
-        return self._simulate_api_call(process_id, "Log_and_Close", log_data)
+    async def atrigger_risk_alert(self, process_id: str, risk_details: Dict[str, Any]):
+        return await self._dispatch(process_id, "Risk_Alert", risk_details)
 
-    def trigger_anomaly_alert(self, process_id: str, anomaly_details: Dict[str, Any]):
-        return self._simulate_api_call(process_id, "Anomaly_Alert", anomaly_details)
\ No newline at end of file
+    async def atrigger_compliance_flag(self, process_id: str, compliance_details: Dict[str, Any]):
+        return await self._dispatch(process_id, "Compliance_Flag", compliance_details)
+
+    async def atrigger_summary_generation(self, process_id: str, summary_data: Dict[str, Any]):
+        return await self._dispatch(process_id, "Summary_Generation", summary_data)
+
+    async def atrigger_logging_and_close(self, process_id: str, log_data: Dict[str, Any]):
+        return await self._dispatch(process_id, "Log_and_Close", log_data)
+
+    async def atrigger_anomaly_alert(self, process_id: str, anomaly_details: Dict[str, Any]):
+        return await self._dispatch(process_id, "Anomaly_Alert", anomaly_details)
@@ -0,0 +1,49 @@
+# File: /multi_agent_system/core/deadline.py
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+# Time budget for processing one document (classification, agent, LLM retries), in seconds.
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "60"))
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a stage starts (or would have to wait) after the current request's deadline."""
+
+
+# time.monotonic() by which the current request must finish; None outside any request.
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+@contextmanager
+def scope(seconds: float = REQUEST_DEADLINE_SECONDS) -> Iterator[float]:
+    """Sets a deadline `seconds` from now for the block (and tasks it spawns); a tighter enclosing one wins."""
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None:
+        deadline = min(deadline, current)
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the deadline (may be negative), or None when no deadline is set."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check(stage: str):
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"Request deadline exceeded before {stage} ({-left:.2f}s over)")
+
+
+def cap(timeout: float) -> float:
+    """`timeout` shortened to the time left before the deadline."""
+    left = remaining()
+    return timeout if left is None else max(min(timeout, left), 0.0)
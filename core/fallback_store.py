@@ -0,0 +1,183 @@
+# File: /multi_agent_system/core/fallback_store.py
+import base64
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+
+class _Trace:
+    __slots__ = ("entries", "size", "expires_at")
+
+    def __init__(self, expires_at: float):
+        self.entries: Dict[str, bytes] = {}
+        self.size = 0
+        self.expires_at = expires_at
+
+
+class FallbackStore:
+    """
+    In-process trace store used by SharedMemory when Redis is unreachable.
+
+    Traces are indexed by process ID, so a lookup touches only that process's entries. Resident
+    traces are bounded by a byte budget (least recently used evicted first; the trace just written
+    or read always stays, even when it alone exceeds the budget) and expire after a TTL.
+    With a `spill_path`, evicted traces (and everything resident at shutdown) are written to a
+    SQLite file and read back on demand, so they survive restarts. A row stays in the file while its
+    trace is resident again, until the trace is re-spilled (replacing it) or expires.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl_seconds: int = 604800, spill_path: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.spill_path = spill_path
+        self._traces: "OrderedDict[str, _Trace]" = OrderedDict()
+        self.resident_bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.spilled = 0
+        self._db = None
+        if spill_path:
+            os.makedirs(os.path.dirname(os.path.abspath(spill_path)), exist_ok=True)
+            self._db = sqlite3.connect(spill_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS traces (process_id TEXT PRIMARY KEY, entries TEXT NOT NULL, expires_at REAL NOT NULL)")
+            self._db.execute("DELETE FROM traces WHERE expires_at < ?", (time.time(),))
+            self._db.commit()
+
+    @staticmethod
+    def _entry_size(key: str, value: bytes) -> int:
+        return len(key) + len(value)
+
+    def _load(self, process_id: str) -> Optional[_Trace]:
+        trace = self._traces.get(process_id)
+        if trace is not None:
+            if trace.expires_at < time.time():
+                self._drop(process_id)
+                self._delete_spilled(process_id)
+                self.expirations += 1
+                return None
+            self._traces.move_to_end(process_id)
+            return trace
+        if self._db is None:
+            return None
+
+        row = self._db.execute("SELECT entries, expires_at FROM traces WHERE process_id = ?", (process_id,)).fetchone()
+        if row is None:
+            return None
+        if row[1] < time.time():
+            self._delete_spilled(process_id)
+            self.expirations += 1
+            return None
+        trace = _Trace(expires_at=row[1])
+        stored = json.loads(row[0])
+        if "$base64" in stored:
+            entries = {key: base64.b64decode(value) for key, value in stored["$base64"].items()}
+        else:
+            entries = stored  # written by releases that stored entries as JSON text
+        for key, value in entries.items():
+            trace.entries[key] = value
+            trace.size += self._entry_size(key, value)
+        self._traces[process_id] = trace
+        self.resident_bytes += trace.size
+        self._evict()
+        return self._traces.get(process_id)
+
+    def _drop(self, process_id: str) -> Optional[_Trace]:
+        trace = self._traces.pop(process_id, None)
+        if trace is not None:
+            self.resident_bytes -= trace.size
+        return trace
+
+    def _delete_spilled(self, process_id: str):
+        if self._db is not None:
+            self._db.execute("DELETE FROM traces WHERE process_id = ?", (process_id,))
+            self._db.commit()
+
+    def _spill(self, process_id: str, trace: _Trace):
+        if self._db is None:
+            return
+        self._db.execute(
+            "INSERT OR REPLACE INTO traces (process_id, entries, expires_at) VALUES (?, ?, ?)",
+            (process_id, json.dumps({"$base64": {key: base64.b64encode(value).decode("ascii") for key, value in trace.entries.items()}}), trace.expires_at)
+        )
+        self.spilled += 1
+
+    def _evict(self):
+        now = time.time()
+        spilled_any = False
+        # The newest trace is never evicted: without a spill file that would lose the write just made.
+        while len(self._traces) > 1 and self.resident_bytes > self.max_bytes:
+            process_id, trace = next(iter(self._traces.items()))
+            self._drop(process_id)
+            if trace.expires_at < now:
+                self._delete_spilled(process_id)
+                self.expirations += 1
+                continue
+            self.evictions += 1
+            if self._db is not None:
+                self._spill(process_id, trace)
+                spilled_any = True
+        if spilled_any:
+            self._db.commit()
+
+    def set_entries(self, process_id: str, mapping: Dict[str, bytes]):
+        trace = self._load(process_id)
+        if trace is None:
+            trace = _Trace(expires_at=0)
+            self._traces[process_id] = trace
+        trace.expires_at = time.time() + self.ttl_seconds
+        for key, value in mapping.items():
+            old = trace.entries.get(key)
+            delta = self._entry_size(key, value) - (self._entry_size(key, old) if old is not None else 0)
+            trace.entries[key] = value
+            trace.size += delta
+            self.resident_bytes += delta
+        self._evict()
+
+    def delete_entries(self, process_id: str, keys: List[str]):
+        trace = self._load(process_id)
+        if trace is None:
+            return
+        for key in keys:
+            old = trace.entries.pop(key, None)
+            if old is not None:
+                size = self._entry_size(key, old)
+                trace.size -= size
+                self.resident_bytes -= size
+
+    def get_entry(self, process_id: str, key: str) -> Optional[bytes]:
+        trace = self._load(process_id)
+        return trace.entries.get(key) if trace else None
+
+    def get_entries(self, process_id: str) -> Dict[str, bytes]:
+        trace = self._load(process_id)
+        return dict(trace.entries) if trace else {}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "in_memory",
+            "resident_processes": len(self._traces),
+            "resident_bytes": self.resident_bytes,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "spilled": self.spilled,
+            "spill_path": self.spill_path,
+        }
+
+    def close(self):
+        """Spills every resident trace (when spilling is enabled) so it survives a restart."""
+        if self._db is None:
+            return
+        now = time.time()
+        for process_id, trace in self._traces.items():
+            if trace.expires_at >= now:
+                self._spill(process_id, trace)
+            else:
+                self._db.execute("DELETE FROM traces WHERE process_id = ?", (process_id,))
+        self._db.commit()
+        self._db.close()
+        self._db = None
@@ -0,0 +1,145 @@
+# File: /multi_agent_system/core/idempotency.py
+import asyncio
+import hashlib
+import json
+import time
+from typing import Any, Dict, Optional
+
+from core.result_cache import LRUTTLCache
+
+
+class IdempotencyConflict(Exception):
+    """The Idempotency-Key was already used for a different payload."""
+
+
+class IdempotencyClaim:
+    """Held by the request that processes a key first; repeats of the key wait for it."""
+
+    def __init__(self, key: str, process_id: str, record: str):
+        self.key = key
+        self.process_id = process_id
+        self.record = record
+
+
+class IdempotencyStore:
+    """
+    Maps repeated submissions of a document to the process that handled the first one.
+
+    The key is the client's `Idempotency-Key` header, or else the SHA-256 of the payload. The first
+    request claims it with SET NX, in Redis (shared by every worker) or in a local LRU without Redis,
+    recording its process_id; repeats get that process_id back instead of a new one. A repeat that
+    arrives while the original is still running waits for it (single-flight): on a local future
+    when the original runs in this process, otherwise by watching the original trace until its
+    `processing_summary` is written. If the original fails, its claim is released and the next
+    repeat processes the document itself.
+    """
+
+    KEY_PREFIX = "idempotency"
+
+    def __init__(self, memory_instance, ttl_seconds: int = 86400, content_ttl_seconds: int = 600,
+                 wait_timeout_seconds: float = 60.0, poll_interval_seconds: float = 0.5, max_local_entries: int = 10000):
+        self.memory = memory_instance
+        self.ttl_seconds = ttl_seconds
+        self.content_ttl_seconds = content_ttl_seconds
+        self.wait_timeout_seconds = wait_timeout_seconds
+        self.poll_interval_seconds = poll_interval_seconds
+        # Without Redis: key -> (record, expires_at); the LRU bounds memory, expires_at the shorter content TTL.
+        self.local = LRUTTLCache(max_entries=max_local_entries, ttl_seconds=max(ttl_seconds, content_ttl_seconds))
+        # Keys claimed by requests running in this process -> future resolved when they finish.
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.counters = {"claimed": 0, "replayed": 0, "coalesced": 0, "conflicts": 0, "released": 0}
+
+    def make_key(self, header_key: Optional[str], content_hash: str) -> Dict[str, str]:
+        """The storage key and its source ("header" or "content")."""
+        if header_key:
+            # Hashed so arbitrary client strings make bounded, safe Redis keys.
+            digest = hashlib.sha256(header_key.encode("utf-8")).hexdigest()
+            return {"key": f"{self.KEY_PREFIX}:header:{digest}", "source": "header"}
+        return {"key": f"{self.KEY_PREFIX}:content:{content_hash}", "source": "content"}
+
+    async def aclaim(self, key: str, source: str, process_id: str, content_hash: str):
+        """
+        Returns an `IdempotencyClaim` when this request should process the document, or the original
+        request's record ({"process_id", "content_hash", "created_at"}) when it is a repeat.
+        Raises `IdempotencyConflict` when a header key is reused with different content.
+        """
+        record = json.dumps({"process_id": process_id, "content_hash": content_hash, "created_at": time.time()})
+        ttl = self.ttl_seconds if source == "header" else self.content_ttl_seconds
+        if self.memory.is_redis_backed:
+            existing = await self.memory.aclaim_cache_value(key, record, ttl)
+        else:
+            item = self.local.get(key)
+            existing = item[0] if item is not None and item[1] > time.monotonic() else None
+            if existing is None:
+                self.local.set(key, (record, time.monotonic() + ttl))
+        if existing is None:
+            self.counters["claimed"] += 1
+            self._inflight[key] = asyncio.get_running_loop().create_future()
+            return IdempotencyClaim(key, process_id, record)
+        original = json.loads(existing)
+        if original["content_hash"] != content_hash:
+            self.counters["conflicts"] += 1
+            raise IdempotencyConflict("Idempotency-Key was already used with a different payload.")
+        self.counters["replayed"] += 1
+        return original
+
+    def complete(self, claim: IdempotencyClaim):
+        """Marks the claimed request finished; its key keeps mapping to its process_id until the TTL."""
+        future = self._inflight.pop(claim.key, None)
+        if future is not None and not future.done():
+            future.set_result(True)
+
+    async def arelease(self, claim: IdempotencyClaim):
+        """Gives the key up after a failure, so the next repeat is processed instead of replayed."""
+        self.counters["released"] += 1
+        future = self._inflight.pop(claim.key, None)
+        if future is not None and not future.done():
+            future.set_result(False)
+        try:
+            if self.memory.is_redis_backed:
+                await self.memory.adelete_cache_value(claim.key, claim.record)
+            else:
+                item = self.local.get(claim.key)
+                if item is not None and item[0] == claim.record:
+                    self.local.set(claim.key, (claim.record, 0.0))  # expired: the next claim overwrites it
+        except Exception as e:
+            print(f"IdempotencyStore: Failed to release {claim.key}: {e}")
+
+    async def await_original(self, key: str, process_id: str) -> bool:
+        """
+        Waits for the original request to finish: True once it has, False if it failed (or its claim
+        expired) without a result. Raises asyncio.TimeoutError after `wait_timeout_seconds`.
+        """
+        self.counters["coalesced"] += 1
+        future = self._inflight.get(key)
+        if future is not None:
+            return await asyncio.wait_for(asyncio.shield(future), timeout=self.wait_timeout_seconds)
+        return await asyncio.wait_for(self._await_trace(key, process_id), timeout=self.wait_timeout_seconds)
+
+    async def _await_trace(self, key: str, process_id: str) -> bool:
+        # The original runs in another worker. Its trace events wake us up; the poll covers
+        # deployments with trace events disabled and a claim dropped after a failure.
+        async with self.memory.events.subscribe(process_id) as queue:
+            while True:
+                if await self.memory.aget_entry(process_id, "processing_summary") is not None:
+                    return True
+                if not await self._is_claimed(key, process_id):
+                    return await self.memory.aget_entry(process_id, "processing_summary") is not None
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=self.poll_interval_seconds)
+                    while "processing_summary" not in json.loads(message)["entries"]:
+                        message = await asyncio.wait_for(queue.get(), timeout=self.poll_interval_seconds)
+                    return True
+                except asyncio.TimeoutError:
+                    continue
+
+    async def _is_claimed(self, key: str, process_id: str) -> bool:
+        if self.memory.is_redis_backed:
+            raw = await self.memory.aget_cache_value(key)
+        else:
+            item = self.local.get(key)
+            raw = item[0] if item is not None and item[1] > time.monotonic() else None
+        return raw is not None and json.loads(raw)["process_id"] == process_id
+
+    def stats(self) -> Dict[str, Any]:
+        return {"in_flight": len(self._inflight), **self.counters}
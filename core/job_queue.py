@@ -0,0 +1,195 @@
+# File: /multi_agent_system/core/job_queue.py
+import asyncio
+import json
+import os
+import socket
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from core.uploads import InputDocument
+
+# handler(process_id, document, job) -> processing status; owns nothing (the queue closes the document).
+JobHandler = Callable[[str, InputDocument, Dict[str, Any]], Awaitable[str]]
+
+
+class JobQueue:
+    """
+    Queue of documents awaiting classification and extraction.
+
+    With Redis, the payload is stored under `job:payload:{process_id}` and the job appended to the
+    `jobs:documents` stream in one pipeline; any number of worker processes (`worker.py`) consume it
+    through a consumer group. A job is acknowledged only after it finished, jobs left pending by a
+    crashed worker are reclaimed after `JOB_CLAIM_IDLE_MS`, and a job delivered more than
+    `JOB_MAX_DELIVERIES` times is recorded as failed instead of being retried forever.
+    Without Redis, jobs (and their already-spooled documents) go to an in-process queue consumed by
+    the API process itself.
+    """
+
+    STREAM_KEY = "jobs:documents"
+    GROUP_NAME = "document-workers"
+    PAYLOAD_KEY_PREFIX = "job:payload:"
+    DELIVERIES_KEY_PREFIX = "job:deliveries:"
+
+    def __init__(self, memory_instance, handler: JobHandler):
+        self.memory = memory_instance
+        self.handler = handler
+        self.concurrency = int(os.getenv("JOB_CONCURRENCY", "8"))
+        # Jobs claimed from the stream ahead of a free slot; the rest stay available to other workers.
+        self.prefetch = max(int(os.getenv("JOB_PREFETCH", "16")), self.concurrency)
+        self.claim_idle_ms = int(os.getenv("JOB_CLAIM_IDLE_MS", "300000"))
+        self.max_deliveries = int(os.getenv("JOB_MAX_DELIVERIES", "3"))
+        self.payload_ttl_seconds = int(os.getenv("JOB_PAYLOAD_TTL_SECONDS", "86400"))
+        self.consumer_name = f"{socket.gethostname()}-{os.getpid()}"
+        self._local_queue: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._in_flight: Set[asyncio.Task] = set()
+        self._runner: Optional[asyncio.Task] = None
+        self.counters = {"enqueued": 0, "completed": 0, "failed": 0, "reclaimed": 0}
+
+    @property
+    def redis(self):
+        return self.memory.async_blob_client
+
+    def _queue(self) -> asyncio.Queue:
+        if self._local_queue is None:
+            self._local_queue = asyncio.Queue()
+        return self._local_queue
+
+    async def aenqueue(self, process_id: str, document: InputDocument, job: Dict[str, Any]):
+        """Queues `document` for processing. The queue takes ownership of (and eventually closes) it."""
+        job = {**job, "process_id": process_id, "enqueued_at": time.time()}
+        if not self.redis:
+            self._queue().put_nowait((job, document))
+            self.counters["enqueued"] += 1
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.set(f"{self.PAYLOAD_KEY_PREFIX}{process_id}", document.as_bytes(), ex=self.payload_ttl_seconds)
+            pipe.xadd(self.STREAM_KEY, {"job": json.dumps(job)})
+            await pipe.execute()
+            self.counters["enqueued"] += 1
+        finally:
+            document.close()
+
+    # --- Consumers ---
+
+    async def start(self):
+        """Consumes jobs in the background on this process's event loop."""
+        if self._runner is None:
+            self._runner = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._runner is not None:
+            self._runner.cancel()
+            await asyncio.gather(self._runner, return_exceptions=True)
+            self._runner = None
+
+    async def run(self):
+        """Consumes jobs until cancelled, keeping at most `prefetch` claimed and `concurrency` running."""
+        self._slots = asyncio.Semaphore(self.concurrency)
+        if self.redis:
+            try:
+                await self.redis.xgroup_create(self.STREAM_KEY, self.GROUP_NAME, id="0", mkstream=True)
+            except Exception as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+        try:
+            while True:
+                if len(self._in_flight) >= self.prefetch:
+                    await asyncio.wait(self._in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                try:
+                    jobs = await self._read(self.prefetch - len(self._in_flight))
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"JobQueue: Failed to read jobs: {e}")
+                    await asyncio.sleep(1.0)
+                    continue
+                for message_id, job, document in jobs:
+                    task = asyncio.create_task(self._run_job(message_id, job, document))
+                    self._in_flight.add(task)
+                    task.add_done_callback(self._in_flight.discard)
+        finally:
+            # Unfinished Redis jobs stay pending and are reclaimed; local ones are lost with the process.
+            for task in list(self._in_flight):
+                task.cancel()
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+    async def _read(self, count: int):
+        """Returns [(message_id, job, document)], waiting up to a second for the first job."""
+        if not self.redis:
+            queue = self._queue()
+            try:
+                items = [await asyncio.wait_for(queue.get(), timeout=1.0)]
+            except asyncio.TimeoutError:
+                return []
+            while len(items) < count and not queue.empty():
+                items.append(queue.get_nowait())
+            return [(None, job, document) for job, document in items]
+
+        response = await self.redis.xreadgroup(
+            self.GROUP_NAME, self.consumer_name, {self.STREAM_KEY: ">"}, count=count, block=1000)
+        messages = response[0][1] if response else []
+        if not messages:
+            claimed = await self.redis.xautoclaim(
+                self.STREAM_KEY, self.GROUP_NAME, self.consumer_name, self.claim_idle_ms, start_id="0-0", count=count)
+            messages = [(message_id, fields) for message_id, fields in claimed[1] if fields]
+            self.counters["reclaimed"] += len(messages)
+        return [(message_id, json.loads(fields[b"job"]), None) for message_id, fields in messages]
+
+    async def _load(self, job: Dict[str, Any]) -> Optional[InputDocument]:
+        process_id = job["process_id"]
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.get(f"{self.PAYLOAD_KEY_PREFIX}{process_id}")
+        pipe.incr(f"{self.DELIVERIES_KEY_PREFIX}{process_id}")
+        pipe.expire(f"{self.DELIVERIES_KEY_PREFIX}{process_id}", self.payload_ttl_seconds)
+        payload, deliveries, _ = await pipe.execute()
+        if payload is None:
+            raise RuntimeError("Job payload expired or missing")
+        if deliveries > self.max_deliveries:
+            raise RuntimeError(f"Job delivered {deliveries - 1} times without completing")
+        return InputDocument.from_bytes(payload)
+
+    async def _run_job(self, message_id, job: Dict[str, Any], document: Optional[InputDocument]):
+        process_id = job["process_id"]
+        async with self._slots:
+            try:
+                if document is None:
+                    document = await self._load(job)
+                await self.memory.aadd_entry(process_id, "job", {
+                    "status": "running", "worker": self.consumer_name, "queued_seconds": round(time.time() - job["enqueued_at"], 3)})
+                await self.handler(process_id, document, job)
+                self.counters["completed"] += 1
+                await self.memory.aadd_entry(process_id, "job", {"status": "completed", "worker": self.consumer_name})
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"JobQueue: Job {process_id} failed: {e}")
+                self.counters["failed"] += 1
+                await self.memory.aadd_entry(process_id, "job", {"status": "failed", "worker": self.consumer_name, "error": str(e)})
+                await self.memory.aadd_entry(process_id, "processing_summary", {"status": f"Processing failed: {e}", "duration_seconds": time.time() - job["enqueued_at"]})
+            finally:
+                if document is not None:
+                    document.close()
+                if not self.redis:
+                    self._local_queue.task_done()
+
+        if self.redis:
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                pipe.xack(self.STREAM_KEY, self.GROUP_NAME, message_id)
+                pipe.xdel(self.STREAM_KEY, message_id)
+                pipe.delete(f"{self.PAYLOAD_KEY_PREFIX}{process_id}", f"{self.DELIVERIES_KEY_PREFIX}{process_id}")
+                await pipe.execute()
+            except Exception as e:
+                print(f"JobQueue: Failed to acknowledge job {process_id}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "redis_stream" if self.redis else "in_process",
+            "consuming": self._runner is not None,
+            "in_flight": len(self._in_flight),
+            "local_depth": self._local_queue.qsize() if self._local_queue is not None else 0,
+            **self.counters,
+        }
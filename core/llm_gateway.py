@@ -0,0 +1,424 @@
+# File: /multi_agent_system/core/llm_gateway.py
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import re
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional
+
+from core import deadline, telemetry
+
+# Lower runs first: classification gates everything downstream, so it jumps ahead of extraction.
+PRIORITY_CLASSIFIER = 0
+PRIORITY_EXTRACTION = 1
+PRIORITY_NAMES = {PRIORITY_CLASSIFIER: "classifier", PRIORITY_EXTRACTION: "extraction"}
+
+if TYPE_CHECKING:
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+
+def _error_chain(error: Optional[BaseException]) -> List[BaseException]:
+    """`error` and the exceptions it was raised from: client libraries wrap the provider's error."""
+    chain: List[BaseException] = []
+    while error is not None and len(chain) < 5 and all(error is not seen for seen in chain):
+        chain.append(error)
+        error = error.__cause__ or error.__context__
+    return chain
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    """The HTTP status an exception carries: `.code` (google-api-core, google-genai) or `.response.status_code` (httpx)."""
+    for code in (getattr(error, "code", None), getattr(getattr(error, "response", None), "status_code", None)):
+        if isinstance(code, int) and 100 <= code < 600:
+            return int(code)
+    return None
+
+
+def _type_names(error: BaseException) -> set:
+    return {cls.__name__ for cls in type(error).__mro__}
+
+
+_RATE_LIMIT_ERRORS = {"ResourceExhausted", "TooManyRequests", "RateLimitError", "ModelRateLimitError", "GoogleRateLimitError"}
+# Matched as a status name only: a bare "429" can just as well be part of a request ID or a token count.
+_RATE_LIMIT_STATUS = re.compile(r"\bRESOURCE_EXHAUSTED\b")
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """True for provider throttling (HTTP 429 / RESOURCE_EXHAUSTED), however the client library wraps it."""
+    return any(_type_names(e) & _RATE_LIMIT_ERRORS or _status_code(e) == 429 or _RATE_LIMIT_STATUS.search(str(e))
+               for e in _error_chain(error))
+
+
+_TRANSIENT_ERRORS = {"ServiceUnavailable", "InternalServerError", "DeadlineExceeded", "GatewayTimeout", "BadGateway",
+                     "ServerError", "ConnectError", "ConnectTimeout", "ReadTimeout", "ReadError", "RemoteProtocolError"}
+_TRANSIENT_CODES = {500, 502, 503, 504}
+# Status names only: "max_output_tokens must be <= 500" is a bad request, not a server error.
+_TRANSIENT_STATUS = re.compile(r"\b(?:UNAVAILABLE|DEADLINE_EXCEEDED)\b")
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """Throttling, timeouts, dropped connections and 5xx responses; bad requests and auth errors fail at once."""
+    if isinstance(error, deadline.DeadlineExceeded):
+        return False
+    if is_rate_limit_error(error):
+        return True
+    for e in _error_chain(error):
+        if isinstance(e, (asyncio.TimeoutError, ConnectionError)) or _type_names(e) & _TRANSIENT_ERRORS:
+            return True
+        code = _status_code(e)
+        if code is not None:
+            return code in _TRANSIENT_CODES
+        if _TRANSIENT_STATUS.search(str(e)):
+            return True
+    return False
+
+
+def _parse_model_limits(spec: str) -> Dict[str, float]:
+    """Parses "gemini-2.0-flash=2000,gemini-1.5-pro=360" into {"gemini-2.0-flash": 2000.0, ...}."""
+    limits = {}
+    for item in spec.split(","):
+        if "=" in item:
+            model, limit = item.split("=", 1)
+            limits[model.strip()] = float(limit)
+    return limits
+
+
+class TokenBucket:
+    """Refills continuously at `per_minute / 60` per second and holds at most a minute's worth."""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        self._refill()
+        # A single call larger than the bucket waits for a full bucket instead of forever.
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+    def adjust(self, delta: float):
+        """Charges (or refunds) the difference between estimated and actual usage; the level may go negative."""
+        self._refill()
+        self.level = min(self.capacity, self.level - delta)
+
+
+class ModelLimiter:
+    """
+    Admission control for one model: a priority queue in front of a request bucket (RPM), a token
+    bucket (TPM) and an AIMD concurrency limit. The limit grows by about one slot per window of calls
+    that finish under the latency target, shrinks by 10% when a call is slower, and halves (with a
+    pause of `cooldown` seconds for everyone) when the provider throttles.
+    """
+
+    def __init__(self, model: str, rpm: float, tpm: float, initial_concurrency: int, min_concurrency: int,
+                 max_concurrency: int, latency_target: float, cooldown: float):
+        self.model = model
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.limit = float(max(min_concurrency, min(initial_concurrency, max_concurrency)))
+        self.latency_target = latency_target
+        self.cooldown = cooldown
+        self.in_flight = 0
+        # [priority, sequence, future, tokens, enqueued_at]; FIFO within a priority.
+        self._waiters: List[list] = []
+        self._sequence = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._paused_until = 0.0
+        self.counters = {"granted": 0, "ok": 0, "error": 0, "rate_limited": 0, "cancelled": 0, "retried": 0, "hedged": 0, "hedge_won": 0}
+        # Latencies of recent successful calls, for the hedging threshold.
+        self._latencies = deque(maxlen=200)
+        # priority -> [calls, total wait seconds, max wait seconds]
+        self._waits: Dict[int, List[float]] = {}
+
+    async def acquire(self, priority: int, tokens: float):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, [priority, next(self._sequence), future, tokens, time.monotonic()])
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Granted just before the caller was cancelled: hand the slot back.
+            if future.done() and not future.cancelled():
+                self.in_flight -= 1
+                self._dispatch()
+            raise
+
+    def try_acquire(self, priority: int, tokens: float) -> bool:
+        """Takes a slot only if one is free right now and nobody of the same or higher priority is queued."""
+        if any(not future.done() and waiter_priority <= priority for waiter_priority, _, future, _, _ in self._waiters):
+            return False
+        if self.in_flight >= int(self.limit):
+            return False
+        if max(self._paused_until - time.monotonic(), self.requests.wait_time(1), self.tokens.wait_time(tokens)) > 0:
+            return False
+        self.requests.take(1)
+        self.tokens.take(tokens)
+        self.in_flight += 1
+        self.counters["granted"] += 1
+        return True
+
+    def latency_percentile(self, quantile: float, min_samples: int) -> Optional[float]:
+        if len(self._latencies) < min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(int(len(ordered) * quantile), len(ordered) - 1)]
+
+    def release(self, latency: float, outcome: str, token_delta: float = 0.0):
+        self.in_flight -= 1
+        self.counters[outcome] += 1
+        if token_delta:
+            self.tokens.adjust(token_delta)
+        if outcome == "ok":
+            self._latencies.append(latency)
+        if outcome == "rate_limited":
+            self.limit = max(self.min_concurrency, self.limit / 2)
+            self._paused_until = time.monotonic() + self.cooldown
+        elif outcome == "ok":
+            if latency > self.latency_target:
+                self.limit = max(self.min_concurrency, self.limit * 0.9)
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+        self._dispatch()
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._waiters:
+            priority, _, future, tokens, enqueued_at = self._waiters[0]
+            if future.done():  # cancelled while queued
+                heapq.heappop(self._waiters)
+                continue
+            if self.in_flight >= int(self.limit):
+                break  # the next release() dispatches again
+            wait = max(self._paused_until - time.monotonic(), self.requests.wait_time(1), self.tokens.wait_time(tokens))
+            if wait > 0:
+                # Strict priority: lower-priority calls never overtake a head that is waiting for budget.
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                break
+            heapq.heappop(self._waiters)
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            self.in_flight += 1
+            self.counters["granted"] += 1
+            self._record_wait(priority, time.monotonic() - enqueued_at)
+            future.set_result(None)
+        self._export_gauges()
+
+    def _record_wait(self, priority: int, waited: float):
+        stats = self._waits.setdefault(priority, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += waited
+        stats[2] = max(stats[2], waited)
+        if telemetry.METRICS_ENABLED:
+            telemetry.LLM_WAIT_SECONDS.observe(waited, self.model, PRIORITY_NAMES.get(priority, str(priority)))
+
+    def _queue_depths(self) -> Dict[str, int]:
+        depths = {name: 0 for name in PRIORITY_NAMES.values()}
+        for priority, _, future, _, _ in self._waiters:
+            if not future.done():
+                name = PRIORITY_NAMES.get(priority, str(priority))
+                depths[name] = depths.get(name, 0) + 1
+        return depths
+
+    def _export_gauges(self):
+        if telemetry.METRICS_ENABLED:
+            for name, depth in self._queue_depths().items():
+                telemetry.LLM_QUEUE_DEPTH.set(depth, self.model, name)
+            telemetry.LLM_CONCURRENCY_LIMIT.set(int(self.limit), self.model)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "concurrency_limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "queue_depth": self._queue_depths(),
+            "wait_seconds": {
+                PRIORITY_NAMES.get(priority, str(priority)): {"avg": round(total / calls, 4) if calls else 0.0, "max": round(longest, 4)}
+                for priority, (calls, total, longest) in self._waits.items()
+            },
+            "requests_available": int(self.requests.level),
+            "tokens_available": int(self.tokens.level),
+            "paused_seconds": round(max(self._paused_until - time.monotonic(), 0.0), 2),
+            **self.counters,
+        }
+
+
+class LLMGateway:
+    """
+    The one place LLM calls leave the process. Agents share one client per model (and its HTTP
+    connection pool), and every call is admitted by that model's `ModelLimiter`. Transient failures
+    (throttling, timeouts, 5xx) are retried here, per call, with jittered backoff and within the
+    request deadline (`core.deadline`), instead of re-running whole agents. With hedging enabled, a
+    call still running past the model's recent p95 latency gets a duplicate, and the first answer wins.
+
+    Limits are per process: with several uvicorn workers or `worker.py` instances, divide the
+    provider quota between them.
+    """
+
+    def __init__(self):
+        self.default_rpm = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "1000"))
+        self.default_tpm = float(os.getenv("LLM_TOKENS_PER_MINUTE", "1000000"))
+        self.model_rpm = _parse_model_limits(os.getenv("LLM_MODEL_REQUESTS_PER_MINUTE", ""))
+        self.model_tpm = _parse_model_limits(os.getenv("LLM_MODEL_TOKENS_PER_MINUTE", ""))
+        self.initial_concurrency = int(os.getenv("LLM_INITIAL_CONCURRENCY", "8"))
+        self.min_concurrency = int(os.getenv("LLM_MIN_CONCURRENCY", "1"))
+        self.max_concurrency = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+        self.latency_target = float(os.getenv("LLM_LATENCY_TARGET_SECONDS", "5"))
+        self.cooldown = float(os.getenv("LLM_RATE_LIMIT_COOLDOWN_SECONDS", "2"))
+        self.max_retries = int(os.getenv("LLM_MAX_RETRIES", "2"))
+        self.backoff_base = float(os.getenv("LLM_RETRY_BACKOFF_SECONDS", "0.5"))
+        self.backoff_max = float(os.getenv("LLM_RETRY_BACKOFF_MAX_SECONDS", "8"))
+        self.call_timeout = float(os.getenv("LLM_CALL_TIMEOUT_SECONDS", "30"))
+        self.hedging = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+        self.hedge_quantile = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+        self.hedge_min_samples = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+        # Completion tokens are unknown until the call returns; this is charged up front and reconciled.
+        self.completion_token_estimate = int(os.getenv("LLM_COMPLETION_TOKEN_ESTIMATE", "256"))
+        self._clients: Dict[str, "ChatGoogleGenerativeAI"] = {}
+        self._limiters: Dict[str, ModelLimiter] = {}
+
+    def client(self, model_name: str) -> "ChatGoogleGenerativeAI":
+        if model_name not in self._clients:
+            # Imported on first use: the Gemini SDK takes longer to import than the rest of the app.
+            from langchain_google_genai import ChatGoogleGenerativeAI
+            # max_retries=1 is a single attempt: retries and backoff happen in acall, so every 429 reaches the
+            # limiter and no attempt sleeps through the request deadline inside the SDK (whose default is 6).
+            self._clients[model_name] = ChatGoogleGenerativeAI(model=model_name, temperature=0.0, google_api_key=os.getenv("GOOGLE_API_KEY"),
+                                                               max_retries=1, timeout=self.call_timeout)
+        return self._clients[model_name]
+
+    def limiter(self, model_name: str) -> ModelLimiter:
+        if model_name not in self._limiters:
+            self._limiters[model_name] = ModelLimiter(
+                model_name,
+                rpm=self.model_rpm.get(model_name, self.default_rpm),
+                tpm=self.model_tpm.get(model_name, self.default_tpm),
+                initial_concurrency=self.initial_concurrency,
+                min_concurrency=self.min_concurrency,
+                max_concurrency=self.max_concurrency,
+                latency_target=self.latency_target,
+                cooldown=self.cooldown,
+            )
+        return self._limiters[model_name]
+
+    def _backoff(self, attempt: int, throttled: bool) -> float:
+        # Full jitter spreads retries of calls that failed together; throttled calls also sit out the cooldown.
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        return max(delay, self.cooldown) if throttled else delay
+
+    async def acall(self, model_name: str, priority: int, prompt_tokens: int, call: Callable[[], Awaitable[Any]],
+                    agent: str = "llm", info: Optional[Dict[str, Any]] = None) -> Any:
+        """
+        Runs `call()` (one LLM request returning a message) once admitted, retrying transient errors.
+        Raises `deadline.DeadlineExceeded` when the request deadline runs out first. `info`, if given,
+        receives "attempts", "hedged" and "hedge_won" for the caller's trace.
+        """
+        limiter = self.limiter(model_name)
+        estimated = prompt_tokens + self.completion_token_estimate
+        info = info if info is not None else {}
+        info.update(attempts=0, hedged=False, hedge_won=False)
+        attempt = 0
+        while True:
+            deadline.check(f"{agent} LLM call")
+            info["attempts"] = attempt + 1
+            try:
+                with telemetry.span("llm_wait", agent):
+                    await asyncio.wait_for(limiter.acquire(priority, estimated), timeout=deadline.remaining())
+            except asyncio.TimeoutError:
+                raise deadline.DeadlineExceeded(f"{model_name}: no LLM slot before the request deadline") from None
+            try:
+                return await self._run_hedged(limiter, priority, estimated, call, info)
+            except Exception as e:
+                left = deadline.remaining()
+                if isinstance(e, asyncio.TimeoutError) and left is not None and left <= 0:
+                    raise deadline.DeadlineExceeded(f"{model_name}: LLM call still running at the request deadline") from None
+                if not is_retryable_error(e) or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt, is_rate_limit_error(e))
+                if left is not None and delay >= left:
+                    raise
+                limiter.counters["retried"] += 1
+                if telemetry.METRICS_ENABLED:
+                    telemetry.LLM_REQUESTS.inc(model_name, "retried")
+                print(f"LLMGateway: {model_name} call failed ({type(e).__name__}), retrying in {delay:.2f}s (attempt {attempt + 1}): {e}")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def _run_hedged(self, limiter: ModelLimiter, priority: int, estimated: float,
+                          call: Callable[[], Awaitable[Any]], info: Dict[str, Any]) -> Any:
+        """Runs an admitted call, plus a hedge once it outlives the p95 latency; returns the first success."""
+        timeout = deadline.cap(self.call_timeout)
+        started = time.monotonic()
+        primary = asyncio.ensure_future(self._run_admitted(limiter, estimated, call))
+        pending = {primary}
+        hedge = None
+        try:
+            threshold = limiter.latency_percentile(self.hedge_quantile, self.hedge_min_samples) if self.hedging else None
+            if threshold is not None and threshold < timeout:
+                await asyncio.wait(pending, timeout=threshold)
+                if not primary.done() and limiter.try_acquire(priority, estimated):
+                    hedge = asyncio.ensure_future(self._run_admitted(limiter, estimated, call))
+                    pending.add(hedge)
+                    info["hedged"] = True
+                    limiter.counters["hedged"] += 1
+                    if telemetry.METRICS_ENABLED:
+                        telemetry.LLM_REQUESTS.inc(limiter.model, "hedged")
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=max(timeout - (time.monotonic() - started), 0.0),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise asyncio.TimeoutError()
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            info["hedge_won"] = True
+                            limiter.counters["hedge_won"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # Cancel the loser (or both, on timeout); each releases its own slot.
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _run_admitted(self, limiter: ModelLimiter, estimated: float, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Makes one call in a slot already granted by `limiter` and releases it with the outcome."""
+        started = time.perf_counter()
+        try:
+            message = await call()
+        except asyncio.CancelledError:
+            limiter.release(time.perf_counter() - started, "cancelled")
+            raise
+        except Exception as e:
+            outcome = "rate_limited" if is_rate_limit_error(e) else "error"
+            limiter.release(time.perf_counter() - started, outcome)
+            if telemetry.METRICS_ENABLED:
+                telemetry.LLM_REQUESTS.inc(limiter.model, outcome)
+            raise
+        usage = getattr(message, "usage_metadata", None) or {}
+        actual = usage.get("total_tokens") or 0
+        limiter.release(time.perf_counter() - started, "ok", token_delta=actual - estimated if actual else 0.0)
+        if telemetry.METRICS_ENABLED:
+            telemetry.LLM_REQUESTS.inc(limiter.model, "ok")
+        return message
+
+    def stats(self) -> Dict[str, Any]:
+        return {model: limiter.stats() for model, limiter in self._limiters.items()}
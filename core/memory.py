@@ -1,42 +1,201 @@
 # File: /multi_agent_system/core/memory.py
+import asyncio
 import json
 import redis
+import redis.asyncio as aioredis
+from redis.asyncio.retry import Retry
+from redis.backoff import NoBackoff
 import time
 import os
-from typing import Dict, Any, Optional
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List, Optional, Tuple
+from core import telemetry
+from core.fallback_store import FallbackStore
+from core.trace_codec import EncodedEntry, TraceCodec
+from core.trace_events import TraceEvents, encode_event
+from core.trace_index import Term, TraceIndex, index_terms
+
+# How long the startup check waits for Redis before falling back to the in-memory store.
+REDIS_CONNECT_TIMEOUT_SECONDS = float(os.getenv("REDIS_CONNECT_TIMEOUT_SECONDS", "2"))
 
 class SharedMemory:
-    def __init__(self, host='localhost', port=6379, db=0):
+    # Each process trace lives in one Redis hash (field = entry key, value = encoded entry, see
+    # core/trace_codec.py) with its own TTL, so a whole trace is written with one HSET and read back
+    # with one HGETALL.
+    TRACE_KEY_PREFIX = "trace:"
+
+    def __init__(self, host='localhost', port=6379, db=0, trace_ttl_seconds: Optional[int] = None):
+        self.fallback_store: Optional[FallbackStore] = None
+        self.trace_ttl_seconds = trace_ttl_seconds or int(os.getenv("TRACE_TTL_SECONDS", "604800"))
+        self.codec = TraceCodec()
+        # process_id -> {entry key: encoded entry} awaiting a pipelined flush
+        self._pending: Dict[str, Dict[str, EncodedEntry]] = {}
+        # process_id -> index terms of those entries, written in the same flush
+        self._pending_terms: Dict[str, List[Tuple[Term, float]]] = {}
+        # Secondary indexes (format, intent, flags, actions, ...) behind the /processes query API.
+        self.index_enabled = os.getenv("TRACE_INDEX_ENABLED", "true").lower() == "true"
+        # Publishes each write to live trace subscribers (see core/trace_events.py).
+        self.events_enabled = os.getenv("TRACE_EVENTS_ENABLED", "true").lower() == "true"
+        self.host, self.port, self.db = host, port, db
+        # Clients connect lazily: constructing SharedMemory (e.g. on import) touches no network. The
+        # connection is checked once by `aconnect()` at startup, which falls back to the in-memory store.
+        # Trace values are binary (see core/trace_codec.py), so the sync client is not decoding.
+        self.redis_client = redis.Redis(host=host, port=port, db=db)
+        # The asyncio client shares nothing with the sync one; its pool connects lazily on the serving loop.
+        self.async_redis_client = aioredis.Redis(host=host, port=port, db=db, decode_responses=True)
+        # Raw-bytes client for binary payloads (queued documents, trace entries) that must not be decoded as UTF-8.
+        self.async_blob_client = aioredis.Redis(host=host, port=port, db=db)
+        self.connected = False
+        self.events = TraceEvents(self.async_redis_client)
+        self.index = TraceIndex(self.async_redis_client, ttl_seconds=self.trace_ttl_seconds)
+
+    async def aconnect(self, timeout: float = REDIS_CONNECT_TIMEOUT_SECONDS) -> bool:
+        """
+        Checks Redis once, without retries, and switches to the in-memory fallback store when it is
+        unreachable. Called at startup (app lifespan, worker.py); returns whether Redis is used.
+        """
+        if self.connected:
+            return self.is_redis_backed
+        probe = aioredis.Redis(host=self.host, port=self.port, db=self.db, socket_connect_timeout=timeout,
+                               retry=Retry(NoBackoff(), 0))
         try:
-            self.redis_client = redis.Redis(host=host, port=port, db=db, decode_responses=True)
-            self.redis_client.ping()
-            print(f"Connected to Redis successfully at {host}:{port}!")
-        except redis.exceptions.ConnectionError as e:
-            print(f"Could not connect to Redis at {host}:{port}: {e}")
-            print("Falling back to in-memory dictionary.")
-            self.redis_client = None
-            self.in_memory_store = {}
-
-    def _get_store(self):
-        return self.redis_client if self.redis_client else self.in_memory_store
+            await asyncio.wait_for(probe.ping(), timeout)
+            print(f"Connected to Redis successfully at {self.host}:{self.port}!")
+        except (redis.exceptions.RedisError, OSError, asyncio.TimeoutError) as e:
+            print(f"Could not connect to Redis at {self.host}:{self.port}: {str(e) or 'timed out'}")
+            print("Falling back to in-memory store.")
+            await self._afall_back()
+        finally:
+            await probe.aclose()
+        self.connected = True
+        return self.is_redis_backed
+
+    async def _afall_back(self):
+        clients = (self.async_redis_client, self.async_blob_client)
+        self.redis_client = self.async_redis_client = self.async_blob_client = None
+        for client in clients:
+            await client.aclose()
+        self.fallback_store = FallbackStore(
+            max_bytes=int(os.getenv("FALLBACK_STORE_MAX_BYTES", str(64 * 1024 * 1024))),
+            ttl_seconds=self.trace_ttl_seconds,
+            spill_path=os.getenv("FALLBACK_STORE_SPILL_PATH") or None
+        )
+        self.events = TraceEvents(None)
+        self.index = TraceIndex(None, ttl_seconds=self.trace_ttl_seconds)
+
+    @property
+    def is_redis_backed(self) -> bool:
+        return self.redis_client is not None
+
+    def _trace_key(self, process_id: str) -> str:
+        return f"{self.TRACE_KEY_PREFIX}{process_id}"
+
+    @staticmethod
+    def _merge(entries: Dict[str, EncodedEntry]) -> Dict[str, bytes]:
+        fields: Dict[str, bytes] = {}
+        for entry in entries.values():
+            fields.update(entry.fields)
+        return fields
+
+    def _queue_publish(self, pipe, process_id: str, entries: Dict[str, EncodedEntry]):
+        if self.events_enabled:
+            pipe.publish(self.events.channel(process_id), encode_event(process_id, {key: entry.json for key, entry in entries.items()}))
+
+    def _terms(self, key: str, data: Any) -> List[Tuple[Term, float]]:
+        if not self.index_enabled:
+            return []
+        now = time.time()
+        return [(term, now) for term in index_terms(key, data)]
+
+    def _queue_write(self, pipe, process_id: str, entries: Dict[str, EncodedEntry], terms: List[Tuple[Term, float]]):
+        """Queues a trace write; its first command reads the values it replaces (see `_replaced_refs`)."""
+        trace_key = self._trace_key(process_id)
+        pipe.hmget(trace_key, list(entries))
+        pipe.hset(trace_key, mapping=self._merge(entries))
+        pipe.expire(trace_key, self.trace_ttl_seconds)
+        self.index.queue_add(pipe, process_id, terms)
+        self._queue_publish(pipe, process_id, entries)
+
+    def _replaced_refs(self, replaced: Optional[List[Optional[bytes]]]) -> bool:
+        """Whether an overwritten value referenced blobs, which may now be referenced by nothing."""
+        for raw in replaced or ():
+            if not raw:
+                continue
+            try:
+                if self.codec.refs(self.codec.unpack(raw)):
+                    return True
+            except Exception:
+                continue
+        return False
+
+    def _collect_blobs(self, process_id: str):
+        """Deletes the blob fields no entry of the trace references any more (after an entry was overwritten)."""
+        trace_key = self._trace_key(process_id)
+        with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.watch(trace_key)
+            orphans = self.codec.unreferenced_blobs(pipe.hgetall(trace_key))
+            if not orphans:
+                pipe.unwatch()
+                return
+            pipe.multi()
+            pipe.hdel(trace_key, *orphans)
+            try:
+                pipe.execute()
+            except redis.exceptions.WatchError:
+                pass  # written meanwhile: left to the next overwrite, or to the trace's TTL
+
+    async def _acollect_blobs(self, process_id: str):
+        trace_key = self._trace_key(process_id)
+        async with self.async_blob_client.pipeline(transaction=True) as pipe:
+            await pipe.watch(trace_key)
+            orphans = self.codec.unreferenced_blobs(await pipe.hgetall(trace_key))
+            if not orphans:
+                await pipe.unwatch()
+                return
+            pipe.multi()
+            pipe.hdel(trace_key, *orphans)
+            try:
+                await pipe.execute()
+            except redis.exceptions.WatchError:
+                pass  # written meanwhile: left to the next overwrite, or to the trace's TTL
+
+    def _decode_entry(self, key: str, raw: Optional[bytes], load_trace) -> Optional[Any]:
+        """One stored entry; the rest of its trace is only read when the entry references blobs in it."""
+        if not raw:
+            return None
+        value = self.codec.unpack(raw)
+        if not self.codec.refs(value):
+            return self.codec.resolve(value, {}, {})
+        return self.codec.decode_entries({**load_trace(), key: raw})[key]
 
     def add_entry(self, process_id: str, key: str, data: Any):
-        store = self._get_store()
-        full_key = f"{process_id}:{key}"
         try:
+            entries = {key: self.codec.encode(key, data)}
+            terms = self._terms(key, data)
             if self.redis_client:
-                store.set(full_key, json.dumps(data))
+                pipe = self.redis_client.pipeline(transaction=False)
+                self._queue_write(pipe, process_id, entries, terms)
+                if self._replaced_refs(pipe.execute()[0]):
+                    self._collect_blobs(process_id)
             else:
-                store[full_key] = json.dumps(data)
+                replaced = [self.fallback_store.get_entry(process_id, key)]
+                self.fallback_store.set_entries(process_id, self._merge(entries))
+                if self._replaced_refs(replaced):
+                    self.fallback_store.delete_entries(
+                        process_id, self.codec.unreferenced_blobs(self.fallback_store.get_entries(process_id)))
+                self.index.add_local(process_id, terms)
+                if self.events_enabled and self.events.has_local_subscribers(process_id):
+                    self.events.publish_local(process_id, encode_event(process_id, {key: entries[key].json}))
         except Exception as e:
             print(f"Error adding entry to memory ({key}): {e}")
 
     def get_entry(self, process_id: str, key: str) -> Optional[Dict[str, Any]]:
-        store = self._get_store()
-        full_key = f"{process_id}:{key}"
         try:
-            val = store.get(full_key) if self.redis_client else store.get(full_key)
-            return json.loads(val) if val else None
+            if self.redis_client:
+                val = self.redis_client.hget(self._trace_key(process_id), key)
+                return self._decode_entry(key, val, lambda: self.redis_client.hgetall(self._trace_key(process_id)))
+            val = self.fallback_store.get_entry(process_id, key)
+            return self._decode_entry(key, val, lambda: self.fallback_store.get_entries(process_id))
         except Exception as e:
             print(f"Error getting entry from memory ({key}): {e}")
             return None
@@ -45,22 +204,211 @@ class SharedMemory:
         self.add_entry(process_id, key, data)
 
     def get_all_entries_for_process(self, process_id: str) -> Dict[str, Any]:
-        store = self._get_store()
-        entries = {}
         if self.redis_client:
-            keys = store.keys(f"{process_id}:*")
-            for key in keys:
-                clean_key = key.split(':', 1)[1] if ':' in key else key
+            return self.codec.decode_entries(self.redis_client.hgetall(self._trace_key(process_id)))
+        return self.codec.decode_entries(self.fallback_store.get_entries(process_id))
+
+    def stats(self) -> Dict[str, Any]:
+        if self.fallback_store:
+            return self.fallback_store.stats()
+        return {"backend": "redis", "pending_processes": len(self._pending)}
+
+    def close(self):
+        if self.fallback_store:
+            self.fallback_store.close()
+
+    # --- Async API (used from the FastAPI event loop) ---
+    # The in-memory fallback never blocks, so those branches reuse the sync implementation.
+
+    @asynccontextmanager
+    async def buffered(self, *process_ids: str):
+        """
+        Buffers `aadd_entry` writes for the given processes and flushes them in a single pipeline
+        on exit (or earlier, whenever the trace is read). A no-op for the in-memory fallback.
+        """
+        if not self.async_redis_client:
+            yield
+            return
+        for process_id in process_ids:
+            self._pending.setdefault(process_id, {})
+            self._pending_terms.setdefault(process_id, [])
+        try:
+            yield
+        finally:
+            await self.aflush(*process_ids)
+            for process_id in process_ids:
+                self._pending.pop(process_id, None)
+                self._pending_terms.pop(process_id, None)
+
+    def _queue_flush(self, pipe, process_id: str):
+        entries = self._pending.get(process_id)
+        if not entries:
+            return
+        # Swap in fresh buffers before the pipeline is awaited so concurrent writes are not lost.
+        self._pending[process_id] = {}
+        terms = self._pending_terms.get(process_id) or []
+        self._pending_terms[process_id] = []
+        self._queue_write(pipe, process_id, entries, terms)
+
+    async def aflush(self, *process_ids: str):
+        if not self.async_redis_client:
+            return
+        pipe = self.async_blob_client.pipeline(transaction=False)
+        flushed = []
+        for process_id in process_ids:
+            start = len(pipe)
+            self._queue_flush(pipe, process_id)
+            if len(pipe) > start:
+                flushed.append((process_id, start))
+        if not len(pipe):
+            return
+        try:
+            with telemetry.span("memory_flush", "memory"):
+                results = await pipe.execute()
+            for process_id, start in flushed:
+                if self._replaced_refs(results[start]):
+                    await self._acollect_blobs(process_id)
+        except Exception as e:
+            print(f"Error flushing memory entries for {len(process_ids)} process(es): {e}")
+
+    async def aflush_stage(self, process_id: str):
+        """Flushes buffered writes at a pipeline stage boundary so live subscribers see the stage as it completes.
+
+        Costs one extra round trip per stage, so it is skipped when trace events are disabled.
+        """
+        if self.events_enabled:
+            await self.aflush(process_id)
+
+    async def aadd_entry(self, process_id: str, key: str, data: Any):
+        if not self.async_redis_client:
+            return self.add_entry(process_id, key, data)
+        try:
+            entry = self.codec.encode(key, data)
+            terms = self._terms(key, data)
+            pending = self._pending.get(process_id)
+            if pending is not None:
+                pending[key] = entry
+                self._pending_terms[process_id].extend(terms)
+                return
+            pipe = self.async_blob_client.pipeline(transaction=False)
+            self._queue_write(pipe, process_id, {key: entry}, terms)
+            with telemetry.span("memory_write", "memory"):
+                replaced = (await pipe.execute())[0]
+            if self._replaced_refs(replaced):
+                await self._acollect_blobs(process_id)
+        except Exception as e:
+            print(f"Error adding entry to memory ({key}): {e}")
+
+    async def aget_entry(self, process_id: str, key: str) -> Optional[Dict[str, Any]]:
+        if not self.async_redis_client:
+            return self.get_entry(process_id, key)
+        pending = self._pending.get(process_id)
+        try:
+            entry = pending.get(key) if pending else None
+            if entry is not None:
+                return json.loads(entry.json)
+            with telemetry.span("memory_read", "memory"):
+                val = await self.async_blob_client.hget(self._trace_key(process_id), key)
+                value = self.codec.unpack(val) if val else None
+                if value is None or not self.codec.refs(value):
+                    return self.codec.resolve(value, {}, {})
+                return self.codec.decode_entries({**await self.async_blob_client.hgetall(self._trace_key(process_id)), key: val})[key]
+        except Exception as e:
+            print(f"Error getting entry from memory ({key}): {e}")
+            return None
+
+    async def aupdate_entry(self, process_id: str, key: str, data: Any):
+        await self.aadd_entry(process_id, key, data)
+
+    async def aget_all_entries_for_process(self, process_id: str) -> Dict[str, Any]:
+        if not self.async_redis_client:
+            return self.get_all_entries_for_process(process_id)
+        # Pending writes ride in the same pipeline as the read: one round trip either way.
+        pipe = self.async_blob_client.pipeline(transaction=False)
+        self._queue_flush(pipe, process_id)
+        flushed = len(pipe) > 0
+        pipe.hgetall(self._trace_key(process_id))
+        with telemetry.span("memory_read_trace", "memory"):
+            results = await pipe.execute()
+        if flushed and self._replaced_refs(results[0]):
+            await self._acollect_blobs(process_id)
+        return self.codec.decode_entries(results[-1] or {})
+
+    async def aget_entries_many(self, process_ids: List[str], keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        """The given entries of many traces (process_id -> {key: value}), read in one round trip."""
+        if not self.async_redis_client:
+            return {process_id: {key: value for key in keys if (value := self.get_entry(process_id, key)) is not None}
+                    for process_id in process_ids}
+        pipe = self.async_blob_client.pipeline(transaction=False)
+        for process_id in process_ids:
+            pipe.hmget(self._trace_key(process_id), keys)
+        with telemetry.span("memory_read", "memory"):
+            rows = await pipe.execute()
+        results: Dict[str, Dict[str, Any]] = {}
+        for process_id, row in zip(process_ids, rows):
+            entries = {}
+            for key, raw in zip(keys, row):
+                if raw is None:
+                    continue
+                try:
+                    value = self.codec.unpack(raw)
+                except ValueError:
+                    continue
+                # Rare for the small entries listed here; those read their whole trace.
+                entries[key] = self.codec.resolve(value, {}, {}) if not self.codec.refs(value) else await self.aget_entry(process_id, key)
+            results[process_id] = entries
+        return results
+
+    async def atrace_exists(self, process_id: str) -> bool:
+        if not self.async_redis_client:
+            return bool(self.fallback_store.get_entries(process_id))
+        return process_id in self._pending or bool(await self.async_redis_client.exists(self._trace_key(process_id)))
+
+    # Raw string values outside the per-process trace namespace (e.g. the result cache).
+
+    async def aget_cache_value(self, key: str) -> Optional[str]:
+        if not self.async_redis_client:
+            return None
+        with telemetry.span("cache_get", "memory"):
+            return await self.async_redis_client.get(key)
+
+    async def aset_cache_value(self, key: str, value: str, ttl_seconds: int):
+        if not self.async_redis_client:
+            return
+        with telemetry.span("cache_set", "memory"):
+            await self.async_redis_client.set(key, value, ex=ttl_seconds)
+
+    async def aclaim_cache_value(self, key: str, value: str, ttl_seconds: int) -> Optional[str]:
+        """Stores `value` unless `key` exists (SET NX); returns None if stored, else the existing value."""
+        if not self.async_redis_client:
+            return None
+        pipe = self.async_redis_client.pipeline(transaction=False)
+        pipe.set(key, value, ex=ttl_seconds, nx=True)
+        pipe.get(key)
+        with telemetry.span("cache_claim", "memory"):
+            stored, current = await pipe.execute()
+        return None if stored else current
+
+    async def adelete_cache_value(self, key: str, expected: str):
+        """Deletes `key` only while it still holds `expected` (so a newer claim is never removed)."""
+        if not self.async_redis_client:
+            return
+        with telemetry.span("cache_delete", "memory"):
+            async with self.async_redis_client.pipeline(transaction=True) as pipe:
+                await pipe.watch(key)
+                if await pipe.get(key) != expected:
+                    await pipe.unwatch()
+                    return
+                pipe.multi()
+                pipe.delete(key)
                 try:
-                    entries[clean_key] = json.loads(store.get(key))
-                except (json.JSONDecodeError, TypeError):
-                    entries[clean_key] = store.get(key)
-        else:
-            for key, val in store.items():
-                if key.startswith(f"{process_id}:"):
-                    clean_key = key.split(':', 1)[1] if ':' in key else key
-                    try:
-                        entries[clean_key] = json.loads(val)
-                    except (json.JSONDecodeError, TypeError):
-                        entries[clean_key] = val
-        return entries
\ No newline at end of file
+                    await pipe.execute()
+                except redis.exceptions.WatchError:
+                    pass  # replaced meanwhile: the new value stays
+
+    async def aclose(self):
+        await self.events.aclose()
+        if self.async_redis_client:
+            await self.async_redis_client.aclose()
+            await self.async_blob_client.aclose()
+        self.close()
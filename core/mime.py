@@ -0,0 +1,162 @@
+# File: /multi_agent_system/core/mime.py
+import email
+import html
+import os
+import re
+from email import policy
+from email.errors import HeaderParseError
+from email.header import decode_header, make_header
+from email.message import EmailMessage
+from email.utils import parseaddr
+from typing import Any, Dict, List, NamedTuple, Optional
+
+# Body characters kept for the LLM once quoted history and signatures are removed.
+EMAIL_BODY_MAX_CHARS = int(os.getenv("EMAIL_BODY_MAX_CHARS", "6000"))
+# PDF attachments processed per email; further ones are listed in the trace but skipped.
+EMAIL_MAX_PDF_ATTACHMENTS = int(os.getenv("EMAIL_MAX_PDF_ATTACHMENTS", "10"))
+
+# Headers repeated in front of the body sent to the LLM.
+_PROMPT_HEADERS = ("From", "To", "Subject", "Date")
+
+# Where quoted history starts in a top-posted reply or forward; everything from here on is dropped.
+_REPLY_MARKER = re.compile(
+    r"^(?:On\s.{0,300}?(?:\n.{0,300}?)?wrote:[ \t]*$"
+    r"|-{2,}[ \t]*(?:Original Message|Forwarded message)[ \t]*-{2,}"
+    r"|_{10,}[ \t]*$"
+    r"|From:[ \t].*\n(?:Sent|Date):[ \t])",
+    re.IGNORECASE | re.MULTILINE)
+# RFC 3676 signature separator ("-- ") and mobile client footers.
+_SIGNATURE_MARKER = re.compile(r"^(?:--[ \t]?$|Sent from my [^\n]*$)", re.MULTILINE)
+_HTML_TAG = re.compile(r"<(?:script|style)\b.*?</(?:script|style)>|<[^>]+>", re.IGNORECASE | re.DOTALL)
+_BLANK_LINES = re.compile(r"\n[ \t]*\n(?:[ \t]*\n)+")
+
+
+class Attachment(NamedTuple):
+    filename: Optional[str]
+    content_type: str
+    data: bytes
+
+
+class ParsedEmail:
+    """An email split locally into headers, a cleaned and bounded body, and its attachments."""
+
+    def __init__(self, headers: Dict[str, str], body: str, body_chars: int, quoted_chars: int, signature_chars: int,
+                 attachments: List[Attachment], skipped_attachments: List[Dict[str, Any]]):
+        self.headers = headers
+        self.body = body
+        self.body_chars = body_chars  # before stripping and bounding
+        self.quoted_chars = quoted_chars
+        self.signature_chars = signature_chars
+        self.attachments = attachments  # PDFs, fanned out to the PDF agent
+        self.skipped_attachments = skipped_attachments  # everything else, only listed
+
+    @property
+    def sender(self) -> Optional[str]:
+        """The From address, or None when the email has no usable From header."""
+        address = parseaddr(self.headers.get("from", ""))[1]
+        return address if "@" in address else None
+
+    @property
+    def subject(self) -> Optional[str]:
+        return self.headers.get("subject")
+
+    def llm_input(self) -> str:
+        """The main headers and the cleaned body: all the LLM needs for urgency, issue and tone."""
+        lines = [f"{name}: {self.headers[name.lower()]}" for name in _PROMPT_HEADERS if name.lower() in self.headers]
+        return "\n".join(lines) + "\n\n" + self.body if lines else self.body
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "sender": self.sender,
+            "subject": self.subject,
+            "date": self.headers.get("date"),
+            "message_id": self.headers.get("message-id"),
+            "body_chars": self.body_chars,
+            "kept_body_chars": len(self.body),
+            "quoted_chars_removed": self.quoted_chars,
+            "signature_chars_removed": self.signature_chars,
+            "pdf_attachments": [{"filename": a.filename, "size": len(a.data)} for a in self.attachments],
+            "other_attachments": self.skipped_attachments,
+        }
+
+
+def _decode_header(value: str) -> str:
+    """Unfolds a raw header value and decodes its RFC 2047 words; undecodable values are kept as they are."""
+    value = re.sub(r"\r?\n[ \t]+", " ", value).strip()
+    try:
+        return str(make_header(decode_header(value)))
+    except (HeaderParseError, LookupError, UnicodeDecodeError):
+        return value
+
+
+def _text_of(part: EmailMessage) -> str:
+    try:
+        content = part.get_content()
+    except (LookupError, ValueError):  # unknown charset or broken transfer encoding
+        payload = part.get_payload(decode=True) or b""
+        content = payload.decode("utf-8", errors="replace")
+    if part.get_content_subtype() == "html":
+        content = html.unescape(_HTML_TAG.sub(" ", content))
+    return content
+
+
+def _is_pdf(part: EmailMessage) -> bool:
+    if part.get_content_type() == "application/pdf":
+        return True
+    filename = part.get_filename() or ""
+    return part.get_content_maintype() == "application" and filename.lower().endswith(".pdf")
+
+
+def strip_quoted(body: str) -> Dict[str, Any]:
+    """Drops quoted history (reply markers, "> " lines) and the signature; returns the body and the chars removed."""
+    quoted = 0
+    marker = _REPLY_MARKER.search(body)
+    # A bare forward has nothing above the marker: then the quoted message is the content.
+    if marker and body[:marker.start()].strip():
+        quoted += len(body) - marker.start()
+        body = body[:marker.start()]
+    lines = body.split("\n")
+    kept = [line for line in lines if not line.lstrip().startswith(">")]
+    if len(kept) != len(lines):
+        stripped = "\n".join(kept)
+        quoted += len(body) - len(stripped)
+        body = stripped
+    signature = 0
+    marker = _SIGNATURE_MARKER.search(body)
+    if marker:
+        signature = len(body) - marker.start()
+        body = body[:marker.start()]
+    return {"body": _BLANK_LINES.sub("\n\n", body).strip(), "quoted_chars": quoted, "signature_chars": signature}
+
+
+def parse_email(raw: str) -> ParsedEmail:
+    """
+    Parses a raw (RFC 822 / MIME) email, or a pasted one. Text that does not start with a header block
+    is treated as the body. The body is the text/plain part (else the text of the HTML part) with quoted
+    history and the signature removed, cut to `EMAIL_BODY_MAX_CHARS`.
+    """
+    text = raw.lstrip()
+    message = email.message_from_string(text, policy=policy.default)
+    headers: Dict[str, str] = {}
+    for name, value in message.raw_items():
+        # Raw values, decoded here: the email's own encoding issues should not fail the parse.
+        headers.setdefault(name.lower(), _decode_header(value))
+
+    attachments: List[Attachment] = []
+    skipped: List[Dict[str, Any]] = []
+    if "from" not in headers and "subject" not in headers:
+        headers = {}
+        body = text
+    else:
+        part = message.get_body(preferencelist=("plain", "html"))
+        body = _text_of(part) if part is not None else ""
+        for attachment in message.iter_attachments() if message.is_multipart() else ():
+            if _is_pdf(attachment) and len(attachments) < EMAIL_MAX_PDF_ATTACHMENTS:
+                data = attachment.get_payload(decode=True) or b""
+                attachments.append(Attachment(attachment.get_filename(), attachment.get_content_type(), data))
+            else:
+                skipped.append({"filename": attachment.get_filename(), "content_type": attachment.get_content_type()})
+
+    stripped = strip_quoted(body)
+    return ParsedEmail(headers, stripped["body"][:EMAIL_BODY_MAX_CHARS], len(body), stripped["quoted_chars"],
+                       stripped["signature_chars"], attachments, skipped)
@@ -0,0 +1,125 @@
+# File: /multi_agent_system/core/ndjson.py
+import asyncio
+from typing import AsyncIterator, List, Optional, Tuple
+
+from fastapi.responses import StreamingResponse
+
+# (1-based line number, line bytes without the newline, or None when the line exceeded the limit)
+Line = Tuple[int, Optional[bytes]]
+
+_END = object()
+
+
+async def aiter_lines(chunks: AsyncIterator[bytes], max_line_bytes: int) -> AsyncIterator[Line]:
+    """
+    Splits a newline-delimited byte stream into its non-blank lines as the chunks arrive; "\r\n" endings
+    are accepted too. At most one partial line (bounded by `max_line_bytes`) is held between chunks, so
+    memory does not grow with the length of the stream. The rest of an oversized line is skipped and
+    reported as None.
+    """
+    buffer = bytearray()
+    oversized = False
+    line_no = 0
+    async for chunk in chunks:
+        start = 0
+        while True:
+            end = chunk.find(b"\n", start)
+            if end == -1:
+                if not oversized:
+                    buffer += chunk[start:]
+                    # One byte of slack for the "\r" of a "\r\n" ending still to come.
+                    if len(buffer) > max_line_bytes + 1:
+                        oversized = True
+                        buffer.clear()
+                break
+            line_no += 1
+            if oversized:
+                oversized = False
+                yield line_no, None
+            else:
+                line = chunk[start:end] if not buffer else bytes(buffer + chunk[start:end])
+                buffer.clear()
+                if line.endswith(b"\r"):
+                    line = line[:-1]
+                if len(line) > max_line_bytes:
+                    yield line_no, None
+                elif line.strip():
+                    yield line_no, line
+            start = end + 1
+    # A final line without a trailing newline.
+    if buffer.endswith(b"\r"):
+        buffer = buffer[:-1]
+    if oversized or len(buffer) > max_line_bytes:
+        yield line_no + 1, None
+    elif buffer.strip():
+        yield line_no + 1, bytes(buffer)
+
+
+async def aiter_line_batches(chunks: AsyncIterator[bytes], max_line_bytes: int, batch_size: int,
+                             max_wait_seconds: float) -> AsyncIterator[List[Line]]:
+    """
+    Groups the lines of `chunks` into batches of up to `batch_size`, closing a batch early once
+    `max_wait_seconds` have passed since its first line, so a slow sender's events are not held back.
+    Lines are read by a separate task into a queue of at most `batch_size`, which also bounds memory:
+    the body is not read further while a full batch is being processed.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=batch_size)
+
+    async def read():
+        try:
+            async for line in aiter_lines(chunks, max_line_bytes):
+                await queue.put(line)
+            await queue.put(_END)
+        except Exception as e:
+            await queue.put(e)
+
+    reader = asyncio.ensure_future(read())
+    try:
+        done = False
+        error: Optional[Exception] = None
+        while not done:
+            item = await queue.get()
+            batch: List[Line] = []
+            close_at = loop.time() + max_wait_seconds
+            while True:
+                if item is _END:
+                    done = True
+                    break
+                if isinstance(item, Exception):
+                    # The lines read before the failure are still handed out first.
+                    error, done = item, True
+                    break
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    break
+                if not queue.empty():
+                    item = queue.get_nowait()
+                    continue
+                timeout = close_at - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    break
+            if batch:
+                yield batch
+        if error is not None:
+            raise error
+    finally:
+        reader.cancel()
+
+
+class RequestStreamingResponse(StreamingResponse):
+    """
+    A StreamingResponse whose body is produced while the request body is still being read.
+    Before ASGI spec 2.4, Starlette also listens for client disconnects, and that listener would
+    compete with `request.stream()` for receive() messages and swallow body chunks. It is not
+    started here; a client that goes away surfaces as a failed send instead.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
@@ -0,0 +1,285 @@
+# File: /multi_agent_system/core/near_duplicates.py
+import asyncio
+import hashlib
+import os
+import random
+import re
+import struct
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Type, TypeVar, Union
+
+from pydantic import BaseModel
+
+T = TypeVar("T", bound=BaseModel)
+
+# Estimated Jaccard similarity (of normalized word shingles) from which a previous result is reused.
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.8"))
+# MinHash signature slots, split into LSH bands of PERMUTATIONS / BANDS rows each.
+NEAR_DUPLICATE_PERMUTATIONS = int(os.getenv("NEAR_DUPLICATE_PERMUTATIONS", "64"))
+NEAR_DUPLICATE_BANDS = int(os.getenv("NEAR_DUPLICATE_BANDS", "16"))
+NEAR_DUPLICATE_SHINGLE_WORDS = int(os.getenv("NEAR_DUPLICATE_SHINGLE_WORDS", "3"))
+# Texts with fewer shingles are too short to tell a near-copy from a different document.
+NEAR_DUPLICATE_MIN_SHINGLES = int(os.getenv("NEAR_DUPLICATE_MIN_SHINGLES", "8"))
+# Most recent documents kept per LSH bucket, which bounds a lookup to BANDS * BUCKET_SIZE candidates.
+NEAR_DUPLICATE_BUCKET_SIZE = int(os.getenv("NEAR_DUPLICATE_BUCKET_SIZE", "8"))
+# Documents held by the in-process index (without Redis).
+NEAR_DUPLICATE_MAX_ENTRIES = int(os.getenv("NEAR_DUPLICATE_MAX_ENTRIES", "100000"))
+NEAR_DUPLICATE_TTL_SECONDS = int(os.getenv("NEAR_DUPLICATE_TTL_SECONDS", str(30 * 86400)))
+
+# Names, numbers, dates and addresses are what tells near-copies apart, and none of them matters for
+# classification: they are masked before shingling.
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+_NUMBER = re.compile(r"\d[\d.,:/-]*")
+_WORD = re.compile(r"[^\W_]+|[#@]")
+
+_MAX_HASH = (1 << 32) - 1
+
+
+class NearDuplicateMatch(NamedTuple):
+    process_id: str  # the process whose result is reused
+    similarity: float
+    value: bytes
+    candidates: int
+
+
+class NearDuplicateIndex:
+    """
+    Finds earlier documents that are near-copies of a new one (the same complaint template with
+    another name, next month's invoice from the same vendor) so their result can be reused instead of
+    calling the LLM again. Complements ResultCache, which only matches byte-identical input.
+
+    Text is lowercased, numbers and email addresses are masked, and the words are cut into
+    overlapping shingles. A MinHash signature estimates the Jaccard similarity of two shingle sets, and
+    locality-sensitive hashing over bands of the signature finds candidates without comparing against
+    every stored document. Each band bucket keeps its `bucket_size` most recent documents, so a lookup
+    reads at most `bands * bucket_size` candidates (two Redis round trips) however large the index
+    grows. Results are stored per namespace, model and prompt version, in Redis when it is available
+    (shared by every worker) and otherwise in a bounded in-process index.
+    """
+
+    KEY_PREFIX = "neardup"
+
+    def __init__(self, memory_instance, threshold: float = NEAR_DUPLICATE_THRESHOLD, permutations: int = NEAR_DUPLICATE_PERMUTATIONS,
+                 bands: int = NEAR_DUPLICATE_BANDS, shingle_words: int = NEAR_DUPLICATE_SHINGLE_WORDS,
+                 min_shingles: int = NEAR_DUPLICATE_MIN_SHINGLES, bucket_size: int = NEAR_DUPLICATE_BUCKET_SIZE,
+                 max_entries: int = NEAR_DUPLICATE_MAX_ENTRIES, ttl_seconds: int = NEAR_DUPLICATE_TTL_SECONDS):
+        if permutations % bands:
+            raise ValueError(f"NEAR_DUPLICATE_PERMUTATIONS ({permutations}) must be a multiple of NEAR_DUPLICATE_BANDS ({bands}).")
+        self.memory = memory_instance
+        self.threshold = threshold
+        self.permutations = permutations
+        self.bands = bands
+        self.rows = permutations // bands
+        self.shingle_words = shingle_words
+        self.min_shingles = min_shingles
+        self.bucket_size = bucket_size
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._format = f"<{permutations}I"
+        # Fixed seed: every worker must derive the same signature from the same text.
+        rng = random.Random(0x5EED)
+        self._probes = [[slot] + rng.sample(range(permutations), permutations) for slot in range(permutations)]
+        # Without Redis: bucket key -> recent document keys, document key -> (expires_at, signature, value).
+        self._buckets: Dict[str, deque] = {}
+        self._documents: "OrderedDict[str, tuple]" = OrderedDict()
+        self.lookups: Dict[str, int] = {}
+        self.matches: Dict[str, int] = {}
+
+    # --- Signatures ---
+
+    def shingles(self, content: Union[str, bytes]) -> set:
+        if isinstance(content, bytes):
+            content = content.decode("utf-8", errors="ignore")
+        text = _NUMBER.sub("#", _EMAIL.sub("@", content.lower()))
+        words = _WORD.findall(text)
+        k = self.shingle_words
+        return {" ".join(words[i:i + k]) for i in range(max(len(words) - k + 1, 0))}
+
+    def signature(self, content: Union[str, bytes]) -> Optional[bytes]:
+        """The packed MinHash signature of `content`, or None when it is too short to compare."""
+        shingles = self.shingles(content)
+        if len(shingles) < self.min_shingles:
+            return None
+        # One permutation hashing: each shingle is hashed once, and its hash's low bits pick the
+        # signature slot that keeps the minimum of the remaining bits (O(shingles), not O(shingles * slots)).
+        slots = self.permutations
+        minima: List[Optional[int]] = [None] * slots
+        for shingle in shingles:
+            h = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+            slot, value = h % slots, (h // slots) & _MAX_HASH
+            if minima[slot] is None or value < minima[slot]:
+                minima[slot] = value
+        # Densification: an empty slot borrows the value of the first filled slot in its own fixed probe
+        # order, so documents with similar shingles still agree on it.
+        values = []
+        for probes in self._probes:
+            values.append(next(minima[slot] for slot in probes if minima[slot] is not None))
+        return struct.pack(self._format, *values)
+
+    def similarity(self, first: bytes, second: bytes) -> float:
+        if len(first) != len(second):
+            return 0.0
+        a = struct.unpack(self._format, first)
+        b = struct.unpack(self._format, second)
+        return sum(x == y for x, y in zip(a, b)) / self.permutations
+
+    def _prefix(self, namespace: str, model_name: str, version: str) -> str:
+        return f"{self.KEY_PREFIX}:{namespace}:{model_name}:{version}"
+
+    def _bucket_keys(self, prefix: str, signature: bytes) -> List[str]:
+        width = self.rows * 4
+        return [f"{prefix}:b{band}:{signature[band * width:(band + 1) * width].hex()}" for band in range(self.bands)]
+
+    # --- Storage (Redis or local) ---
+
+    async def _acandidates(self, bucket_keys: List[str]) -> Dict[str, Optional[bytes]]:
+        """Document key -> stored record (signature followed by the result) for every bucket member."""
+        if not self.memory.is_redis_backed:
+            now = time.monotonic()
+            found = {}
+            for key in bucket_keys:
+                for doc_key in self._buckets.get(key, ()):
+                    item = self._documents.get(doc_key)
+                    found[doc_key] = item[1] + item[2] if item is not None and item[0] >= now else None
+            return found
+        redis = self.memory.async_blob_client
+        pipe = redis.pipeline(transaction=False)
+        for key in bucket_keys:
+            pipe.lrange(key, 0, self.bucket_size - 1)
+        doc_keys = list(dict.fromkeys(
+            member.decode("utf-8") if isinstance(member, bytes) else member
+            for members in await pipe.execute() for member in members))
+        if not doc_keys:
+            return {}
+        return dict(zip(doc_keys, await redis.mget(doc_keys)))
+
+    async def _astore(self, bucket_keys: List[str], doc_key: str, signature: bytes, value: bytes):
+        if not self.memory.is_redis_backed:
+            self._documents[doc_key] = (time.monotonic() + self.ttl_seconds, signature, value)
+            self._documents.move_to_end(doc_key)
+            for key in bucket_keys:
+                self._buckets.setdefault(key, deque(maxlen=self.bucket_size)).appendleft(doc_key)
+            while len(self._documents) > self.max_entries:
+                self._evict_local(*self._documents.popitem(last=False))
+            return
+        pipe = self.memory.async_blob_client.pipeline(transaction=False)
+        pipe.set(doc_key, signature + value, ex=self.ttl_seconds)
+        for key in bucket_keys:
+            pipe.lpush(key, doc_key)
+            pipe.ltrim(key, 0, self.bucket_size - 1)
+            pipe.expire(key, self.ttl_seconds)
+        await pipe.execute()
+
+    def _evict_local(self, doc_key: str, item: tuple):
+        prefix = doc_key.rsplit(":doc:", 1)[0]
+        for key in self._bucket_keys(prefix, item[1]):
+            bucket = self._buckets.get(key)
+            if bucket is not None and doc_key in bucket:
+                bucket.remove(doc_key)
+                if not bucket:
+                    del self._buckets[key]
+
+    # --- Lookups ---
+
+    async def alookup(self, namespace: str, model_name: str, version: str, signature: bytes) -> Optional[NearDuplicateMatch]:
+        """The most similar stored document at or above the threshold, if any."""
+        self.lookups[namespace] = self.lookups.get(namespace, 0) + 1
+        try:
+            candidates = await self._acandidates(self._bucket_keys(self._prefix(namespace, model_name, version), signature))
+        except Exception as e:
+            print(f"NearDuplicateIndex: lookup failed for {namespace}: {e}")
+            return None
+        size = len(signature)
+        best = None
+        for doc_key, record in candidates.items():
+            if not record:
+                continue
+            similarity = self.similarity(signature, record[:size])
+            if similarity >= self.threshold and (best is None or similarity > best.similarity):
+                best = NearDuplicateMatch(doc_key.rsplit(":doc:", 1)[1], similarity, record[size:], len(candidates))
+        if best is not None:
+            self.matches[namespace] = self.matches.get(namespace, 0) + 1
+        return best
+
+    async def aadd(self, namespace: str, model_name: str, version: str, signature: bytes, process_id: str, value: BaseModel):
+        prefix = self._prefix(namespace, model_name, version)
+        try:
+            await self._astore(self._bucket_keys(prefix, signature), f"{prefix}:doc:{process_id}", signature,
+                               value.model_dump_json().encode("utf-8"))
+        except Exception as e:
+            print(f"NearDuplicateIndex: store failed for {namespace}: {e}")
+
+    def trace_entry(self, match: NearDuplicateMatch) -> Dict[str, Any]:
+        return {
+            "matched_process_id": match.process_id,
+            "similarity": round(match.similarity, 3),
+            "threshold": self.threshold,
+            "candidates": match.candidates,
+            "backend": "redis" if self.memory.is_redis_backed else "local",
+        }
+
+    async def aget_or_compute(self, process_id: str, namespace: str, content: Optional[Union[str, bytes]], model_name: str,
+                              version: str, model_cls: Type[T], compute: Callable[[], Awaitable[T]]) -> T:
+        """
+        Returns the result of a near-duplicate of `content` (recorded in the trace as
+        `{namespace}_near_duplicate`), or awaits `compute()` and indexes its result. A None `content`
+        is never matched.
+        """
+        signature = self.signature(content) if content is not None else None
+        if signature is not None:
+            match = await self.alookup(namespace, model_name, version, signature)
+            value = self.parse_match(namespace, match, model_cls)
+            if value is not None:
+                await self.memory.aadd_entry(process_id, f"{namespace}_near_duplicate", self.trace_entry(match))
+                return value
+        value = await compute()
+        if signature is not None:
+            await self.aadd(namespace, model_name, version, signature, process_id, value)
+        return value
+
+    async def aget_or_compute_many(self, process_ids: List[str], namespace: str, contents: List[Optional[Union[str, bytes]]],
+                                   model_name: str, version: str, model_cls: Type[T], compute_many) -> List[Any]:
+        """Batch form of `aget_or_compute`: `compute_many(indices)` is awaited once for every document without a match."""
+        signatures = [self.signature(content) if content is not None else None for content in contents]
+
+        async def alookup(signature: Optional[bytes]) -> Optional[NearDuplicateMatch]:
+            return await self.alookup(namespace, model_name, version, signature) if signature is not None else None
+
+        found = await asyncio.gather(*(alookup(signature) for signature in signatures))
+        results: List[Any] = [None] * len(contents)
+        missing: List[int] = []
+        for i, (process_id, match) in enumerate(zip(process_ids, found)):
+            results[i] = self.parse_match(namespace, match, model_cls)
+            if results[i] is not None:
+                await self.memory.aadd_entry(process_id, f"{namespace}_near_duplicate", self.trace_entry(match))
+            else:
+                missing.append(i)
+
+        if missing:
+            computed = await compute_many(missing)
+            for i, value in zip(missing, computed):
+                results[i] = value
+                if signatures[i] is not None and not isinstance(value, Exception):
+                    await self.aadd(namespace, model_name, version, signatures[i], process_ids[i], value)
+        return results
+
+    @staticmethod
+    def parse_match(namespace: str, match: Optional[NearDuplicateMatch], model_cls: Type[T]) -> Optional[T]:
+        """The matched result as `model_cls`, or None without a match or when the stored entry is unreadable."""
+        if match is None:
+            return None
+        try:
+            return model_cls.model_validate_json(match.value)
+        except Exception as e:
+            print(f"NearDuplicateIndex: discarding unreadable entry for {namespace}: {e}")
+            return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "redis" if self.memory.is_redis_backed else "local",
+            "threshold": self.threshold,
+            "lookups": dict(self.lookups),
+            "matches": dict(self.matches),
+            "local_documents": len(self._documents),
+        }
@@ -0,0 +1,147 @@
+# File: /multi_agent_system/core/prompts.py
+import asyncio
+from typing import Any, Dict, List, Tuple
+
+from langchain_core.prompts import ChatPromptTemplate
+
+from core import deadline, telemetry
+from core.llm_gateway import PRIORITY_EXTRACTION
+from core.result_cache import ResultCache
+
+# Gemini does not expose a local tokenizer; ~4 characters per token is close enough for budgeting.
+CHARS_PER_TOKEN = 4
+TRUNCATION_MARKER = "\n[... truncated ...]"
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def trim_to_token_budget(text: str, max_tokens: int, strategy: str = "paragraphs") -> str:
+    """
+    Trims `text` to roughly `max_tokens`.
+
+    "paragraphs" keeps whole leading blocks (an email's header block, then its first body paragraphs),
+    cutting the first block that does not fit. "head" keeps a plain prefix (the first pages of a PDF).
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    budget = max_chars - len(TRUNCATION_MARKER)
+    if strategy == "head":
+        return text[:budget] + TRUNCATION_MARKER
+
+    kept = []
+    used = 0
+    for block in text.replace("\r\n", "\n").split("\n\n"):
+        if used + len(block) + 2 > budget:
+            remaining = budget - used - 2
+            if remaining > 0:
+                kept.append(block[:remaining])
+            break
+        kept.append(block)
+        used += len(block) + 2
+    return "\n\n".join(kept) + TRUNCATION_MARKER
+
+
+class CompiledPrompt:
+    """
+    A prompt whose static parts (few-shot examples, format instructions) are bound once, with the
+    `prompt | llm | parser` chain composed once, and a token budget for the single variable input.
+
+    `ainvoke`/`abatch` return the parsed result (or the exception) together with token usage, taken
+    from the provider's usage metadata when present and estimated otherwise. Calls are timed as the
+    `stage` span of `agent` and their tokens counted in the metrics. With a `gateway`, every call
+    (batched ones included) is admitted by the gateway's limiter for `model_name` at `priority`.
+    """
+
+    def __init__(self, prompt: ChatPromptTemplate, llm, parser, input_key: str, token_budget: int,
+                 trim_strategy: str = "paragraphs", agent: str = "llm", stage: str = "llm_call",
+                 gateway=None, model_name: str = "", priority: int = PRIORITY_EXTRACTION, **static_variables: str):
+        self.input_key = input_key
+        self.agent = agent
+        self.stage = stage
+        self.gateway = gateway
+        self.model_name = model_name
+        self.priority = priority
+        self.token_budget = token_budget
+        self.trim_strategy = trim_strategy
+        self.prompt = prompt.partial(**static_variables)
+        self.parser = parser
+        self.llm_chain = self.prompt | llm
+        self.chain = self.llm_chain | parser
+        self.version = ResultCache.prompt_version(prompt.pretty_repr(), *(static_variables[k] for k in sorted(static_variables)))
+        static_messages = self.prompt.format_messages(**{input_key: ""})
+        self.static_tokens = sum(estimate_tokens(str(m.content)) for m in static_messages)
+
+    def trim(self, text: str) -> str:
+        return trim_to_token_budget(text, self.token_budget, self.trim_strategy)
+
+    def _usage(self, text: str, message: Any) -> Dict[str, Any]:
+        metadata = getattr(message, "usage_metadata", None)
+        if metadata:
+            return {"prompt_tokens": metadata.get("input_tokens"), "completion_tokens": metadata.get("output_tokens"), "source": "provider"}
+        completion = str(message.content) if hasattr(message, "content") else ""
+        return {
+            "prompt_tokens": self.static_tokens + estimate_tokens(text),
+            "completion_tokens": estimate_tokens(completion),
+            "source": "estimate",
+        }
+
+    async def _aparse(self, text: str, message: Any) -> Tuple[Any, Dict[str, Any]]:
+        if isinstance(message, Exception):
+            return message, {"prompt_tokens": self.static_tokens + estimate_tokens(text), "completion_tokens": 0, "source": "estimate"}
+        usage = self._usage(text, message)
+        try:
+            return await self.parser.ainvoke(message), usage
+        except Exception as e:
+            return e, usage
+
+    async def _acall(self, text: str, info: Dict[str, Any]) -> Any:
+        if self.gateway is None:
+            return await self.llm_chain.ainvoke({self.input_key: text})
+        return await self.gateway.acall(
+            self.model_name, self.priority, self.static_tokens + estimate_tokens(text),
+            lambda: self.llm_chain.ainvoke({self.input_key: text}), agent=self.agent, info=info)
+
+    async def ainvoke(self, text: str) -> Tuple[Any, Dict[str, Any]]:
+        """`text` should already be trimmed; returns (parsed result or exception, usage)."""
+        info: Dict[str, Any] = {}
+        with telemetry.span(self.stage, self.agent) as span:
+            try:
+                message = await self._acall(text, info)
+            except Exception as e:
+                message = e
+            result, usage = await self._aparse(text, message)
+            usage.update(info)  # gateway attempts / hedging, shown with the usage in the trace
+            if isinstance(message, deadline.DeadlineExceeded):
+                span["outcome"] = "deadline_exceeded"
+            elif isinstance(result, Exception):
+                span["outcome"] = "error" if isinstance(message, Exception) else "invalid_output"
+        telemetry.record_llm_usage(self.agent, usage)
+        return result, usage
+
+    async def abatch(self, texts: List[str], max_concurrency: int) -> List[Tuple[Any, Dict[str, Any]]]:
+        infos: List[Dict[str, Any]] = [{} for _ in texts]
+        with telemetry.span(f"{self.stage}_batch", self.agent):
+            if self.gateway is None:
+                messages = await self.llm_chain.abatch(
+                    [{self.input_key: text} for text in texts],
+                    config={"max_concurrency": max_concurrency},
+                    return_exceptions=True,
+                )
+            else:
+                # Individual calls, so each one is admitted (and prioritized) by the gateway.
+                slots = asyncio.Semaphore(max_concurrency)
+
+                async def call(text: str, info: Dict[str, Any]):
+                    async with slots:
+                        return await self._acall(text, info)
+
+                messages = await asyncio.gather(*(call(text, info) for text, info in zip(texts, infos)), return_exceptions=True)
+        results = [await self._aparse(text, message) for text, message in zip(texts, messages)]
+        for (_, usage), info in zip(results, infos):
+            usage.update(info)
+        for _, usage in results:
+            telemetry.record_llm_usage(self.agent, usage)
+        return results
@@ -0,0 +1,157 @@
+# File: /multi_agent_system/core/result_cache.py
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Type, TypeVar, Union
+
+from pydantic import BaseModel
+
+T = TypeVar("T", bound=BaseModel)
+
+
+class LRUTTLCache:
+    """Bounded in-process cache: least-recently-used eviction plus a per-entry TTL."""
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ResultCache:
+    """
+    Content-addressed cache for parsed LLM results.
+
+    Keys combine a hash of the normalized input with the model name and a prompt version, so
+    editing a prompt, the few-shot examples or the output schema invalidates old entries.
+    Values live in Redis (via SharedMemory) when it is available, otherwise in a local LRU.
+    """
+
+    KEY_PREFIX = "cache"
+
+    def __init__(self, memory_instance, max_entries: int = 2048, ttl_seconds: int = 86400):
+        self.memory = memory_instance
+        self.ttl_seconds = ttl_seconds
+        self.local = LRUTTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+
+    @staticmethod
+    def prompt_version(*parts: Any) -> str:
+        """Fingerprint of everything that shapes the LLM output (templates, examples, schema)."""
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+            digest.update(b"\x00")
+        return digest.hexdigest()[:16]
+
+    @staticmethod
+    def normalize(content: Union[str, bytes]) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        lines = content.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+        return "\n".join(line.rstrip() for line in lines).strip().encode("utf-8")
+
+    def make_key(self, namespace: str, content: Union[str, bytes], model_name: str, version: str) -> str:
+        content_hash = hashlib.sha256(self.normalize(content)).hexdigest()
+        return f"{self.KEY_PREFIX}:{namespace}:{model_name}:{version}:{content_hash}"
+
+    async def aget(self, namespace: str, key: str, model_cls: Type[T]) -> Optional[T]:
+        raw = None
+        try:
+            if self.memory.is_redis_backed:
+                raw = await self.memory.aget_cache_value(key)
+            else:
+                raw = self.local.get(key)
+        except Exception as e:
+            print(f"ResultCache: lookup failed for {namespace}: {e}")
+
+        value = None
+        if raw is not None:
+            try:
+                value = model_cls.model_validate_json(raw)
+            except Exception as e:
+                # A stale or corrupt entry behaves like a miss and is overwritten on the next set.
+                print(f"ResultCache: discarding unreadable entry for {namespace}: {e}")
+
+        counters = self.hits if value is not None else self.misses
+        counters[namespace] = counters.get(namespace, 0) + 1
+        return value
+
+    async def aset(self, namespace: str, key: str, value: BaseModel):
+        raw = value.model_dump_json()
+        try:
+            if self.memory.is_redis_backed:
+                await self.memory.aset_cache_value(key, raw, self.ttl_seconds)
+            else:
+                self.local.set(key, raw)
+        except Exception as e:
+            print(f"ResultCache: store failed for {namespace}: {e}")
+
+    def trace_entry(self, namespace: str, key: str, hit: bool) -> Dict[str, Any]:
+        return {
+            "hit": hit,
+            "key": key,
+            "hits": self.hits.get(namespace, 0),
+            "misses": self.misses.get(namespace, 0),
+            "backend": "redis" if self.memory.is_redis_backed else "local_lru",
+        }
+
+    async def aget_or_compute(self, process_id: str, namespace: str, content: Union[str, bytes],
+                              model_name: str, version: str, model_cls: Type[T], compute) -> T:
+        """Returns the cached result for `content`, or awaits `compute()` and caches its result.
+
+        Hit/miss counters are written to the process trace as `{namespace}_cache`.
+        """
+        key = self.make_key(namespace, content, model_name, version)
+        value = await self.aget(namespace, key, model_cls)
+        await self.memory.aadd_entry(process_id, f"{namespace}_cache", self.trace_entry(namespace, key, value is not None))
+        if value is not None:
+            return value
+        value = await compute()
+        await self.aset(namespace, key, value)
+        return value
+
+    async def aget_or_compute_many(self, process_ids: List[str], namespace: str, contents: List[Union[str, bytes]],
+                                   model_name: str, version: str, model_cls: Type[T], compute_many) -> List[Any]:
+        """Batch form of `aget_or_compute`.
+
+        `compute_many(indices)` is awaited once with the positions of every miss and must return one
+        result (or exception) per position; exceptions are passed through and never cached.
+        """
+        keys = [self.make_key(namespace, content, model_name, version) for content in contents]
+        results: List[Any] = [None] * len(contents)
+        missing: List[int] = []
+        for i, (process_id, key) in enumerate(zip(process_ids, keys)):
+            results[i] = await self.aget(namespace, key, model_cls)
+            await self.memory.aadd_entry(process_id, f"{namespace}_cache", self.trace_entry(namespace, key, results[i] is not None))
+            if results[i] is None:
+                missing.append(i)
+
+        if missing:
+            computed = await compute_many(missing)
+            for i, value in zip(missing, computed):
+                results[i] = value
+                if not isinstance(value, Exception):
+                    await self.aset(namespace, keys[i], value)
+        return results
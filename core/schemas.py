@@ -0,0 +1,64 @@
+# File: /multi_agent_system/core/schemas.py
+import json
+from typing import Any, Dict, List, Optional, Tuple, Type, Union
+
+from pydantic import BaseModel, TypeAdapter
+
+try:
+    import orjson
+except ImportError:  # optional speed-up; the stdlib decoder is used without it
+    orjson = None
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    """Parses JSON with orjson when installed, else `json`; both raise a `json.JSONDecodeError` subclass."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(value: Any) -> bytes:
+    """Compact JSON as UTF-8 bytes, with orjson when installed (non-string keys are stringified by both)."""
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+class RegisteredSchema:
+    """One webhook `event_type`: its envelope model, compiled once into a TypeAdapter, and its intent."""
+
+    def __init__(self, event_type: str, model: Type[BaseModel], intent: str):
+        self.event_type = event_type
+        self.model = model
+        self.intent = intent
+        self.adapter = TypeAdapter(model)
+
+    def validate(self, payload: Dict[str, Any]) -> BaseModel:
+        """Raises pydantic.ValidationError when the payload does not fit."""
+        return self.adapter.validate_python(payload)
+
+
+class SchemaRegistry:
+    """
+    Webhook schemas keyed by `event_type`. A parsed JSON object whose `event_type` is registered is
+    classified without the LLM (format JSON, the registered intent) and validated by the JSON agent
+    against that event type's compiled adapter; unregistered event types are reported as anomalies.
+    """
+
+    def __init__(self, schemas: Optional[Dict[str, Tuple[Type[BaseModel], str]]] = None):
+        self._schemas: Dict[str, RegisteredSchema] = {}
+        for event_type, (model, intent) in (schemas or {}).items():
+            self.register(event_type, model, intent)
+
+    def register(self, event_type: str, model: Type[BaseModel], intent: str = "Unknown"):
+        self._schemas[event_type] = RegisteredSchema(event_type, model, intent)
+
+    def match(self, payload: Any) -> Optional[RegisteredSchema]:
+        if not isinstance(payload, dict):
+            return None
+        event_type = payload.get("event_type")
+        return self._schemas.get(event_type) if isinstance(event_type, str) else None
+
+    @property
+    def event_types(self) -> List[str]:
+        return list(self._schemas)
@@ -0,0 +1,180 @@
+# File: /multi_agent_system/core/sniffing.py
+import os
+import re
+from typing import Callable, FrozenSet, List, NamedTuple, Optional, Tuple, Union
+
+# Bytes a detector may look at; uploads keep exactly this much as their sniffing prefix.
+SNIFF_PREFIX_BYTES = int(os.getenv("SNIFF_PREFIX_BYTES", str(64 * 1024)))
+# Header blocks and CSV rows are only looked for near the start.
+HEADER_WINDOW_BYTES = 8192
+
+_WHITESPACE = b" \t\r\n"
+_UTF8_BOM = b"\xef\xbb\xbf"
+# RFC 5322 field name: printable ASCII except ":", then the colon.
+_HEADER_FIELD = re.compile(rb"([!-9;-~]+):")
+
+
+class SniffResult(NamedTuple):
+    format: str  # what the payload looks like, e.g. "PDF", "MIME", "CSV"
+    route: str  # the agent format it is routed as: "Email", "JSON", "PDF" or "Unknown"
+    confidence: float
+
+
+# detector(prefix, total_size) -> confidence in (0, 1], or None when the format does not match.
+Detector = Callable[[memoryview, int], Optional[float]]
+
+
+def _skip_whitespace(view: memoryview, start: int = 0) -> int:
+    if start == 0 and view[:3] == _UTF8_BOM:
+        start = 3
+    end = min(len(view), start + 1024)
+    while start < end and view[start] in _WHITESPACE:
+        start += 1
+    return start
+
+
+def _header_names(view: memoryview) -> Optional[FrozenSet[str]]:
+    """Lower-cased field names of a leading RFC 822 header block, or None if the payload does not start with one."""
+    window = view[_skip_whitespace(view):HEADER_WINDOW_BYTES].tobytes()
+    names = set()
+    for index, line in enumerate(window.split(b"\n")):
+        line = line.rstrip(b"\r")
+        if not line:
+            break  # end of the header block
+        if line[:1] in (b" ", b"\t"):
+            if not names:
+                return None
+            continue  # folded continuation of the previous field
+        if index == 0 and line.startswith(b"From "):
+            continue  # mbox separator line
+        match = _HEADER_FIELD.match(line)
+        if match is None:
+            return None
+        names.add(match.group(1).decode("ascii").lower())
+    return frozenset(names) if names else None
+
+
+def detect_pdf(view: memoryview, total_size: int) -> Optional[float]:
+    # The spec allows junk before the marker as long as it is within the first KiB.
+    position = view[:1024].tobytes().find(b"%PDF-")
+    if position == 0:
+        return 1.0
+    return 0.9 if position > 0 else None
+
+
+def detect_json(view: memoryview, total_size: int) -> Optional[float]:
+    start = _skip_whitespace(view)
+    if start >= len(view) or view[start] not in b"{[":
+        return None
+    opener = view[start]
+    following = _skip_whitespace(view, start + 1)
+    if following < len(view):
+        allowed = b'"}' if opener == ord("{") else b'{["-0123456789tfn]'
+        if view[following] not in allowed:
+            return None
+    if total_size > len(view):
+        return 0.85  # the closing bracket is beyond the prefix
+    end = len(view) - 1
+    while end > start and view[end] in _WHITESPACE:
+        end -= 1
+    closer = ord("}") if opener == ord("{") else ord("]")
+    return 0.95 if view[end] == closer else None
+
+
+def detect_mime(view: memoryview, total_size: int) -> Optional[float]:
+    """Raw EML / MIME messages: a header block declaring MIME content."""
+    names = _header_names(view)
+    if names and ("mime-version" in names or ("content-type" in names and names & {"from", "to", "received"})):
+        return 0.97
+    return None
+
+
+def detect_email(view: memoryview, total_size: int) -> Optional[float]:
+    names = _header_names(view)
+    if names and "from" in names:
+        return 0.95 if names & {"subject", "to", "date", "message-id", "received"} else 0.7
+    # Pasted emails whose headers are not at the very top.
+    window = view[:HEADER_WINDOW_BYTES].tobytes()
+    if b"From:" in window and b"Subject:" in window and b"@" in window:
+        return 0.6
+    return None
+
+
+def detect_xml(view: memoryview, total_size: int) -> Optional[float]:
+    start = _skip_whitespace(view)
+    if view[start:start + 5] == b"<?xml":
+        return 1.0
+    if start + 1 < len(view) and view[start] == ord("<") and (chr(view[start + 1]).isalpha() or view[start + 1] == ord("!")):
+        window = view[start:start + HEADER_WINDOW_BYTES].tobytes()
+        if b"</" in window or b"/>" in window:
+            return 0.7
+    return None
+
+
+def detect_csv(view: memoryview, total_size: int) -> Optional[float]:
+    window = view[:HEADER_WINDOW_BYTES].tobytes()
+    rows = window.split(b"\n")
+    if total_size > len(window):
+        rows = rows[:-1]  # possibly cut off
+    rows = [row.rstrip(b"\r") for row in rows if row.strip()][:20]
+    if len(rows) < 2:
+        return None
+    best = None
+    for delimiter in (b",", b";", b"\t", b"|"):
+        columns = rows[0].count(delimiter)
+        if columns == 0:
+            continue
+        # Quoted fields may contain the delimiter, so a few irregular rows are tolerated.
+        matching = sum(1 for row in rows if row.count(delimiter) == columns)
+        if matching >= 0.8 * len(rows):
+            confidence = min(0.8, 0.5 + 0.03 * len(rows))
+            best = max(best or 0.0, confidence)
+    return best
+
+
+class FormatSniffer:
+    """
+    Guesses a payload's format from a bounded prefix, without decoding or copying the payload.
+
+    Detectors receive a memoryview over at most `prefix_bytes` bytes and the payload's total size,
+    and return a confidence; the most confident match wins (a certain one, 1.0, ends the search).
+    Each format is registered with the agent format it is routed as, so new formats can be
+    recognised (and shown in the trace) before any agent handles them:
+
+        sniffer.register("YAML", "Unknown", detect_yaml)
+    """
+
+    def __init__(self, prefix_bytes: int = SNIFF_PREFIX_BYTES):
+        self.prefix_bytes = prefix_bytes
+        self._detectors: List[Tuple[str, str, Detector]] = []
+
+    def register(self, format: str, route: str, detector: Detector):
+        self._detectors.append((format, route, detector))
+
+    @classmethod
+    def default(cls) -> "FormatSniffer":
+        sniffer = cls()
+        sniffer.register("PDF", "PDF", detect_pdf)
+        sniffer.register("JSON", "JSON", detect_json)
+        sniffer.register("MIME", "Email", detect_mime)
+        sniffer.register("Email", "Email", detect_email)
+        sniffer.register("XML", "Unknown", detect_xml)
+        sniffer.register("CSV", "Unknown", detect_csv)
+        return sniffer
+
+    def sniff(self, data: Union[bytes, bytearray, memoryview, str], total_size: Optional[int] = None) -> SniffResult:
+        """`data` is the payload or its prefix; pass `total_size` when it is only a prefix."""
+        if isinstance(data, str):
+            # Bounded: at most prefix_bytes characters are encoded.
+            total_size = len(data) if total_size is None else total_size
+            data = data[:self.prefix_bytes].encode("utf-8", errors="ignore")
+        view = memoryview(data)[:self.prefix_bytes]
+        total_size = len(data) if total_size is None else total_size
+        best = SniffResult("Unknown", "Unknown", 0.0)
+        for format, route, detector in self._detectors:
+            confidence = detector(view, total_size)
+            if confidence is not None and confidence > best.confidence:
+                best = SniffResult(format, route, confidence)
+                if confidence >= 1.0:
+                    break
+        return best
@@ -0,0 +1,343 @@
+# File: /multi_agent_system/core/telemetry.py
+import bisect
+import cProfile
+import os
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# Fraction of documents whose processing is profiled with cProfile (0 disables profiling).
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+# Seconds; spans range from sub-millisecond memory writes to multi-second LLM calls.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labelvalues, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value: float, *labelvalues: str):
+        with self._lock:
+            self._values[labelvalues] = value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str], buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labelvalues -> [per-bucket counts (non-cumulative, last one is +Inf), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labelvalues, (counts, total) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labelvalues, le)} {cumulative}")
+                labels = _format_labels(self.labelnames, labelvalues)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Process-local metrics rendered in the Prometheus text exposition format (`GET /metrics`)."""
+
+    def __init__(self):
+        self._metrics: List[Any] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str]) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str]) -> Gauge:
+        metric = Gauge(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str], buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    "document_stage_duration_seconds", "Duration of one processing stage (classifier call, PDF parse, memory write, ...).",
+    ["stage", "agent", "format", "intent", "outcome"])
+DOCUMENT_SECONDS = registry.histogram(
+    "document_processing_duration_seconds", "Classification plus agent processing time per document.",
+    ["format", "intent", "outcome"])
+DOCUMENTS = registry.counter(
+    "documents_processed_total", "Documents run through classification and agent processing.",
+    ["format", "intent", "outcome"])
+LLM_TOKENS = registry.counter(
+    "llm_tokens_total", "Tokens sent to and received from the LLM (provider-reported or estimated).",
+    ["agent", "kind"])
+LLM_WAIT_SECONDS = registry.histogram(
+    "llm_gateway_wait_seconds", "Time an LLM call waited in the gateway queue for a concurrency slot and rate budget.",
+    ["model", "priority"])
+LLM_REQUESTS = registry.counter(
+    "llm_gateway_requests_total", "LLM calls made through the gateway by outcome (ok, error, rate_limited) plus retries and hedges issued.",
+    ["model", "outcome"])
+LLM_QUEUE_DEPTH = registry.gauge(
+    "llm_gateway_queue_depth", "LLM calls waiting in the gateway queue.", ["model", "priority"])
+LLM_CONCURRENCY_LIMIT = registry.gauge(
+    "llm_gateway_concurrency_limit", "Current adaptive concurrency limit of the gateway.", ["model"])
+ACTION_SECONDS = registry.histogram(
+    "action_duration_seconds", "Duration of one downstream call for a batch of same-type actions, including retries.",
+    ["action_type", "outcome"])
+ACTIONS = registry.counter(
+    "actions_total", "Follow-up actions by final status.",
+    ["action_type", "outcome"])
+STARTUP_SECONDS = registry.gauge(
+    "process_startup_phase_seconds", "Time this process spent in each startup phase (import, redis_connect, agents, ...).",
+    ["phase"])
+RESIDENT_MEMORY = registry.gauge(
+    "process_resident_memory_bytes", "Resident memory of this process, sampled at startup milestones.", ["at"])
+
+
+class StageTimer:
+    """Spans recorded while processing one document, written to its trace as `stage_timings`."""
+
+    def __init__(self, process_id: str):
+        self.process_id = process_id
+        self.started = time.perf_counter()
+        self.labels = {"format": "unknown", "intent": "unknown"}
+        self.spans: List[Dict[str, Any]] = []
+
+    def summary(self) -> Dict[str, Any]:
+        # Spans are appended as they end; listed by start time, enclosing spans precede their children.
+        return {"total_ms": round((time.perf_counter() - self.started) * 1000, 2),
+                "spans": sorted(self.spans, key=lambda s: s["start_ms"])}
+
+
+# The timer of the document being processed; child tasks (asyncio.gather) inherit it.
+_current_timer: ContextVar[Optional[StageTimer]] = ContextVar("stage_timer", default=None)
+
+
+@contextmanager
+def track(process_id: str) -> Iterator[StageTimer]:
+    """Collects the spans of everything run inside the block for `process_id`."""
+    timer = StageTimer(process_id)
+    token = _current_timer.set(timer)
+    try:
+        yield timer
+    finally:
+        _current_timer.reset(token)
+
+
+def set_labels(**labels: str):
+    """Labels (format, intent) applied to the current document's later spans, e.g. once it is classified."""
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.labels.update(labels)
+
+
+@contextmanager
+def span(stage: str, agent: str = "pipeline") -> Iterator[Dict[str, str]]:
+    """
+    Times the block as `stage` of `agent`: observed in `document_stage_duration_seconds` and, inside
+    `track()`, appended to the document's spans. Yields a dict whose "outcome" the block may override
+    (it defaults to "ok", or "error"/"cancelled" when the block raises).
+    """
+    result = {"outcome": "ok"}
+    if not METRICS_ENABLED:
+        yield result
+        return
+    start = time.perf_counter()
+    try:
+        yield result
+    except Exception:
+        result["outcome"] = "error"
+        raise
+    except BaseException:
+        result["outcome"] = "cancelled"
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        timer = _current_timer.get()
+        labels = timer.labels if timer is not None else {}
+        STAGE_SECONDS.observe(duration, stage, agent, labels.get("format", "unknown"), labels.get("intent", "unknown"), result["outcome"])
+        if timer is not None:
+            timer.spans.append({
+                "stage": stage, "agent": agent, "outcome": result["outcome"],
+                "start_ms": round((start - timer.started) * 1000, 2), "duration_ms": round(duration * 1000, 2),
+            })
+
+
+def record_document(timer: StageTimer, outcome: str):
+    if METRICS_ENABLED:
+        DOCUMENT_SECONDS.observe(time.perf_counter() - timer.started, timer.labels["format"], timer.labels["intent"], outcome)
+        DOCUMENTS.inc(timer.labels["format"], timer.labels["intent"], outcome)
+
+
+def record_llm_usage(agent: str, usage: Dict[str, Any]):
+    if METRICS_ENABLED:
+        LLM_TOKENS.inc(agent, "prompt", amount=usage.get("prompt_tokens") or 0)
+        LLM_TOKENS.inc(agent, "completion", amount=usage.get("completion_tokens") or 0)
+
+
+def record_action(action_type: str, outcome: str, duration: float, count: int):
+    if METRICS_ENABLED:
+        ACTION_SECONDS.observe(duration, action_type, outcome)
+        ACTIONS.inc(action_type, outcome, amount=count)
+
+
+_profiling = threading.Lock()
+
+
+@contextmanager
+def maybe_profile(process_id: str) -> Iterator[Optional[str]]:
+    """
+    Profiles the block with cProfile for a PROFILE_SAMPLE_RATE sample of documents and yields the
+    .prof path (None when not sampled). At most one profile runs at a time, and since the profiler
+    follows the thread, it also captures whatever else the event loop runs meanwhile.
+    """
+    if PROFILE_SAMPLE_RATE <= 0 or random.random() >= PROFILE_SAMPLE_RATE or not _profiling.acquire(blocking=False):
+        yield None
+        return
+    path = os.path.join(PROFILE_DIR, f"{process_id}.prof")
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+        try:
+            yield path
+        finally:
+            profiler.disable()
+            try:
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                profiler.dump_stats(path)
+            except OSError as e:
+                print(f"Telemetry: Could not write profile {path}: {e}")
+    finally:
+        _profiling.release()
+
+
+def resident_memory_bytes() -> Optional[int]:
+    """Current resident set size (Linux), else the peak RSS where the `resource` module exists, else None."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # bytes on macOS, KiB elsewhere
+
+
+class StartupProfile:
+    """
+    Where this process's startup time went, phase by phase, and its resident memory at each milestone.
+    Reported under `startup` in /health and as `process_startup_phase_seconds` in /metrics, so cold
+    starts can be compared across deployments and worker counts.
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.memory: Dict[str, Optional[int]] = {}
+        self.ready_after: Optional[float] = None
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, seconds: float):
+        self.phases[name] = round(seconds, 4)
+        if METRICS_ENABLED:
+            STARTUP_SECONDS.set(seconds, name)
+
+    def sample_memory(self, at: str):
+        self.memory[at] = resident_memory_bytes()
+        if METRICS_ENABLED and self.memory[at] is not None:
+            RESIDENT_MEMORY.set(self.memory[at], at)
+
+    def mark_ready(self):
+        self.ready_after = round(time.perf_counter() - self._started, 4)
+        self.sample_memory("ready")
+
+    @property
+    def ready(self) -> bool:
+        return self.ready_after is not None
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "pid": os.getpid(),
+            "started_at": self.started_at,
+            "ready": self.ready,
+            "ready_after_seconds": self.ready_after,
+            "phases_seconds": dict(self.phases),
+            "resident_memory_bytes": {**self.memory, "now": resident_memory_bytes()},
+        }
@@ -0,0 +1,196 @@
+# File: /multi_agent_system/core/trace_codec.py
+import hashlib
+import json
+import os
+import zlib
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, Set, Union
+
+from core import schemas
+
+# Stored values at least this large are zlib-compressed (kept only when that is actually smaller).
+TRACE_COMPRESS_MIN_BYTES = int(os.getenv("TRACE_COMPRESS_MIN_BYTES", "1024"))
+# Objects and lists at least this large (serialized) are stored once per trace and referenced.
+TRACE_REF_MIN_BYTES = int(os.getenv("TRACE_REF_MIN_BYTES", "256"))
+# Longer strings are truncated before they are stored.
+TRACE_MAX_STRING_CHARS = int(os.getenv("TRACE_MAX_STRING_CHARS", "8192"))
+
+# One-byte tags in front of every stored value; untagged values are plain JSON from older releases.
+_TAG_JSON = b"\x00"
+_TAG_ZLIB = b"\x01"
+
+REF_KEY = "$ref"
+# Wraps user objects that would otherwise read as a reference (JSON Schema and OpenAPI use {"$ref": ...}).
+LIT_KEY = "$lit"
+BLOB_PREFIX = "$blob:"
+
+
+class EncodedEntry(NamedTuple):
+    fields: Dict[str, bytes]  # the entry's own field plus the blob fields it references
+    json: str  # the entry's full value as JSON, for live trace events
+
+
+class TraceCodec:
+    """
+    Compact storage for trace entries.
+
+    Values are stored as compact JSON (orjson when installed) behind a one-byte tag, zlib-compressed
+    from `compress_min_bytes` on. Every object or list of at least `ref_min_bytes` is moved into a
+    content-addressed `$blob:<digest>` field of the same trace and replaced by `{"$ref": digest}`, so a
+    payload repeated across entries (an agent's output and the action that carries it) is stored once.
+    User objects shaped like a reference or an escape (a single `$ref` or `$lit` key) are stored
+    wrapped as `{"$lit": object}`, so they are never taken for a reference. Strings longer than
+    `max_string_chars` are truncated. Decoding resolves the references, so readers get the logical
+    entries back.
+    """
+
+    def __init__(self, compress_min_bytes: int = TRACE_COMPRESS_MIN_BYTES, ref_min_bytes: int = TRACE_REF_MIN_BYTES,
+                 max_string_chars: int = TRACE_MAX_STRING_CHARS):
+        self.compress_min_bytes = compress_min_bytes
+        self.ref_min_bytes = ref_min_bytes
+        self.max_string_chars = max_string_chars
+
+    def _cap(self, value: Any) -> Any:
+        if isinstance(value, str):
+            if len(value) > self.max_string_chars:
+                return f"{value[:self.max_string_chars]}... [{len(value) - self.max_string_chars} chars truncated]"
+            return value
+        if isinstance(value, dict):
+            return {key: self._cap(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self._cap(item) for item in value]
+        return value
+
+    def _pack(self, serialized: bytes) -> bytes:
+        if len(serialized) >= self.compress_min_bytes:
+            compressed = zlib.compress(serialized, 6)
+            if len(compressed) < len(serialized):
+                return _TAG_ZLIB + compressed
+        return _TAG_JSON + serialized
+
+    def unpack(self, raw: Union[bytes, str]) -> Any:
+        """One stored value, with references left unresolved."""
+        if isinstance(raw, str):
+            return json.loads(raw)
+        tag = raw[:1]
+        if tag == _TAG_ZLIB:
+            return schemas.loads(zlib.decompress(raw[1:]))
+        if tag == _TAG_JSON:
+            return schemas.loads(raw[1:])
+        return schemas.loads(raw)
+
+    def _dedupe(self, value: Any, blobs: Dict[str, bytes]) -> Any:
+        # Children first, so a blob holds references to the blobs nested in it rather than copies.
+        if isinstance(value, dict):
+            value = {key: self._dedupe(item, blobs) for key, item in value.items()}
+            if len(value) == 1 and (REF_KEY in value or LIT_KEY in value):
+                value = {LIT_KEY: value}
+        elif isinstance(value, list):
+            value = [self._dedupe(item, blobs) for item in value]
+        else:
+            return value
+        serialized = schemas.dumps(value)
+        if len(serialized) < self.ref_min_bytes:
+            return value
+        digest = hashlib.blake2b(serialized, digest_size=8).hexdigest()
+        blobs[BLOB_PREFIX + digest] = self._pack(serialized)
+        return {REF_KEY: digest}
+
+    def encode(self, key: str, data: Any) -> EncodedEntry:
+        """Raises TypeError (or ValueError) for values that are not JSON-serializable."""
+        capped = self._cap(data)
+        blobs: Dict[str, bytes] = {}
+        stored = self._dedupe(capped, blobs)
+        blobs[key] = self._pack(schemas.dumps(stored))
+        return EncodedEntry(blobs, schemas.dumps(capped).decode("utf-8"))
+
+    @staticmethod
+    def _ref(value: Any):
+        if isinstance(value, dict) and len(value) == 1 and isinstance(value.get(REF_KEY), str):
+            return value[REF_KEY]
+        return None
+
+    @staticmethod
+    def _literal(value: Any) -> Optional[Dict[str, Any]]:
+        if isinstance(value, dict) and len(value) == 1 and isinstance(value.get(LIT_KEY), dict):
+            return value[LIT_KEY]
+        return None
+
+    def refs(self, value: Any) -> Set[str]:
+        """Digests referenced anywhere in an unpacked value."""
+        digest = self._ref(value)
+        if digest is not None:
+            return {digest}
+        found: Set[str] = set()
+        literal = self._literal(value)
+        if literal is not None:
+            value = literal
+        items = value.values() if isinstance(value, dict) else value if isinstance(value, list) else ()
+        for item in items:
+            found |= self.refs(item)
+        return found
+
+    def resolve(self, value: Any, blobs: Mapping[str, bytes], resolved: Dict[str, Any]) -> Any:
+        """
+        Replaces references with their blobs (digest -> stored value) and unwraps escaped objects; unknown
+        references are left as they are.
+        """
+        digest = self._ref(value)
+        if digest is not None:
+            if digest not in resolved:
+                raw = blobs.get(digest)
+                if raw is None:
+                    return value
+                resolved[digest] = self.resolve(self.unpack(raw), blobs, resolved)
+            return resolved[digest]
+        literal = self._literal(value)
+        if literal is not None:
+            return {key: self.resolve(item, blobs, resolved) for key, item in literal.items()}
+        if isinstance(value, dict):
+            return {key: self.resolve(item, blobs, resolved) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.resolve(item, blobs, resolved) for item in value]
+        return value
+
+    def decode_entries(self, raw: Mapping[Union[bytes, str], Union[bytes, str]]) -> Dict[str, Any]:
+        """A whole stored trace (as returned by HGETALL) back to its logical entries."""
+        blobs: Dict[str, bytes] = {}
+        stored: Dict[str, Any] = {}
+        for field, value in raw.items():
+            field = field.decode("utf-8") if isinstance(field, bytes) else field
+            if field.startswith(BLOB_PREFIX):
+                blobs[field[len(BLOB_PREFIX):]] = value
+            else:
+                stored[field] = value
+        resolved: Dict[str, Any] = {}
+        entries = {}
+        for key, value in stored.items():
+            try:
+                entries[key] = self.resolve(self.unpack(value), blobs, resolved)
+            except (ValueError, zlib.error):
+                entries[key] = value.decode("utf-8", errors="replace") if isinstance(value, bytes) else value
+        return entries
+
+    def unreferenced_blobs(self, raw: Mapping[Union[bytes, str], Union[bytes, str]]) -> List[str]:
+        """The `$blob:` fields of a stored trace that no entry references any more, directly or through other blobs."""
+        blobs: Dict[str, Union[bytes, str]] = {}
+        pending: List[str] = []
+        for field, value in raw.items():
+            field = field.decode("utf-8") if isinstance(field, bytes) else field
+            if field.startswith(BLOB_PREFIX):
+                blobs[field[len(BLOB_PREFIX):]] = value
+                continue
+            try:
+                pending.extend(self.refs(self.unpack(value)))
+            except (ValueError, zlib.error):
+                continue
+        reachable: Set[str] = set()
+        while pending:
+            digest = pending.pop()
+            if digest in reachable or digest not in blobs:
+                continue
+            reachable.add(digest)
+            try:
+                pending.extend(self.refs(self.unpack(blobs[digest])))
+            except (ValueError, zlib.error):
+                continue
+        return [BLOB_PREFIX + digest for digest in blobs if digest not in reachable]
@@ -0,0 +1,87 @@
+# File: /multi_agent_system/core/trace_events.py
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Set
+
+
+def encode_event(process_id: str, fields: Dict[str, str]) -> str:
+    """Builds the event payload from already-serialized entry values, without re-encoding them."""
+    entries = ",".join(f"{json.dumps(key)}:{value}" for key, value in fields.items())
+    return f'{{"process_id":{json.dumps(process_id)},"entries":{{{entries}}}}}'
+
+
+class TraceEvents:
+    """
+    Fan-out of trace writes to live subscribers (the `/trace/{process_id}/events` stream).
+
+    With Redis, SharedMemory publishes every flushed batch of entries on `trace-events:{process_id}`
+    inside the same pipeline as the write, and each API process keeps one pub/sub connection that
+    subscribes only to the channels its local clients are watching. Without Redis, writes are
+    handed to local subscribers directly.
+    """
+
+    CHANNEL_PREFIX = "trace-events:"
+
+    def __init__(self, async_redis_client=None):
+        self.redis = async_redis_client
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._pubsub = None
+        self._reader: Optional[asyncio.Task] = None
+
+    def channel(self, process_id: str) -> str:
+        return f"{self.CHANNEL_PREFIX}{process_id}"
+
+    def has_local_subscribers(self, process_id: str) -> bool:
+        return process_id in self._subscribers
+
+    def publish_local(self, process_id: str, message: str):
+        for queue in self._subscribers.get(process_id, ()):
+            queue.put_nowait(message)
+
+    @asynccontextmanager
+    async def subscribe(self, process_id: str):
+        """Yields a queue receiving every event (a JSON string) published for `process_id`."""
+        queue: asyncio.Queue = asyncio.Queue()
+        first = process_id not in self._subscribers
+        self._subscribers.setdefault(process_id, set()).add(queue)
+        try:
+            if first and self.redis:
+                if self._pubsub is None:
+                    self._pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                await self._pubsub.subscribe(self.channel(process_id))
+                if self._reader is None or self._reader.done():
+                    self._reader = asyncio.create_task(self._read_loop())
+            yield queue
+        finally:
+            subscribers = self._subscribers.get(process_id)
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[process_id]
+                if self.redis and self._pubsub is not None:
+                    try:
+                        await self._pubsub.unsubscribe(self.channel(process_id))
+                    except Exception as e:
+                        print(f"TraceEvents: Failed to unsubscribe from {process_id}: {e}")
+
+    async def _read_loop(self):
+        while self._subscribers:
+            try:
+                message = await self._pubsub.get_message(timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"TraceEvents: Pub/sub read failed: {e}")
+                await asyncio.sleep(1.0)
+                continue
+            if message and message.get("type") == "message":
+                self.publish_local(message["channel"][len(self.CHANNEL_PREFIX):], message["data"])
+
+    async def aclose(self):
+        if self._reader is not None:
+            self._reader.cancel()
+            await asyncio.gather(self._reader, return_exceptions=True)
+            self._reader = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
@@ -0,0 +1,331 @@
+# File: /multi_agent_system/core/trace_index.py
+import base64
+import json
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+# Index sorted sets are split into time buckets of this many seconds, each expiring with its traces.
+INDEX_BUCKET_SECONDS = int(os.getenv("INDEX_BUCKET_SECONDS", "86400"))
+# Candidates a multi-filter query or count examines per request before it stops (and says so).
+INDEX_MAX_SCAN = int(os.getenv("INDEX_MAX_SCAN", "20000"))
+# Values of one dimension a group_by counts at most; values come from documents, so there may be many.
+INDEX_MAX_GROUPS = int(os.getenv("INDEX_MAX_GROUPS", "100"))
+# Index entries (process, term) held without Redis; the oldest processes are dropped beyond it.
+INDEX_MAX_LOCAL_ENTRIES = int(os.getenv("INDEX_MAX_LOCAL_ENTRIES", "200000"))
+
+# Dimensions processes can be filtered and grouped by ("all" holds every process).
+DIMENSIONS = ("format", "intent", "status", "source", "tone", "urgency", "document_type", "flag", "event_type", "anomaly", "action")
+
+Term = Tuple[str, str]  # (dimension, value)
+
+
+def index_terms(key: str, data: Any) -> List[Term]:
+    """The (dimension, value) pairs a trace entry adds to its process's index."""
+    if not isinstance(data, dict):
+        return []
+    terms: List[Tuple[str, Any]] = []
+    if key == "input_metadata":
+        terms = [("all", "all"), ("source", data.get("source_type"))]
+    elif key == "classifier_agent_output":
+        terms = [("format", data.get("format")), ("intent", data.get("intent"))]
+    elif key == "email_agent_output":
+        terms = [("tone", data.get("tone")), ("urgency", data.get("urgency"))]
+    elif key == "pdf_agent_output":
+        terms = [("document_type", data.get("document_type"))] + [("flag", flag) for flag in data.get("flags") or ()]
+    elif key == "json_agent_output":
+        parsed = data.get("parsed_data")
+        terms = [("event_type", parsed.get("event_type") if isinstance(parsed, dict) else None)]
+        if data.get("anomalies"):
+            terms.append(("anomaly", "json"))
+    elif key.startswith("action_queued:"):
+        terms = [("action", key.split(":", 1)[1])]
+    elif key == "processing_summary":
+        status = str(data.get("status") or "")
+        terms = [("status", "failed" if "failed" in status.lower() else "ok")]
+    return [(dimension, str(value)[:100]) for dimension, value in terms if isinstance(value, (str, int, float, bool)) and value != ""]
+
+
+def _encode_cursor(score: float, process_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([score, process_id]).encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> Tuple[float, str]:
+    """Raises ValueError for a malformed cursor."""
+    try:
+        score, process_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return float(score), str(process_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
+
+class TraceIndex:
+    """
+    Secondary indexes over processed documents, maintained by SharedMemory as trace entries are written.
+
+    Each (dimension, value) pair, e.g. ("intent", "Fraud Risk"), is a sorted set of process IDs
+    scored by the time the entry was written, split into `INDEX_BUCKET_SECONDS` buckets
+    (`idx:{dimension}:{value}:{bucket}`) that expire with the traces they point to. With Redis the
+    index writes ride in the same pipeline as the trace write; without Redis the same structure is
+    kept in process, bounded to `max_local_entries` (oldest processes dropped first). A query walks
+    the non-empty buckets of its time range newest first, and the range is first cut to the index
+    TTL, so its cost never depends on how wide a window is asked for. With several filters, it pages
+    through the filter with the fewest matches (one ZCOUNT pipeline decides) and checks the others
+    with pipelined ZSCOREs, so its cost follows the most selective filter, not the number of processes.
+    Pagination uses an opaque (score, process_id) cursor, which stays stable while new processes arrive.
+    """
+
+    KEY_PREFIX = "idx:"
+
+    def __init__(self, redis_client=None, ttl_seconds: int = 604800, bucket_seconds: int = INDEX_BUCKET_SECONDS,
+                 max_scan: int = INDEX_MAX_SCAN, max_groups: int = INDEX_MAX_GROUPS,
+                 max_local_entries: int = INDEX_MAX_LOCAL_ENTRIES):
+        self.redis = redis_client
+        self.bucket_seconds = bucket_seconds
+        self.max_scan = max_scan
+        self.max_groups = max_groups
+        self.max_local_entries = max_local_entries
+        # A bucket outlives the last trace written into it.
+        self.ttl_seconds = ttl_seconds + bucket_seconds
+        # Without Redis: index key -> {process_id: score}, and values key -> values seen in its bucket.
+        self._local: Dict[str, Dict[str, float]] = {}
+        self._local_values: Dict[str, Set[str]] = {}
+        self._local_buckets: Dict[int, Set[str]] = {}
+        # process_id -> its (term, bucket) entries, oldest process first, for evicting past max_local_entries.
+        self._local_processes: "OrderedDict[str, List[Tuple[Term, int]]]" = OrderedDict()
+        self._local_size = 0
+        self.local_evictions = 0
+
+    def _bucket(self, score: float) -> int:
+        return int(score // self.bucket_seconds)
+
+    def _key(self, term: Term, bucket: int) -> str:
+        return f"{self.KEY_PREFIX}{term[0]}:{term[1]}:{bucket}"
+
+    def _values_key(self, dimension: str, bucket: int) -> str:
+        return f"{self.KEY_PREFIX}values:{dimension}:{bucket}"
+
+    # --- Writes ---
+
+    def queue_add(self, pipe, process_id: str, terms: Iterable[Tuple[Term, float]]):
+        """Adds the index writes for `terms` ((term, score) pairs) to a Redis pipeline."""
+        for term, score in terms:
+            bucket = self._bucket(score)
+            key = self._key(term, bucket)
+            pipe.zadd(key, {process_id: score})
+            pipe.expire(key, self.ttl_seconds)
+            # Values are kept per bucket too, so they expire with the index entries that use them.
+            values_key = self._values_key(term[0], bucket)
+            pipe.sadd(values_key, term[1])
+            pipe.expire(values_key, self.ttl_seconds)
+
+    def add_local(self, process_id: str, terms: Iterable[Tuple[Term, float]]):
+        for term, score in terms:
+            bucket = self._bucket(score)
+            key = self._key(term, bucket)
+            if bucket not in self._local_buckets:
+                self._local_buckets[bucket] = set()
+                self._expire_local(bucket)
+            values_key = self._values_key(term[0], bucket)
+            self._local_buckets[bucket].update((key, values_key))
+            members = self._local.setdefault(key, {})
+            if process_id not in members:
+                self._local_size += 1
+                self._local_processes.setdefault(process_id, []).append((term, bucket))
+            members[process_id] = score
+            self._local_values.setdefault(values_key, set()).add(term[1])
+        while self._local_size > self.max_local_entries and self._local_processes:
+            self._evict_local(*self._local_processes.popitem(last=False))
+            self.local_evictions += 1
+
+    def _evict_local(self, process_id: str, entries: List[Tuple[Term, int]]):
+        for term, bucket in entries:
+            key = self._key(term, bucket)
+            members = self._local.get(key)
+            if members is None or members.pop(process_id, None) is None:
+                continue
+            self._local_size -= 1
+            if not members:
+                del self._local[key]
+                bucket_keys = self._local_buckets.get(bucket, set())
+                bucket_keys.discard(key)
+                values_key = self._values_key(term[0], bucket)
+                values = self._local_values.get(values_key, set())
+                values.discard(term[1])
+                if not values:
+                    self._local_values.pop(values_key, None)
+                    bucket_keys.discard(values_key)
+
+    def _expire_local(self, newest: int):
+        oldest = newest - self.ttl_seconds // self.bucket_seconds
+        for bucket in [b for b in self._local_buckets if b < oldest]:
+            for key in self._local_buckets.pop(bucket):
+                self._local_size -= len(self._local.pop(key, ()))
+                self._local_values.pop(key, None)
+        # Processes are kept oldest first: drop those whose every entry has just expired.
+        while self._local_processes:
+            process_id, entries = next(iter(self._local_processes.items()))
+            if any(bucket >= oldest for _, bucket in entries):
+                break
+            del self._local_processes[process_id]
+
+    # --- Primitive reads (Redis or local) ---
+
+    async def _zcounts(self, keys: List[str], low: float, high: float) -> List[int]:
+        if self.redis is None:
+            return [sum(1 for score in self._local.get(key, {}).values() if low <= score <= high) for key in keys]
+        pipe = self.redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.zcount(key, low, high)
+        return await pipe.execute()
+
+    async def _zrevrange(self, key: str, high: float, low: float, count: int, offset: int = 0) -> List[Tuple[str, float]]:
+        # Ties come in reverse id order, as Redis returns them.
+        if self.redis is None:
+            members = [(pid, score) for pid, score in self._local.get(key, {}).items() if low <= score <= high]
+            members.sort(key=lambda item: (item[1], item[0]), reverse=True)
+            return members[offset:offset + count]
+        return await self.redis.zrevrangebyscore(key, high, low, start=offset, num=count, withscores=True)
+
+    async def _contains(self, term: Term, candidates: List[Tuple[str, float]]) -> List[bool]:
+        # A process's entries are written close together, but possibly on either side of a bucket edge.
+        checks = []
+        for process_id, score in candidates:
+            bucket = self._bucket(score)
+            checks.extend((self._key(term, b), process_id) for b in (bucket - 1, bucket, bucket + 1))
+        if self.redis is None:
+            found = [process_id in self._local.get(key, {}) for key, process_id in checks]
+        else:
+            pipe = self.redis.pipeline(transaction=False)
+            for key, process_id in checks:
+                pipe.zscore(key, process_id)
+            found = [score is not None for score in await pipe.execute()]
+        return [any(found[i * 3:i * 3 + 3]) for i in range(len(candidates))]
+
+    async def avalues(self, dimension: str, since: float, until: float) -> List[str]:
+        """Values of `dimension` indexed in the buckets of [since, until]."""
+        keys = [self._values_key(dimension, b) for b in self._buckets(since, until)]
+        if not keys:
+            return []
+        if self.redis is None:
+            return sorted(set().union(*(self._local_values.get(key, ()) for key in keys)))
+        return sorted(await self.redis.sunion(keys))
+
+    # --- Queries ---
+
+    def window(self, since: float, until: float) -> Tuple[float, float]:
+        """
+        [since, until] narrowed to where index keys can exist: nothing outlives the TTL and nothing is
+        written in the future (beyond a bucket of clock skew). Raises ValueError for non-finite bounds.
+        """
+        if not (math.isfinite(since) and math.isfinite(until)):
+            raise ValueError("since and until must be finite Unix times.")
+        now = time.time()
+        return max(since, now - self.ttl_seconds), min(until, now + self.bucket_seconds)
+
+    def _buckets(self, since: float, until: float) -> List[int]:
+        since, until = self.window(since, until)
+        return list(range(self._bucket(until), self._bucket(since) - 1, -1))
+
+    async def _count_terms(self, terms: List[Term], since: float, until: float) -> List[int]:
+        buckets = self._buckets(since, until)
+        counts = await self._zcounts([self._key(term, b) for term in terms for b in buckets], since, until)
+        return [sum(counts[i * len(buckets):(i + 1) * len(buckets)]) for i in range(len(terms))]
+
+    async def _scan(self, driver: Term, others: List[Term], since: float, until: float, after: Optional[Tuple[float, str]],
+                    limit: Optional[int]) -> Tuple[List[Tuple[str, float]], Optional[Tuple[float, str]], bool]:
+        """
+        Matches newest first, after the cursor position `after`. Returns the matches, the position to
+        resume from (None once the range is exhausted), and whether the scan finished within `max_scan`.
+        """
+        matches: List[Tuple[str, float]] = []
+        position = after
+        scanned = 0
+        # One ZCOUNT pipeline finds the buckets holding the driver, so empty ones cost no round trip.
+        buckets = [b for b in self._buckets(since, until) if position is None or self._bucket(position[0]) >= b]
+        counts = await self._zcounts([self._key(driver, b) for b in buckets], since, until)
+        for bucket, count in zip(buckets, counts):
+            if not count:
+                continue
+            skip = 0
+            while True:
+                wanted = self.max_scan - scanned if limit is None else min(self.max_scan - scanned, max(limit - len(matches), 1) * 4)
+                if wanted <= 0:
+                    return matches, position, False
+                high = until if position is None else min(until, position[0])
+                fetched = await self._zrevrange(self._key(driver, bucket), high, since, wanted + 16, skip)
+                # Ties on the cursor's score were already seen if their id sorts at or after it.
+                batch = fetched if position is None else [
+                    (pid, score) for pid, score in fetched if score < position[0] or (score == position[0] and pid < position[1])]
+                if not batch and len(fetched) == wanted + 16:
+                    # A whole fetch of ties already seen: page past them, still on the tied score.
+                    skip += len(fetched)
+                    continue
+                batch = batch[:wanted]
+                if not batch:
+                    break
+                skip = 0
+                keep = [True] * len(batch)
+                for term in others:
+                    keep = [k and c for k, c in zip(keep, await self._contains(term, batch))]
+                for (process_id, score), matched in zip(batch, keep):
+                    scanned += 1
+                    position = (score, process_id)
+                    if matched:
+                        matches.append((process_id, score))
+                        if limit is not None and len(matches) >= limit:
+                            return matches, position, True
+        return matches, None, True
+
+    async def aquery(self, filters: Dict[str, str], since: float, until: float, limit: int = 50,
+                     cursor: Optional[str] = None) -> Dict[str, Any]:
+        """
+        One page of processes matching every filter (dimension -> value) in [since, until], newest first.
+        Raises ValueError for a malformed cursor.
+        """
+        terms = sorted(filters.items()) or [("all", "all")]
+        after = _decode_cursor(cursor) if cursor else None
+        counts = await self._count_terms(terms, since, until) if len(terms) > 1 else [0]
+        driver = terms[counts.index(min(counts))]
+        others = [term for term in terms if term != driver]
+        matches, position, complete = await self._scan(driver, others, since, until, after, limit)
+        return {
+            "items": [{"process_id": process_id, "indexed_at": score} for process_id, score in matches],
+            "next_cursor": _encode_cursor(*position) if position is not None else None,
+            "scan_complete": complete,
+        }
+
+    async def acount(self, filters: Dict[str, str], since: float, until: float) -> Dict[str, Any]:
+        """Matching processes in [since, until]: exact from ZCOUNT for one filter, else counted up to `max_scan`."""
+        terms = sorted(filters.items()) or [("all", "all")]
+        counts = await self._count_terms(terms, since, until)
+        if len(terms) == 1:
+            return {"count": counts[0], "exact": True}
+        driver = terms[counts.index(min(counts))]
+        if min(counts) == 0:
+            return {"count": 0, "exact": True}
+        matches, _, complete = await self._scan(driver, [t for t in terms if t != driver], since, until, None, None)
+        return {"count": len(matches), "exact": complete}
+
+    async def aaggregate(self, group_by: str, filters: Dict[str, str], since: float, until: float) -> Dict[str, Any]:
+        """
+        Counts per value of `group_by` among the processes matching `filters`, for at most `max_groups`
+        values (`truncated` says whether there were more).
+        """
+        values = await self.avalues(group_by, since, until)
+        truncated = len(values) > self.max_groups
+        values = values[:self.max_groups]
+        if not filters:
+            counts = await self._count_terms([(group_by, value) for value in values], since, until)
+            groups = {value: count for value, count in zip(values, counts) if count}
+            return {"group_by": group_by, "groups": groups, "exact": True, "truncated": truncated}
+        groups = {}
+        exact = True
+        for value in values:
+            result = await self.acount({**filters, group_by: value}, since, until)
+            exact = exact and result["exact"]
+            if result["count"]:
+                groups[value] = result["count"]
+        return {"group_by": group_by, "groups": groups, "exact": exact, "truncated": truncated}
@@ -0,0 +1,166 @@
+# File: /multi_agent_system/core/uploads.py
+import hashlib
+import os
+import tempfile
+from typing import Any, Dict, Optional, Union
+
+from fastapi import HTTPException, UploadFile
+
+from core import schemas
+from core.sniffing import SNIFF_PREFIX_BYTES
+
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+
+class InputDocument:
+    """
+    One input payload, held with bounded memory.
+
+    Uploads are copied in chunks: small ones stay in memory, larger ones spill to a named temp file
+    that PDF extraction workers can open by path. Only a bounded prefix is kept for format sniffing,
+    and text is decoded lazily, once, for the formats that need it.
+    """
+
+    def __init__(self, max_bytes: int, max_memory_bytes: int, prefix_bytes: int):
+        self.max_bytes = max_bytes
+        self.max_memory_bytes = max_memory_bytes
+        self.prefix_bytes = prefix_bytes
+        self.size = 0
+        self.prefix = b""
+        self.path: Optional[str] = None
+        self._buffer = bytearray()
+        self._file = None
+        self._text: Optional[str] = None
+        self._text_decoded = False
+        # Hashed as the payload streams in, for idempotency keys that default to the content.
+        self._digest = hashlib.sha256()
+        self._json: Any = None
+        self._json_parsed = False
+
+    @classmethod
+    def from_env(cls) -> "InputDocument":
+        return cls(
+            max_bytes=int(os.getenv("UPLOAD_MAX_BYTES", str(50 * 1024 * 1024))),
+            max_memory_bytes=int(os.getenv("UPLOAD_SPOOL_MEMORY_BYTES", str(1024 * 1024))),
+            prefix_bytes=SNIFF_PREFIX_BYTES
+        )
+
+    @classmethod
+    async def from_upload(cls, upload: UploadFile) -> "InputDocument":
+        document = cls.from_env()
+        try:
+            while True:
+                chunk = await upload.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                document._write(chunk)
+        except BaseException:
+            document.close()
+            raise
+        finally:
+            await upload.close()
+        return document
+
+    @classmethod
+    def from_text(cls, text: str) -> "InputDocument":
+        document = cls.from_env()
+        encoded = text.encode('utf-8')
+        if len(encoded) > document.max_bytes:
+            raise HTTPException(status_code=413, detail=f"Input exceeds the {document.max_bytes} byte limit.")
+        document._text = text
+        document._text_decoded = True
+        document._digest.update(encoded)
+        document.prefix = encoded[:document.prefix_bytes]
+        document.size = len(encoded)
+        return document
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "InputDocument":
+        """Rebuilds a document from a stored payload (e.g. a queued job), spooling it like an upload."""
+        document = cls.from_env()
+        try:
+            for start in range(0, len(data), UPLOAD_CHUNK_BYTES):
+                document._write(data[start:start + UPLOAD_CHUNK_BYTES])
+        except BaseException:
+            document.close()
+            raise
+        return document
+
+    def _write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise HTTPException(status_code=413, detail=f"Upload exceeds the {self.max_bytes} byte limit.")
+        self._digest.update(chunk)
+        if len(self.prefix) < self.prefix_bytes:
+            self.prefix += chunk[:self.prefix_bytes - len(self.prefix)]
+        if self._file is None and len(self._buffer) + len(chunk) > self.max_memory_bytes:
+            self._file = tempfile.NamedTemporaryFile(prefix="upload-", delete=False)
+            self.path = self._file.name
+            self._file.write(self._buffer)
+            self._buffer = bytearray()
+        if self._file is not None:
+            self._file.write(chunk)
+        else:
+            self._buffer += chunk
+
+    @property
+    def sha256(self) -> str:
+        return self._digest.hexdigest()
+
+    @property
+    def on_disk(self) -> bool:
+        return self.path is not None
+
+    def as_bytes(self) -> bytes:
+        """Materializes the whole payload; avoid for large uploads (see `pdf_source`)."""
+        if self._file is not None:
+            self._file.flush()
+            with open(self.path, "rb") as f:
+                return f.read()
+        if not self._buffer and self._text is not None:
+            return self._text.encode('utf-8')
+        return bytes(self._buffer)
+
+    def text(self) -> Optional[str]:
+        """The payload decoded as UTF-8 (None if it is not valid UTF-8), decoded at most once."""
+        if not self._text_decoded:
+            self._text_decoded = True
+            try:
+                self._text = self.as_bytes().decode('utf-8')
+            except UnicodeDecodeError:
+                self._text = None
+        return self._text
+
+    def prefix_text(self) -> str:
+        """The sniffing prefix decoded as UTF-8 (a character cut at its end is dropped): enough for a classifier prompt, without decoding the whole payload."""
+        if self._text is not None:
+            return self._text[:self.prefix_bytes]
+        return self.prefix.decode('utf-8', errors='ignore')
+
+    def json_payload(self) -> Optional[Dict[str, Any]]:
+        """The payload parsed as a JSON object (None if it is not one), parsed at most once and shared by every stage."""
+        if not self._json_parsed:
+            self._json_parsed = True
+            if self.prefix.lstrip()[:1] == b"{":
+                try:
+                    self._json = schemas.loads(self._text if self._text is not None else self.as_bytes())
+                except ValueError:
+                    self._json = None
+        return self._json if isinstance(self._json, dict) else None
+
+    def pdf_source(self) -> Union[bytes, str]:
+        """A file path for spilled uploads (no in-memory copy), the bytes otherwise."""
+        if self._file is not None:
+            self._file.flush()
+            return self.path
+        return self.as_bytes()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+        self._buffer = bytearray()
@@ -1,12 +1,17 @@
 # File: /multi_agent_system/main.py
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
-from fastapi.responses import JSONResponse, HTMLResponse
+import time
+_import_started = time.perf_counter()  # the startup profile's "import" phase covers this whole module
+
+from fastapi import APIRouter, FastAPI, UploadFile, File, Form, Header, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse, PlainTextResponse
 from fastapi.templating import Jinja2Templates
 from dotenv import load_dotenv
 import os
 import uuid
-import time
-from typing import Optional, Dict, Any, Union
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, Union, List, Tuple
 
 # Load environment variables FIRST so they are available for SharedMemory initialization
 load_dotenv()
@@ -18,153 +23,729 @@ if not os.getenv("GOOGLE_API_KEY"):
 # Import SharedMemory CLASS and ActionRouter CLASS
 from core.memory import SharedMemory
 from core.action_router import ActionRouter
+from core.result_cache import ResultCache
+from core.near_duplicates import NearDuplicateIndex
+from core.uploads import InputDocument
+from core.job_queue import JobQueue
+from core.idempotency import IdempotencyStore, IdempotencyClaim, IdempotencyConflict
+from core.llm_gateway import LLMGateway
+from core.schemas import SchemaRegistry
+from core.sniffing import FormatSniffer, SniffResult
+from core.trace_index import DIMENSIONS
+from core.ndjson import RequestStreamingResponse, aiter_line_batches
+from core import deadline, schemas, telemetry
+
+# Where this worker's startup time and memory go (see /health and /metrics)
+startup = telemetry.StartupProfile()
 
-# Initialize SharedMemory instance (will connect to Redis or fallback)
+# Initialize SharedMemory instance (connects to Redis, or falls back, at startup: see lifespan)
 memory = SharedMemory(host=os.getenv("REDIS_HOST", "localhost"))
 
 # Initialize ActionRouter instance, passing the memory instance to it
 action_router = ActionRouter(memory_instance=memory)
 
-# Import Agent Classes
-from agents.classifier_agent import ClassifierAgent
-from agents.email_agent import EmailAgent
-from agents.json_agent import JsonAgent
-from agents.pdf_agent import PdfAgent
-
-# Initialize agents, passing the shared memory and action router instances
-# This is crucial for proper dependency injection and avoiding circular imports.
-classifier_agent = ClassifierAgent(memory_instance=memory)
-email_agent = EmailAgent(memory_instance=memory, action_router_instance=action_router)
-json_agent = JsonAgent(memory_instance=memory, action_router_instance=action_router)
-pdf_agent = PdfAgent(memory_instance=memory, action_router_instance=action_router)
-
-app = FastAPI(
-    title="Multi-Agent Document Processing System",
-    description="Processes various document formats, classifies intent, routes to specialized agents, and triggers dynamic actions.",
-    version="1.0.0"
-)
+# Content-addressed cache for parsed LLM results (Redis-backed when available, local LRU otherwise)
+result_cache = ResultCache(
+    memory_instance=memory,
+    max_entries=int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "2048")),
+    ttl_seconds=int(os.getenv("RESULT_CACHE_TTL_SECONDS", "86400"))
+) if os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true" else None
+
+# Reuses results for near-copies of earlier documents (MinHash LSH; Redis-backed when available, bounded local index otherwise)
+near_duplicates = NearDuplicateIndex(memory_instance=memory) if os.getenv("NEAR_DUPLICATE_ENABLED", "true").lower() == "true" else None
+
+# Maps repeated submissions (same Idempotency-Key header, or same content) to the original process
+idempotency = IdempotencyStore(
+    memory_instance=memory,
+    ttl_seconds=int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400")),
+    content_ttl_seconds=int(os.getenv("IDEMPOTENCY_CONTENT_TTL_SECONDS", "600")),
+    wait_timeout_seconds=float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", str(deadline.REQUEST_DEADLINE_SECONDS)))
+) if os.getenv("IDEMPOTENCY_ENABLED", "true").lower() == "true" else None
+# How often a repeat may take over processing after the request it waited for failed.
+IDEMPOTENCY_MAX_TAKEOVERS = 2
+
+# One LLM client per model shared by all agents, behind rate limits and an adaptive concurrency cap
+llm_gateway = LLMGateway()
+
+# Agent classes are imported by the registry when first built
+from agents.models import WEBHOOK_SCHEMAS
+from agents.registry import AgentRegistry
+
+# Webhook schemas by event_type: registered JSON skips the LLM classifier and is validated once by the JSON agent
+schema_registry = SchemaRegistry(WEBHOOK_SCHEMAS)
+
+# Formats are sniffed once per document, from its bounded prefix, and the result is shared with the classifier
+format_sniffer = FormatSniffer.default()
+
+# Agents are built on first use (or warmed up at startup, see AGENT_WARMUP), passing the shared memory
+# and action router instances. This is crucial for proper dependency injection and avoiding circular imports.
+agent_registry = AgentRegistry(memory_instance=memory, action_router_instance=action_router, result_cache_instance=result_cache,
+                               llm_gateway_instance=llm_gateway, schema_registry_instance=schema_registry, format_sniffer_instance=format_sniffer,
+                               near_duplicate_index_instance=near_duplicates)
+
+# When agents are built: "background" (default) right after startup, reporting ready once done; "eager"
+# before startup completes; "lazy" on the first document that needs each one.
+AGENT_WARMUP = os.getenv("AGENT_WARMUP", "background").lower()
+
+# With a pre-forking server (gunicorn --preload), import the agent modules once in the master so the
+# workers share them copy-on-write. Clients and connections are still created per worker, after the fork.
+if os.getenv("PRELOAD_AGENT_MODULES", "false").lower() == "true":
+    with startup.phase("preload_modules"):
+        AgentRegistry.preload_modules()
+
+async def warm_up_agents():
+    try:
+        with startup.phase("agents"):
+            await agent_registry.awarm_up()
+    except Exception as e:
+        print(f"Startup: Agent warm-up failed, agents are built on first use instead: {e}")
+    startup.mark_ready()
+    print(f"Startup: Agents ready after {startup.ready_after:.2f}s")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    with startup.phase("redis_connect"):
+        await memory.aconnect()
+    await action_router.start()
+    # Without Redis there are no separate workers, so the API process consumes its own queue.
+    if PROCESSING_MODE == "queue" and (not memory.is_redis_backed or os.getenv("RUN_JOB_WORKER", "false").lower() == "true"):
+        await job_queue.start()
+    warm_up = None
+    if AGENT_WARMUP == "eager":
+        await warm_up_agents()
+    elif AGENT_WARMUP == "background":
+        warm_up = asyncio.create_task(warm_up_agents())
+    else:
+        startup.mark_ready()
+    print(f"Startup: Serving after {time.perf_counter() - _import_started:.2f}s ({startup.phases})")
+    yield
+    if warm_up is not None:
+        await warm_up
+    await job_queue.stop()
+    await action_router.stop()
+    agent_registry.close()
+    # Closes Redis connections, or spills the in-memory fallback store to disk when configured.
+    await memory.aclose()
+
+# Routes are collected here and mounted by create_app()
+router = APIRouter()
 
 templates = Jinja2Templates(directory="templates")
 
-def with_retry(func, *args, retries=3, delay=1, **kwargs):
-    for i in range(retries):
-        try:
-            return func(*args, **kwargs)
-        except Exception as e:
-            print(f"Attempt {i+1} failed for {func.__name__}: {e}")
-            if i < retries - 1:
-                time.sleep(delay * (2**i))
-            else:
-                raise
-
-@app.get("/", response_class=HTMLResponse)
+# Caps how many documents are classified/extracted at once per worker. Requests beyond
+# the cap wait here instead of piling more concurrent calls onto Gemini and Redis.
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "32"))
+_processing_slots: Optional[asyncio.Semaphore] = None
+
+def processing_slots() -> asyncio.Semaphore:
+    # Created on first use: before Python 3.10 an asyncio.Semaphore binds to the event loop that is current
+    # when it is constructed, and at import time that is not the loop uvicorn serves requests on.
+    global _processing_slots
+    if _processing_slots is None:
+        _processing_slots = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    return _processing_slots
+
+# "inline" processes documents inside /process_input; "queue" returns 202 and leaves them to workers (worker.py).
+PROCESSING_MODE = os.getenv("PROCESSING_MODE", "inline").lower()
+
+# Upper bound on concurrent LLM calls / agent runs inside a single /process_batch request.
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "32"))
+
+# Deadline for a whole /process_batch request (single documents use REQUEST_DEADLINE_SECONDS).
+BATCH_DEADLINE_SECONDS = float(os.getenv("BATCH_DEADLINE_SECONDS", "300"))
+
+def sniff_document(document: InputDocument) -> SniffResult:
+    return format_sniffer.sniff(document.prefix, document.size)
+
+def select_classifier_input(document: InputDocument, sniffed: SniffResult) -> Union[str, bytes]:
+    # The classifier only sees a token-budgeted preview of the leading text, which the bounded prefix
+    # covers, so nothing is decoded or loaded in full here. PDFs are previewed from their raw bytes.
+    if sniffed.route == "PDF":
+        return document.prefix
+    return document.prefix_text()
+
+async def route_to_agent(process_id: str, classification_result, document: InputDocument) -> str:
+    """
+    Runs the specialized agent for the classified format and returns the processing status.
+    Agents run once: transient LLM failures are retried per call by the gateway, so memory writes
+    and actions are never repeated.
+    """
+    try:
+        deadline.check("agent processing")
+        if classification_result.format == "Email":
+            content_str = document.text()
+            if not content_str:
+                raise HTTPException(status_code=400, detail="Email content must be decodeable to string.")
+            email_agent = await agent_registry.aget("email")
+            await email_agent.aprocess(process_id, content_str)
+            return "Email processed"
+        elif classification_result.format == "JSON":
+            # With the payload already parsed, the agent only traces the leading content.
+            payload = document.json_payload()
+            content_str = document.prefix_text() if payload is not None else document.text()
+            if not content_str:
+                raise HTTPException(status_code=400, detail="JSON content must be decodeable to string.")
+            json_agent = await agent_registry.aget("json")
+            await json_agent.aprocess(process_id, content_str, payload=payload)
+            return "JSON processed"
+        elif classification_result.format == "PDF":
+            if not document.size:
+                raise HTTPException(status_code=400, detail="PDF content must be provided as bytes.")
+            pdf_agent = await agent_registry.aget("pdf")
+            await pdf_agent.aprocess(process_id, document.pdf_source())
+            return "PDF processed"
+        else:
+            await memory.aadd_entry(process_id, "routing_decision", {"agent": "None", "reason": "Unknown format"})
+            return "Unknown format, no specialized agent action"
+
+    except Exception as e:
+        await memory.aadd_entry(process_id, "agent_processing_error", {"error": str(e)})
+        print(f"Error during specialized agent processing: {e}")
+        return f"Agent processing failed: {e}"
+
+async def process_document(process_id: str, document: InputDocument) -> str:
+    """
+    Classifies one document and routes it to its agent, holding one of the worker's processing slots.
+    """
+    async with processing_slots():
+        with telemetry.track(process_id) as timer, telemetry.maybe_profile(process_id) as profile_path:
+            print(f"\n--- Processing ID: {process_id} ---")
+            print("Classifying format and intent...")
+            try:
+                with telemetry.span("classification", "classifier"):
+                    sniffed = sniff_document(document)
+                    classifier_input = select_classifier_input(document, sniffed)
+                    classifier_agent = await agent_registry.aget("classifier")
+                    classification_result = await classifier_agent.aprocess(
+                        process_id, classifier_input, payload=document.json_payload(), sniffed=sniffed, size=document.size)
+            except Exception as e:
+                await memory.aadd_entry(process_id, "classification_error", {"error": str(e)})
+                await record_stage_timings(process_id, timer, "classification_failed", profile_path)
+                raise HTTPException(status_code=500, detail=f"Classification failed: {e}")
+            telemetry.set_labels(format=classification_result.format, intent=classification_result.intent)
+            await memory.aflush_stage(process_id)
+
+            print(f"Routing to agent based on classification: Format={classification_result.format}, Intent={classification_result.intent}")
+            with telemetry.span("agent", classification_result.format.lower()) as span:
+                processing_status = await route_to_agent(process_id, classification_result, document)
+                if "failed" in processing_status:
+                    span["outcome"] = "error"
+            await record_stage_timings(process_id, timer, "failed" if "failed" in processing_status else "ok", profile_path)
+            await memory.aflush_stage(process_id)
+
+            return processing_status
+
+async def record_stage_timings(process_id: str, timer: telemetry.StageTimer, outcome: str, profile_path: Optional[str] = None):
+    """Writes the document's spans to its trace and counts it in the /metrics document totals."""
+    telemetry.record_document(timer, outcome)
+    timings = timer.summary()
+    if profile_path:
+        timings["profile_path"] = profile_path
+    await memory.aadd_entry(process_id, "stage_timings", timings)
+
+async def process_job(process_id: str, document: InputDocument, job: Dict[str, Any]) -> str:
+    """
+    Runs a queued document through the same pipeline as an inline request (used by JobQueue consumers).
+    """
+    try:
+        async with memory.buffered(process_id):
+            # The deadline starts when a worker picks the job up; time spent queued is not charged to it.
+            with deadline.scope():
+                processing_status = await process_document(process_id, document)
+            await memory.aadd_entry(process_id, "processing_summary", {
+                "status": processing_status,
+                "duration_seconds": time.time() - job["received_at"]
+            })
+            print(f"--- Processing complete for ID: {process_id} ---")
+    except Exception:
+        await release_job_claim(process_id, job)
+        raise
+    if "failed" in processing_status:
+        await release_job_claim(process_id, job)
+    return processing_status
+
+async def release_job_claim(process_id: str, job: Dict[str, Any]):
+    # Same as inline requests: a failed job gives its idempotency key up, so the next repeat is processed again.
+    if idempotency is not None and job.get("idempotency"):
+        await idempotency.arelease(IdempotencyClaim(job["idempotency"]["key"], process_id, job["idempotency"]["record"]))
+
+job_queue = JobQueue(memory_instance=memory, handler=process_job)
+
+@router.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
     """
     Serves the simple UI for uploading inputs.
     """
     return templates.TemplateResponse("index.html", {"request": request})
 
-@app.post("/process_input")
+@router.post("/process_input")
 async def process_input(
     file: Optional[UploadFile] = File(None),
     raw_content: Optional[str] = Form(None),
-    input_type_hint: Optional[str] = Form(None, description="Optional hint for content type (e.g., 'email', 'json', 'pdf'). Will be auto-detected if not provided.")
+    input_type_hint: Optional[str] = Form(None, description="Optional hint for content type (e.g., 'email', 'json', 'pdf'). Will be auto-detected if not provided."),
+    process_id: Optional[str] = Form(None, description="Optional client-generated UUID, so the caller can open /trace/{process_id}/events before submitting."),
+    idempotency_key: Optional[str] = Header(None, description="Repeats of a key return the original process instead of reprocessing. Defaults to a hash of the content.")
 ):
     """
     Processes an input, classifying its format and intent, then routing to specialized agents.
     Accepts either a file upload or raw text content.
+    With PROCESSING_MODE=queue the input is only stored and queued: the response is `202` with the
+    process_id, and the result appears in `/trace/{process_id}` once a worker has processed it.
+    A repeat of an earlier input (same `Idempotency-Key`, or same content) gets the original
+    process_id and result back, waiting for it first if the original is still being processed.
     """
-    process_id = str(uuid.uuid4())
+    if process_id:
+        try:
+            process_id = str(uuid.UUID(process_id))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="process_id must be a UUID.")
+        if await memory.atrace_exists(process_id):
+            raise HTTPException(status_code=409, detail="process_id is already in use.")
+    else:
+        process_id = str(uuid.uuid4())
     start_time = time.time()
-    
-    input_metadata = {
-        "process_id": process_id,
-        "timestamp": time.time(),
-        "source_type": "file" if file else "raw_content",
-        "original_filename": file.filename if file else None,
-        "input_type_hint": input_type_hint
-    }
-    memory.add_entry(process_id, "input_metadata", input_metadata)
-
-    content_bytes: Optional[bytes] = None
-    content_str: Optional[str] = None
 
     if file:
-        content_bytes = await file.read()
-        try:
-            content_str = content_bytes.decode('utf-8')
-        except UnicodeDecodeError:
-            pass
+        document = await InputDocument.from_upload(file)
     elif raw_content:
-        content_str = raw_content
-        content_bytes = raw_content.encode('utf-8')
+        document = InputDocument.from_text(raw_content)
     else:
         raise HTTPException(status_code=400, detail="Either 'file' or 'raw_content' must be provided.")
 
-    print(f"\n--- Processing ID: {process_id} ---")
-    print("Classifying format and intent...")
+    claim = None
+    if idempotency is not None:
+        key = idempotency.make_key(idempotency_key, document.sha256)
+        for _ in range(IDEMPOTENCY_MAX_TAKEOVERS + 1):
+            try:
+                claim = await idempotency.aclaim(key["key"], key["source"], process_id, document.sha256)
+            except IdempotencyConflict as e:
+                document.close()
+                raise HTTPException(status_code=422, detail=str(e))
+            if isinstance(claim, IdempotencyClaim):
+                break
+            original = claim
+            claim = None
+            if PROCESSING_MODE == "queue" or await memory.aget_entry(original["process_id"], "processing_summary") is not None:
+                document.close()
+                return await replay_process(original["process_id"])
+            try:
+                finished = await idempotency.await_original(key["key"], original["process_id"])
+            except asyncio.TimeoutError:
+                document.close()
+                return JSONResponse(status_code=409, content={
+                    "detail": "An identical request is still being processed.",
+                    "process_id": original["process_id"], "trace_url": f"/trace/{original['process_id']}"
+                })
+            if finished:
+                document.close()
+                return await replay_process(original["process_id"])
+            # The original failed and gave the key up: claim it again and process the document here.
+        else:
+            document.close()
+            raise HTTPException(status_code=503, detail="Earlier attempts of this request failed; retry later.")
+
     try:
-        classifier_input = content_bytes if content_bytes and classifier_agent.classify_format_heuristic(content_bytes) == "PDF" else (content_str or content_bytes.decode('utf-8', errors='ignore'))
-        
-        classification_result = with_retry(classifier_agent.process, process_id, classifier_input)
-    except Exception as e:
-        memory.add_entry(process_id, "classification_error", {"error": str(e)})
-        raise HTTPException(status_code=500, detail=f"Classification failed: {e}")
+        processing_status, response = await run_input(process_id, document, start_time, {
+            "process_id": process_id,
+            "timestamp": time.time(),
+            "source_type": "file" if file else "raw_content",
+            "original_filename": file.filename if file else None,
+            "input_type_hint": input_type_hint
+        }, claim, {"key_source": key["source"], "content_sha256": document.sha256} if claim else None)
+    except BaseException:
+        if claim:
+            await idempotency.arelease(claim)
+        raise
+    if claim:
+        # A failed result is not worth replaying: the next retry processes the document again.
+        if "failed" in processing_status:
+            await idempotency.arelease(claim)
+        else:
+            idempotency.complete(claim)
+    return response
 
-    print(f"Routing to agent based on classification: Format={classification_result.format}, Intent={classification_result.intent}")
-    processing_status = "Processing in progress"
-    agent_output: Optional[Dict[str, Any]] = None
 
-    try:
-        if classification_result.format == "Email":
-            if not content_str:
-                raise HTTPException(status_code=400, detail="Email content must be decodeable to string.")
-            agent_output = with_retry(email_agent.process, process_id, content_str).model_dump()
-            processing_status = "Email processed"
-        elif classification_result.format == "JSON":
-            if not content_str:
-                raise HTTPException(status_code=400, detail="JSON content must be decodeable to string.")
-            agent_output = with_retry(json_agent.process, process_id, content_str).model_dump()
-            processing_status = "JSON processed"
-        elif classification_result.format == "PDF":
-            if not content_bytes:
-                raise HTTPException(status_code=400, detail="PDF content must be provided as bytes.")
-            agent_output = with_retry(pdf_agent.process, process_id, content_bytes).model_dump()
-            processing_status = "PDF processed"
+async def run_input(process_id: str, document: InputDocument, start_time: float, input_metadata: Dict[str, Any],
+                    claim: Optional[IdempotencyClaim], idempotency_entry: Optional[Dict[str, Any]]) -> Tuple[str, JSONResponse]:
+    # Trace writes are buffered for the lifetime of the request and flushed in one Redis pipeline.
+    async with memory.buffered(process_id):
+        await memory.aadd_entry(process_id, "input_metadata", input_metadata)
+        await memory.aadd_entry(process_id, "input_content", {"size": document.size, "spooled_to_disk": document.on_disk})
+        if idempotency_entry:
+            await memory.aadd_entry(process_id, "idempotency", idempotency_entry)
+        if PROCESSING_MODE == "queue":
+            await memory.aadd_entry(process_id, "job", {"status": "queued"})
         else:
-            processing_status = "Unknown format, no specialized agent action"
-            memory.add_entry(process_id, "routing_decision", {"agent": "None", "reason": "Unknown format"})
+            try:
+                with deadline.scope():
+                    processing_status = await process_document(process_id, document)
+            finally:
+                document.close()
 
-    except Exception as e:
-        processing_status = f"Agent processing failed: {e}"
-        memory.add_entry(process_id, "agent_processing_error", {"error": str(e)})
-        print(f"Error during specialized agent processing: {e}")
+            end_time = time.time()
+            await memory.aadd_entry(process_id, "processing_summary", {
+                "status": processing_status,
+                "duration_seconds": end_time - start_time
+            })
+            full_trace = await memory.aget_all_entries_for_process(process_id)
+            print(f"--- Processing complete for ID: {process_id} ---")
+            return processing_status, JSONResponse(content={"process_id": process_id, "status": processing_status, "trace": full_trace})
 
+    # Enqueued only after the buffered trace is flushed, so a worker's entries can never be overwritten by it.
+    job = {"received_at": start_time}
+    if claim is not None:
+        job["idempotency"] = {"key": claim.key, "record": claim.record}
+    await job_queue.aenqueue(process_id, document, job)
+    return "queued", JSONResponse(status_code=202, content={"process_id": process_id, "status": "queued", "trace_url": f"/trace/{process_id}"})
 
-    end_time = time.time()
-    memory.add_entry(process_id, "processing_summary", {
-        "status": processing_status,
-        "duration_seconds": end_time - start_time
+
+async def replay_process(process_id: str) -> JSONResponse:
+    """The response for a repeated request: the original process, with its result once there is one."""
+    trace = await memory.aget_all_entries_for_process(process_id)
+    summary = trace.get("processing_summary")
+    headers = {"Idempotent-Replayed": "true"}
+    if summary is None:
+        return JSONResponse(status_code=202, headers=headers, content={
+            "process_id": process_id, "status": "queued", "trace_url": f"/trace/{process_id}", "idempotent_replay": True
+        })
+    return JSONResponse(headers=headers, content={
+        "process_id": process_id, "status": summary.get("status"), "trace": trace, "idempotent_replay": True
     })
 
-    full_trace = memory.get_all_entries_for_process(process_id)
-    print(f"--- Processing complete for ID: {process_id} ---")
-    return JSONResponse(content={"process_id": process_id, "status": processing_status, "trace": full_trace})
 
+@router.post("/process_batch")
+async def process_batch(
+    files: Optional[List[UploadFile]] = File(None),
+    raw_contents: Optional[List[str]] = Form(None)
+):
+    """
+    Processes many documents in one request. Classification (and email extraction) run as
+    batched LLM calls; every other document is routed to its agent under a bounded concurrency limit.
+    Returns one process ID and status per document, in input order.
+    """
+    batch_id = str(uuid.uuid4())
+    start_time = time.time()
+
+    documents = []
+    try:
+        for file in files or []:
+            documents.append({"source_type": "file", "original_filename": file.filename, "document": await InputDocument.from_upload(file)})
+        for raw_content in raw_contents or []:
+            documents.append({"source_type": "raw_content", "original_filename": None, "document": InputDocument.from_text(raw_content)})
+        if not documents:
+            raise HTTPException(status_code=400, detail="At least one 'files' or 'raw_contents' item must be provided.")
+        with deadline.scope(BATCH_DEADLINE_SECONDS):
+            return await process_batch_documents(batch_id, start_time, documents)
+    finally:
+        for doc in documents:
+            doc["document"].close()
+
+
+async def process_batch_documents(batch_id: str, start_time: float, documents: List[Dict[str, Any]]) -> JSONResponse:
+    process_ids = [str(uuid.uuid4()) for _ in documents]
+    async with memory.buffered(*process_ids):
+        for process_id, doc in zip(process_ids, documents):
+            await memory.aadd_entry(process_id, "input_metadata", {
+                "process_id": process_id,
+                "batch_id": batch_id,
+                "timestamp": time.time(),
+                "source_type": doc["source_type"],
+                "original_filename": doc["original_filename"],
+                "input_type_hint": None
+            })
+
+        print(f"\n--- Processing batch {batch_id} ({len(documents)} documents) ---")
+        sniffed = [sniff_document(doc["document"]) for doc in documents]
+        classifier_inputs = [select_classifier_input(doc["document"], result) for doc, result in zip(documents, sniffed)]
+        classifier_agent = await agent_registry.aget("classifier")
+        classifications = await classifier_agent.aprocess_batch(
+            process_ids, classifier_inputs, max_concurrency=BATCH_MAX_CONCURRENCY,
+            payloads=[doc["document"].json_payload() for doc in documents], sniffed=sniffed,
+            sizes=[doc["document"].size for doc in documents])
+
+        statuses: List[Optional[str]] = [None] * len(documents)
+
+        email_indices = [i for i, c in enumerate(classifications) if c.format == "Email" and documents[i]["document"].text()]
+        if email_indices:
+            try:
+                email_agent = await agent_registry.aget("email")
+                await email_agent.aprocess_batch(
+                    [process_ids[i] for i in email_indices],
+                    [documents[i]["document"].text() for i in email_indices],
+                    max_concurrency=BATCH_MAX_CONCURRENCY
+                )
+                for i in email_indices:
+                    statuses[i] = "Email processed"
+            except Exception as e:
+                print(f"Error during batched email processing: {e}")
+                for i in email_indices:
+                    await memory.aadd_entry(process_ids[i], "agent_processing_error", {"error": str(e)})
+                    statuses[i] = f"Agent processing failed: {e}"
+
+        batch_slots = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+
+        async def route(i: int):
+            async with batch_slots:
+                with telemetry.track(process_ids[i]) as timer:
+                    telemetry.set_labels(format=classifications[i].format, intent=classifications[i].intent)
+                    with telemetry.span("agent", classifications[i].format.lower()):
+                        statuses[i] = await route_to_agent(process_ids[i], classifications[i], documents[i]["document"])
+                    await record_stage_timings(process_ids[i], timer, "failed" if "failed" in statuses[i] else "ok")
+
+        await asyncio.gather(*(route(i) for i in range(len(documents)) if statuses[i] is None))
+
+        duration = time.time() - start_time
+        for process_id, status in zip(process_ids, statuses):
+            await memory.aadd_entry(process_id, "processing_summary", {"status": status, "duration_seconds": duration})
+        print(f"--- Batch {batch_id} complete in {duration:.2f}s ---")
+
+        return JSONResponse(content={
+            "batch_id": batch_id,
+            "duration_seconds": duration,
+            "documents": [
+                {
+                    "process_id": process_id,
+                    "original_filename": doc["original_filename"],
+                    "format": classification.format,
+                    "intent": classification.intent,
+                    "status": status
+                }
+                for process_id, doc, classification, status in zip(process_ids, documents, classifications, statuses)
+            ]
+        })
+
+
+# Line-by-line webhook ingestion: lines per batch (one trace flush and one action append each), how long
+# a batch may wait to fill up, and the longest line accepted.
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "200"))
+WEBHOOK_BATCH_MAX_WAIT_SECONDS = float(os.getenv("WEBHOOK_BATCH_MAX_WAIT_MS", "50")) / 1000
+WEBHOOK_MAX_LINE_BYTES = int(os.getenv("WEBHOOK_MAX_LINE_BYTES", str(1024 * 1024)))
+
+@router.post("/ingest/webhooks")
+async def ingest_webhooks(request: Request):
+    """
+    Ingests a stream of webhook events as newline-delimited JSON (one event per line, any body length).
+    Events skip classification: each is parsed and validated by the JSON agent as it arrives, with its
+    own process_id and trace. Trace writes and follow-up actions are batched per WEBHOOK_BATCH_SIZE
+    lines (or whatever arrived within WEBHOOK_BATCH_MAX_WAIT_MS). The response streams one NDJSON
+    result per line, then a final summary line.
+    """
+    stream_id = str(uuid.uuid4())
+
+    async def results():
+        started = time.time()
+        totals = {"lines": 0, "valid": 0, "invalid": 0, "rejected": 0, "failed": 0}
+        async for batch in aiter_line_batches(request.stream(), WEBHOOK_MAX_LINE_BYTES, WEBHOOK_BATCH_SIZE, WEBHOOK_BATCH_MAX_WAIT_SECONDS):
+            lines = []
+            for result in await ingest_webhook_batch(stream_id, batch):
+                totals["lines"] += 1
+                totals[result["status"]] += 1
+                lines.append(json.dumps(result) + "\n")
+            yield "".join(lines)
+        yield json.dumps({"summary": {"stream_id": stream_id, **totals, "duration_seconds": round(time.time() - started, 3)}}) + "\n"
+
+    return RequestStreamingResponse(results(), media_type="application/x-ndjson")
+
+async def ingest_webhook_batch(stream_id: str, batch: List[Tuple[int, Optional[bytes]]]) -> List[Dict[str, Any]]:
+    """Runs one batch of NDJSON lines through the JSON agent; returns one result per line."""
+    process_ids = [str(uuid.uuid4()) if line is not None else None for _, line in batch]
+    results = []
+    json_agent = await agent_registry.aget("json")
+    with telemetry.span("ingest_batch", "json"):
+        async with memory.buffered(*(pid for pid in process_ids if pid)), action_router.queue.batched():
+            for (line_no, line), process_id in zip(batch, process_ids):
+                if line is None:
+                    results.append({"line": line_no, "process_id": None, "status": "rejected",
+                                    "anomalies": [f"Line exceeds the {WEBHOOK_MAX_LINE_BYTES} byte limit."]})
+                    continue
+                started = time.time()
+                try:
+                    payload = schemas.loads(line)
+                except ValueError:
+                    payload = None  # the agent reports the decode error
+                await memory.aadd_entry(process_id, "input_metadata", {
+                    "process_id": process_id, "timestamp": started, "source_type": "ndjson_stream",
+                    "stream_id": stream_id, "line": line_no})
+                try:
+                    result = await json_agent.aprocess(process_id, line.decode('utf-8', errors='replace'),
+                                                       payload=payload if isinstance(payload, dict) else None)
+                except Exception as e:
+                    # One failing event must not cost the rest of its batch their results.
+                    print(f"Webhook ingest: line {line_no} of stream {stream_id} failed: {e}")
+                    await memory.aadd_entry(process_id, "processing_summary", {"status": f"JSON processing failed: {e}", "duration_seconds": time.time() - started})
+                    results.append({"line": line_no, "process_id": process_id, "status": "failed", "anomalies": [f"Processing failed: {e}"]})
+                    continue
+                await memory.aadd_entry(process_id, "processing_summary", {"status": "JSON processed", "duration_seconds": time.time() - started})
+                results.append({
+                    "line": line_no, "process_id": process_id, "status": "valid" if result.is_valid_schema else "invalid",
+                    "event_type": payload.get("event_type") if isinstance(payload, dict) else None, "anomalies": result.anomalies
+                })
+    return results
 
-@app.get("/trace/{process_id}")
+
+@router.get("/trace/{process_id}")
 async def get_trace(process_id: str):
     """
     Retrieves the full processing trace for a given process_id from shared memory.
     """
-    trace = memory.get_all_entries_for_process(process_id)
+    trace = await memory.aget_all_entries_for_process(process_id)
     if not trace:
         raise HTTPException(status_code=404, detail="Process ID not found.")
     return JSONResponse(content={"process_id": process_id, "trace": trace})
 
-@app.get("/health")
+@router.get("/trace/{process_id}/events")
+async def stream_trace(process_id: str, request: Request):
+    """
+    Streams a process trace as Server-Sent Events: the entries written so far, then each new entry
+    as it is written. Ends once the processing summary and every queued action's outcome have been
+    sent, or after TRACE_STREAM_TIMEOUT_SECONDS.
+    """
+    timeout = float(os.getenv("TRACE_STREAM_TIMEOUT_SECONDS", "300"))
+
+    def is_complete(keys) -> bool:
+        if "processing_summary" not in keys:
+            return False
+        return all(f"action_triggered:{key.split(':', 1)[1]}" in keys for key in keys if key.startswith("action_queued:"))
+
+    async def events():
+        # Subscribe before reading the snapshot so nothing written in between is missed.
+        async with memory.events.subscribe(process_id) as queue:
+            snapshot = await memory.aget_all_entries_for_process(process_id)
+            seen = set(snapshot)
+            for key, value in snapshot.items():
+                yield f"event: entry\ndata: {json.dumps({'key': key, 'value': value})}\n\n"
+            ends_at = time.monotonic() + timeout
+            while not is_complete(seen) and time.monotonic() < ends_at:
+                if await request.is_disconnected():
+                    return
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=min(15.0, max(ends_at - time.monotonic(), 0.01)))
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                for key, value in json.loads(message)["entries"].items():
+                    seen.add(key)
+                    yield f"event: entry\ndata: {json.dumps({'key': key, 'value': value})}\n\n"
+            yield f"event: end\ndata: {json.dumps({'complete': is_complete(seen)})}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Default time range of /processes queries, ending now.
+PROCESSES_DEFAULT_WINDOW_SECONDS = float(os.getenv("PROCESSES_DEFAULT_WINDOW_SECONDS", "86400"))
+# Trace entries summarized for each listed process.
+PROCESS_SUMMARY_ENTRIES = ["input_metadata", "classifier_agent_output", "processing_summary"]
+
+@router.get("/processes")
+async def list_processes(
+    format: Optional[str] = None,
+    intent: Optional[str] = None,
+    status: Optional[str] = Query(None, description="ok or failed"),
+    source: Optional[str] = Query(None, description="input source_type, e.g. file, raw_content, ndjson_stream"),
+    tone: Optional[str] = None,
+    urgency: Optional[str] = None,
+    document_type: Optional[str] = None,
+    flag: Optional[str] = Query(None, description="a PDF flag, e.g. Invoice_Total_High"),
+    event_type: Optional[str] = None,
+    anomaly: Optional[str] = Query(None, description="json: JSON documents with anomalies"),
+    action: Optional[str] = Query(None, description="an action type, e.g. CRM_Escalation"),
+    since: Optional[float] = Query(None, description="Unix time; defaults to PROCESSES_DEFAULT_WINDOW_SECONDS before `until`"),
+    until: Optional[float] = Query(None, description="Unix time; defaults to now"),
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    count: bool = Query(False, description="Also count every match in the range"),
+    group_by: Optional[str] = Query(None, description=f"Count matches per value of one of: {', '.join(DIMENSIONS)}")
+):
+    """
+    Processed documents matching every given filter, newest first, from the secondary indexes kept
+    as traces are written (e.g. `?intent=Fraud Risk&format=Email&since=<an hour ago>`).
+    Pages are cursor-based: pass `next_cursor` back until it is null.
+    """
+    if not memory.index_enabled:
+        raise HTTPException(status_code=404, detail="Trace indexing is disabled (TRACE_INDEX_ENABLED=false).")
+    filters = {dimension: value for dimension, value in {
+        "format": format, "intent": intent, "status": status, "source": source, "tone": tone, "urgency": urgency,
+        "document_type": document_type, "flag": flag, "event_type": event_type, "anomaly": anomaly, "action": action
+    }.items() if value}
+    if group_by is not None and group_by not in DIMENSIONS:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of: {', '.join(DIMENSIONS)}")
+    until = until if until is not None else time.time()
+    since = since if since is not None else until - PROCESSES_DEFAULT_WINDOW_SECONDS
+    if since > until:
+        raise HTTPException(status_code=400, detail="since must not be after until.")
+
+    try:
+        # Nothing older than the index TTL exists, so the range is cut to it before any bucket is read.
+        since, until = memory.index.window(since, until)
+        page = await memory.index.aquery(filters, since, until, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    summaries = await memory.aget_entries_many([item["process_id"] for item in page["items"]], PROCESS_SUMMARY_ENTRIES)
+    for item in page["items"]:
+        entries = summaries.get(item["process_id"], {})
+        metadata = entries.get("input_metadata") or {}
+        classification = entries.get("classifier_agent_output") or {}
+        item.update({
+            "received_at": metadata.get("timestamp"),
+            "source_type": metadata.get("source_type"),
+            "original_filename": metadata.get("original_filename"),
+            "format": classification.get("format"),
+            "intent": classification.get("intent"),
+            "status": (entries.get("processing_summary") or {}).get("status"),
+            "trace_url": f"/trace/{item['process_id']}",
+        })
+
+    content: Dict[str, Any] = {"filters": filters, "since": since, "until": until, **page}
+    if count:
+        content["count"] = await memory.index.acount(filters, since, until)
+    if group_by is not None:
+        content["aggregate"] = await memory.index.aaggregate(group_by, filters, since, until)
+    return JSONResponse(content=content)
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Stage/document latency histograms and token/action counters in the Prometheus text format.
+    Metrics are per process: scrape every uvicorn worker (and worker.py) separately.
+    """
+    return PlainTextResponse(telemetry.registry.render(), media_type="text/plain; version=0.0.4")
+
+@router.get("/health")
 async def health_check():
     """
-    Basic health check endpoint.
+    Basic health check endpoint (liveness). `ready` and `startup` report this worker's startup profile.
+    """
+    return {"status": "ok", "message": "Multi-Agent System is running", "memory": memory.stats(), "actions": action_router.queue.stats(),
+            "processing_mode": PROCESSING_MODE, "jobs": job_queue.stats(), "llm": llm_gateway.stats(),
+            "idempotency": idempotency.stats() if idempotency is not None else None,
+            "near_duplicates": near_duplicates.stats() if near_duplicates is not None else None,
+            "ready": startup.ready, "agents": agent_registry.built(), "startup": startup.summary()}
+
+@router.get("/health/ready")
+async def readiness_check():
     """
-    return {"status": "ok", "message": "Multi-Agent System is running"}
\ No newline at end of file
+    Readiness: `200` once this worker has connected to Redis (or fallen back) and built its agents
+    (with AGENT_WARMUP=background or eager), `503` until then.
+    """
+    content = {"ready": startup.ready, "redis_backed": memory.is_redis_backed, "agents": agent_registry.built(),
+               "ready_after_seconds": startup.ready_after}
+    return JSONResponse(status_code=200 if startup.ready else 503, content=content)
+
+
+def create_app() -> FastAPI:
+    """
+    Builds the FastAPI app around this module's shared services, which connect to Redis and build
+    their agents at startup rather than on import. Served as `main:app`, or `--factory main:create_app`.
+    """
+    application = FastAPI(
+        lifespan=lifespan,
+        title="Multi-Agent Document Processing System",
+        description="Processes various document formats, classifies intent, routes to specialized agents, and triggers dynamic actions.",
+        version="1.0.0"
+    )
+    application.include_router(router)
+    return application
+
+app = create_app()
+
+startup.record("import", time.perf_counter() - _import_started)
+startup.sample_memory("imported")
\ No newline at end of file
@@ -0,0 +1,39 @@
+# File: /multi_agent_system/tests/conftest.py
+import os
+
+import pytest
+import redis
+import redis.asyncio
+
+# The agent modules build their Gemini clients on import; no request ever reaches the provider in tests.
+os.environ.setdefault("GOOGLE_API_KEY", "test")
+
+
+@pytest.fixture(params=["none", "fake"])
+def redis_backend(request, monkeypatch):
+    """
+    Which store SharedMemory finds at startup: "none" makes Redis unreachable (the in-memory
+    fallback), "fake" points every client at one fakeredis server, as `benchmarks/run.py` does.
+    """
+    if request.param == "none":
+        class Unavailable(redis.asyncio.Redis):
+            async def ping(self, *args, **kwargs):
+                raise redis.exceptions.ConnectionError("Redis disabled for this test")
+
+        monkeypatch.setattr(redis.asyncio, "Redis", Unavailable)
+        return request.param
+
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+
+    class FakeSync(fakeredis.FakeRedis):
+        def __init__(self, *args, host=None, port=None, db=None, **kwargs):
+            super().__init__(server=server, **kwargs)
+
+    class FakeAsync(fakeredis.aioredis.FakeRedis):
+        def __init__(self, *args, host=None, port=None, db=None, **kwargs):
+            super().__init__(server=server, **kwargs)
+
+    monkeypatch.setattr(redis, "Redis", FakeSync)
+    monkeypatch.setattr(redis.asyncio, "Redis", FakeAsync)
+    return request.param
@@ -0,0 +1,38 @@
+# File: /multi_agent_system/tests/test_classifier_agent.py
+import asyncio
+import json
+from pathlib import Path
+
+from agents.classifier_agent import ClassifierAgent
+from agents.models import WEBHOOK_SCHEMAS
+from core.memory import SharedMemory
+from core.schemas import SchemaRegistry
+from core.uploads import InputDocument
+
+SAMPLES = Path(__file__).resolve().parent.parent / "samples"
+
+
+def test_trace_records_the_document_size_not_the_prefix(redis_backend):
+    # A registered webhook is classified from the schema registry, so no LLM call is made.
+    body = json.loads((SAMPLES / "webhook_data.json").read_text())
+    body["data"]["notes"] = "é" * 5000
+    content = json.dumps(body, ensure_ascii=False)
+
+    async def scenario():
+        memory = SharedMemory()
+        await memory.aconnect(timeout=0.5)
+        agent = ClassifierAgent(memory, schema_registry_instance=SchemaRegistry(WEBHOOK_SCHEMAS))
+        document = InputDocument.from_text(content)
+        prefix = document.prefix_text()[:512]
+        result = await agent.aprocess("process-1", prefix, payload=document.json_payload(), size=document.size)
+        single = await memory.aget_entry("process-1", "classifier_agent_input")
+        await agent.aprocess_batch(["process-2"], [prefix], payloads=[document.json_payload()], sizes=[document.size])
+        batch = await memory.aget_entry("process-2", "classifier_agent_input")
+        return result, single, batch, document.size
+
+    result, single, batch, size = asyncio.run(scenario())
+    assert result.format == "JSON"
+    assert size == len(content.encode("utf-8"))
+    for trace in (single, batch):
+        assert trace["content_length"] == size
+        assert trace["prefix_length"] == 512
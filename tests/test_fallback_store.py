@@ -0,0 +1,63 @@
+# File: /multi_agent_system/tests/test_fallback_store.py
+from core.fallback_store import FallbackStore
+
+
+def test_lru_traces_are_evicted_beyond_the_budget():
+    store = FallbackStore(max_bytes=100)
+    store.set_entries("a", {"k": b"x" * 40})
+    store.set_entries("b", {"k": b"x" * 40})
+    store.get_entry("a", "k")  # "b" is now the least recently used
+    store.set_entries("c", {"k": b"x" * 40})
+    assert store.get_entries("b") == {}
+    assert store.get_entries("a") and store.get_entries("c")
+    assert store.evictions == 1 and store.resident_bytes <= 100
+
+
+def test_a_trace_larger_than_the_budget_is_kept():
+    store = FallbackStore(max_bytes=100)
+    store.set_entries("small", {"k": b"x" * 40})
+    store.set_entries("huge", {"k": b"x" * 500})
+    assert store.get_entries("huge") == {"k": b"x" * 500}
+    assert store.get_entries("small") == {}
+    store.set_entries("huge", {"more": b"y" * 10})
+    assert set(store.get_entries("huge")) == {"k", "more"}
+    assert store.stats()["resident_processes"] == 1
+
+
+def spill_rows(path) -> set:
+    import sqlite3
+    with sqlite3.connect(path) as db:
+        return {row[0] for row in db.execute("SELECT process_id FROM traces")}
+
+
+def test_spilled_traces_survive_a_crash_after_being_read(tmp_path):
+    path = str(tmp_path / "traces.db")
+    store = FallbackStore(max_bytes=100, spill_path=path)
+    store.set_entries("a", {"k": b"x" * 60})
+    store.set_entries("b", {"k": b"y" * 60})  # spills "a"
+    assert spill_rows(path) == {"a"}
+    assert store.get_entry("a", "k") == b"x" * 60  # reads "a" back, spilling "b"
+    assert spill_rows(path) == {"a", "b"}
+
+    # No close(): the process dies with "a" resident. Its row is still on disk.
+    restarted = FallbackStore(max_bytes=100, spill_path=path)
+    assert restarted.get_entries("a") == {"k": b"x" * 60}
+    assert restarted.get_entries("b") == {"k": b"y" * 60}
+    restarted.close()
+
+
+def test_respill_replaces_the_row_and_expiry_deletes_it(tmp_path):
+    path = str(tmp_path / "traces.db")
+    store = FallbackStore(max_bytes=100, spill_path=path)
+    store.set_entries("a", {"k": b"x" * 60})
+    store.set_entries("b", {"k": b"y" * 60})
+    store.set_entries("a", {"extra": b"z"})  # read back, changed, and spilled again on close
+    store.close()
+    restarted = FallbackStore(max_bytes=100, spill_path=path)
+    assert restarted.get_entries("a") == {"k": b"x" * 60, "extra": b"z"}
+
+    restarted.ttl_seconds = -1
+    restarted.set_entries("b", {"k": b"y"})  # now expired
+    assert restarted.get_entries("b") == {}
+    assert spill_rows(path) == {"a"}
+    restarted.close()
@@ -0,0 +1,202 @@
+# File: /multi_agent_system/tests/test_idempotency.py
+import asyncio
+import json
+
+import pytest
+
+from core.idempotency import IdempotencyClaim, IdempotencyConflict, IdempotencyStore
+from core.memory import SharedMemory
+
+
+async def connected_memory() -> SharedMemory:
+    memory = SharedMemory()
+    await memory.aconnect(timeout=0.5)
+    return memory
+
+
+def make_store(memory: SharedMemory, **settings) -> IdempotencyStore:
+    options = dict(content_ttl_seconds=600, wait_timeout_seconds=5.0, poll_interval_seconds=0.05)
+    options.update(settings)
+    return IdempotencyStore(memory, **options)
+
+
+@pytest.fixture
+def app(redis_backend, monkeypatch):
+    """main.process_input against a fresh store, with document processing replaced by a counter."""
+    import main
+
+    state = {"runs": 0, "statuses": [], "delay": 0.05}
+
+    async def process_document(process_id, document):
+        state["runs"] += 1
+        await asyncio.sleep(state["delay"])
+        status = state["statuses"].pop(0) if state["statuses"] else "Email processed"
+        await main.memory.aadd_entry(process_id, "email_agent_output", {"tone": "polite"})
+        return status
+
+    async def setup(**settings):
+        memory = await connected_memory()
+        monkeypatch.setattr(main, "memory", memory)
+        monkeypatch.setattr(main, "idempotency", make_store(memory, **settings))
+        return main
+
+    monkeypatch.setattr(main, "PROCESSING_MODE", "inline")
+    monkeypatch.setattr(main, "process_document", process_document)
+    state["setup"] = setup
+    return state
+
+
+async def submit(main, content: str, idempotency_key=None):
+    response = await main.process_input(file=None, raw_content=content, input_type_hint=None, process_id=None,
+                                        idempotency_key=idempotency_key)
+    return response.status_code, json.loads(response.body), response.headers
+
+
+def test_concurrent_identical_requests_are_processed_once(app):
+    async def scenario():
+        main = await app["setup"]()
+        return await asyncio.gather(*(submit(main, "Subject: Invoice 42\n\nPlease pay.") for _ in range(4)))
+
+    results = asyncio.run(scenario())
+    assert app["runs"] == 1
+    assert {body["process_id"] for _, body, _ in results} == {results[0][1]["process_id"]}
+    assert all(status == 200 and body["status"] == "Email processed" for status, body, _ in results)
+    assert sum(1 for _, _, headers in results if headers.get("Idempotent-Replayed") == "true") == 3
+
+
+def test_repeat_after_completion_is_replayed(app):
+    async def scenario():
+        main = await app["setup"]()
+        first = await submit(main, "same body", idempotency_key="order-7")
+        second = await submit(main, "same body", idempotency_key="order-7")
+        conflict = None
+        try:
+            await submit(main, "another body", idempotency_key="order-7")
+        except Exception as e:
+            conflict = e
+        return first, second, conflict
+
+    first, second, conflict = asyncio.run(scenario())
+    assert app["runs"] == 1
+    assert second[1]["process_id"] == first[1]["process_id"] and second[1]["idempotent_replay"]
+    assert getattr(conflict, "status_code", None) == 422
+
+
+def test_failed_original_is_taken_over_by_a_waiting_repeat(app):
+    app["statuses"] = ["Processing failed: provider error"]
+
+    async def scenario():
+        main = await app["setup"]()
+        first = asyncio.ensure_future(submit(main, "flaky body"))
+        await asyncio.sleep(0.01)
+        second = await submit(main, "flaky body")
+        return await first, second
+
+    first, second = asyncio.run(scenario())
+    assert app["runs"] == 2
+    assert "failed" in first[1]["status"]
+    assert second[1]["status"] == "Email processed"
+    assert second[1]["process_id"] != first[1]["process_id"]
+    assert "idempotent_replay" not in second[1]
+
+
+def test_waiter_times_out_while_the_original_runs(app):
+    app["delay"] = 0.5
+
+    async def scenario():
+        main = await app["setup"](wait_timeout_seconds=0.1)
+        first = asyncio.ensure_future(submit(main, "slow body"))
+        await asyncio.sleep(0.01)
+        second = await submit(main, "slow body")
+        return await first, second
+
+    first, second = asyncio.run(scenario())
+    assert app["runs"] == 1
+    assert second[0] == 409
+    assert second[1]["process_id"] == first[1]["process_id"]
+
+
+@pytest.mark.parametrize("events_enabled", [True, False])
+def test_repeat_in_another_worker_waits_for_the_trace(redis_backend, events_enabled):
+    if redis_backend == "none":
+        pytest.skip("workers only share claims through Redis")
+
+    async def scenario():
+        original_memory, repeat_memory = await connected_memory(), await connected_memory()
+        # With events the waiter wakes on the summary's trace event, long before its next poll; without, it polls.
+        original_memory.events_enabled = events_enabled
+        original = make_store(original_memory)
+        repeat = make_store(repeat_memory, poll_interval_seconds=30.0 if events_enabled else 0.05)
+        key = original.make_key(None, "digest")["key"]
+        claim = await original.aclaim(key, "content", "process-1", "digest")
+        assert isinstance(claim, IdempotencyClaim)
+        record = await repeat.aclaim(key, "content", "process-2", "digest")
+        assert record["process_id"] == "process-1"
+
+        waiter = asyncio.ensure_future(repeat.await_original(key, "process-1"))
+        await asyncio.sleep(0.1)
+        assert not waiter.done()
+        await original_memory.aadd_entry("process-1", "processing_summary", {"status": "Email processed"})
+        original.complete(claim)
+        finished = await asyncio.wait_for(waiter, timeout=2)
+        await repeat_memory.events.aclose()
+        return finished
+
+    assert asyncio.run(scenario()) is True
+
+
+def test_stale_claim_of_another_worker_is_taken_over(redis_backend):
+    if redis_backend == "none":
+        pytest.skip("workers only share claims through Redis")
+
+    async def scenario():
+        crashed_memory, repeat_memory = await connected_memory(), await connected_memory()
+        # The original's worker dies mid-request: its claim is never completed and lapses after the content TTL.
+        crashed, repeat = make_store(crashed_memory, content_ttl_seconds=1), make_store(repeat_memory, content_ttl_seconds=1)
+        key = crashed.make_key(None, "digest")["key"]
+        assert isinstance(await crashed.aclaim(key, "content", "process-1", "digest"), IdempotencyClaim)
+        assert (await repeat.aclaim(key, "content", "process-2", "digest"))["process_id"] == "process-1"
+        finished = await repeat.await_original(key, "process-1")
+        takeover = await repeat.aclaim(key, "content", "process-2", "digest")
+        await repeat_memory.events.aclose()
+        return finished, takeover
+
+    finished, takeover = asyncio.run(scenario())
+    assert finished is False
+    assert isinstance(takeover, IdempotencyClaim) and takeover.process_id == "process-2"
+
+
+def test_cross_worker_waiter_times_out(redis_backend):
+    if redis_backend == "none":
+        pytest.skip("workers only share claims through Redis")
+
+    async def scenario():
+        original_memory, repeat_memory = await connected_memory(), await connected_memory()
+        original, repeat = make_store(original_memory), make_store(repeat_memory, wait_timeout_seconds=0.2)
+        key = original.make_key(None, "digest")["key"]
+        await original.aclaim(key, "content", "process-1", "digest")
+        await repeat.aclaim(key, "content", "process-2", "digest")
+        with pytest.raises(asyncio.TimeoutError):
+            await repeat.await_original(key, "process-1")
+        await repeat_memory.events.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_release_only_removes_its_own_claim(redis_backend):
+    async def scenario():
+        store = make_store(await connected_memory())
+        key = store.make_key("client-key", "digest")["key"]
+        first = await store.aclaim(key, "header", "process-1", "digest")
+        await store.arelease(first)
+        second = await store.aclaim(key, "header", "process-2", "digest")
+        # A late release of the first claim must not drop the second one.
+        await store.arelease(first)
+        repeat = await store.aclaim(key, "header", "process-3", "digest")
+        with pytest.raises(IdempotencyConflict):
+            await store.aclaim(key, "header", "process-4", "other-digest")
+        return second, repeat
+
+    second, repeat = asyncio.run(scenario())
+    assert isinstance(second, IdempotencyClaim) and second.process_id == "process-2"
+    assert repeat["process_id"] == "process-2"
@@ -0,0 +1,56 @@
+# File: /multi_agent_system/tests/test_json_agent.py
+import asyncio
+import json
+from pathlib import Path
+
+from agents.json_agent import JsonAgent
+from core.memory import SharedMemory
+
+SAMPLES = Path(__file__).resolve().parent.parent / "samples"
+
+
+class RecordingRouter:
+    """Collects the actions an agent triggers instead of queueing them."""
+
+    def __init__(self):
+        self.actions = []
+
+    async def atrigger_anomaly_alert(self, process_id, details):
+        self.actions.append(("Anomaly_Alert", details))
+
+    async def atrigger_logging_and_close(self, process_id, details):
+        self.actions.append(("Log_and_Close", details))
+
+
+def run_agent(content: str, payload=None):
+    async def scenario():
+        memory = SharedMemory()
+        await memory.aconnect(timeout=0.5)
+        router = RecordingRouter()
+        result = await JsonAgent(memory, router).aprocess("process-1", content, payload=payload)
+        return result, await memory.aget_entry("process-1", "json_agent_output"), router.actions
+
+    return asyncio.run(scenario())
+
+
+def test_array_body_is_flagged_not_rejected(redis_backend):
+    body = [{"event_type": "order_created"}, {"event_type": "payment_failed"}]
+    result, stored, actions = run_agent(json.dumps(body))
+    assert result.is_valid_schema is False
+    assert result.parsed_data == {"items": body}
+    assert stored["parsed_data"] == {"items": body}
+    assert [action for action, _ in actions] == ["Anomaly_Alert"]
+    assert actions[0][1]["reason"] == "JSON_Not_An_Object"
+
+
+def test_registered_event_is_validated(redis_backend):
+    content = (SAMPLES / "webhook_data.json").read_text()
+    result, _, actions = run_agent(content, payload=json.loads(content))
+    assert result.anomalies == [] and result.is_valid_schema
+    assert [action for action, _ in actions] == ["Log_and_Close"]
+
+
+def test_malformed_body_is_flagged(redis_backend):
+    result, _, actions = run_agent('{"event_type": ')
+    assert result.parsed_data is None and not result.is_valid_schema
+    assert actions[0][1]["reason"] == "JSON_Decode_Error"
@@ -0,0 +1,225 @@
+# File: /multi_agent_system/tests/test_llm_gateway.py
+import asyncio
+
+import pytest
+
+from core import llm_gateway
+from core.llm_gateway import LLMGateway
+
+
+class RateLimited(Exception):
+    """A 429 as the Gemini SDK raises it."""
+
+    code = 429
+
+
+class SdkModel:
+    """Stands in for ChatGoogleGenerativeAI: makes `max_retries` attempts per call, like the SDK's HttpRetryOptions."""
+
+    def __init__(self, model: str, max_retries: int = 6, timeout=None, **kwargs):
+        self.model = model
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.provider_calls = 0
+
+    async def ainvoke(self, prompt):
+        for _ in range(self.max_retries):
+            self.provider_calls += 1
+            await asyncio.sleep(0)
+        raise RateLimited("429 RESOURCE_EXHAUSTED")
+
+
+def make_gateway(**settings) -> LLMGateway:
+    gateway = LLMGateway()
+    gateway.cooldown = 0.01
+    gateway.backoff_base = 0.001
+    gateway.backoff_max = 0.002
+    for name, value in settings.items():
+        setattr(gateway, name, value)
+    return gateway
+
+
+def test_rate_limits_reach_the_gateway_once_per_attempt(monkeypatch):
+    langchain_google_genai = pytest.importorskip("langchain_google_genai")
+    monkeypatch.setattr(langchain_google_genai, "ChatGoogleGenerativeAI", SdkModel)
+    gateway = make_gateway(max_retries=2, initial_concurrency=8)
+    client = gateway.client("gemini-test")
+    assert client.max_retries == 1 and client.timeout == gateway.call_timeout
+
+    async def scenario():
+        info = {}
+        with pytest.raises(RateLimited):
+            await gateway.acall("gemini-test", llm_gateway.PRIORITY_EXTRACTION, 10, lambda: client.ainvoke("hi"), info=info)
+        return info
+
+    info = asyncio.run(scenario())
+    limiter = gateway.limiter("gemini-test")
+    assert info["attempts"] == 3
+    assert client.provider_calls == 3
+    assert limiter.counters["rate_limited"] == 3
+    assert limiter.counters["retried"] == 2
+    assert limiter.limit == 1.0  # halved on each of the three 429s: 8 -> 4 -> 2 -> 1
+    assert limiter.in_flight == 0
+
+
+def make_limiter(**settings) -> llm_gateway.ModelLimiter:
+    options = dict(rpm=1000, tpm=1_000_000, initial_concurrency=1, min_concurrency=1, max_concurrency=1,
+                   latency_target=1.0, cooldown=0.05)
+    options.update(settings)
+    return llm_gateway.ModelLimiter("gemini-test", **options)
+
+
+def test_waiters_are_granted_by_priority_then_arrival():
+    async def scenario():
+        limiter = make_limiter()
+        await limiter.acquire(llm_gateway.PRIORITY_EXTRACTION, 1)
+        order = []
+
+        async def waiter(name, priority):
+            await limiter.acquire(priority, 1)
+            order.append(name)
+
+        tasks = []
+        for name, priority in [("extract-1", llm_gateway.PRIORITY_EXTRACTION), ("extract-2", llm_gateway.PRIORITY_EXTRACTION),
+                               ("classify-1", llm_gateway.PRIORITY_CLASSIFIER), ("classify-2", llm_gateway.PRIORITY_CLASSIFIER)]:
+            tasks.append(asyncio.ensure_future(waiter(name, priority)))
+            await asyncio.sleep(0)
+        assert limiter.stats()["queue_depth"] == {"classifier": 2, "extraction": 2}
+        # A free slot is not taken past queued callers of the same or a higher priority.
+        assert not limiter.try_acquire(llm_gateway.PRIORITY_EXTRACTION, 1)
+        for _ in tasks:
+            limiter.release(0.01, "ok")
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        assert order == ["classify-1", "classify-2", "extract-1", "extract-2"]
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiters_are_skipped():
+    async def scenario():
+        limiter = make_limiter()
+        await limiter.acquire(llm_gateway.PRIORITY_EXTRACTION, 1)
+        cancelled = asyncio.ensure_future(limiter.acquire(llm_gateway.PRIORITY_CLASSIFIER, 1))
+        queued = asyncio.ensure_future(limiter.acquire(llm_gateway.PRIORITY_EXTRACTION, 1))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.gather(cancelled, return_exceptions=True)
+        limiter.release(0.01, "ok")
+        await asyncio.wait_for(queued, timeout=1)
+        assert limiter.in_flight == 1
+
+    asyncio.run(scenario())
+
+
+def test_token_buckets_refill_per_minute(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm_gateway.time, "monotonic", lambda: now[0])
+    requests = llm_gateway.TokenBucket(60)  # one request per second
+    for _ in range(60):
+        assert requests.wait_time(1) == 0.0
+        requests.take(1)
+    assert requests.wait_time(1) == pytest.approx(1.0)
+    now[0] += 0.5
+    assert requests.wait_time(1) == pytest.approx(0.5)
+    now[0] += 600
+    assert requests.level == pytest.approx(0.5)
+    requests.wait_time(1)
+    assert requests.level == 60  # never more than a minute's worth
+
+    tokens = llm_gateway.TokenBucket(6000)  # 100 tokens per second
+    tokens.take(6000)
+    assert tokens.wait_time(500) == pytest.approx(5.0)
+    # A call larger than the bucket waits for a full bucket, not forever.
+    assert tokens.wait_time(10_000) == pytest.approx(60.0)
+    # Actual usage above the estimate is charged afterwards, and may leave the bucket in debt.
+    tokens.adjust(1000)
+    assert tokens.wait_time(500) == pytest.approx(15.0)
+
+
+def test_limiter_waits_for_the_request_bucket():
+    async def scenario():
+        limiter = make_limiter(rpm=60, initial_concurrency=4, max_concurrency=4)
+        limiter.requests.level = 0
+        started = asyncio.get_running_loop().time()
+        await asyncio.wait_for(limiter.acquire(llm_gateway.PRIORITY_CLASSIFIER, 1), timeout=5)
+        return asyncio.get_running_loop().time() - started
+
+    assert 0.8 < asyncio.run(scenario()) < 2.0
+
+
+def test_aimd_grows_on_fast_calls_and_backs_off():
+    async def scenario():
+        limiter = make_limiter(initial_concurrency=4, max_concurrency=8)
+        for _ in range(4):
+            await limiter.acquire(llm_gateway.PRIORITY_EXTRACTION, 1)
+            limiter.release(0.1, "ok")
+        expected = 4.0
+        for _ in range(4):
+            expected += 1 / expected
+        grown = limiter.limit
+        assert grown == pytest.approx(expected)
+        assert 4.9 < grown < 5.0  # about one slot per window of fast calls
+
+        await limiter.acquire(llm_gateway.PRIORITY_EXTRACTION, 1)
+        limiter.release(5.0, "ok")  # slower than the latency target
+        assert limiter.limit == pytest.approx(grown * 0.9)
+
+        slowed = limiter.limit
+        await limiter.acquire(llm_gateway.PRIORITY_EXTRACTION, 1)
+        limiter.release(0.1, "rate_limited")
+        assert limiter.limit == pytest.approx(slowed / 2)
+        assert limiter.stats()["paused_seconds"] > 0
+        # Everyone sits out the cooldown after a 429.
+        assert not limiter.try_acquire(llm_gateway.PRIORITY_CLASSIFIER, 1)
+        await asyncio.sleep(0.06)
+        assert limiter.try_acquire(llm_gateway.PRIORITY_CLASSIFIER, 1)
+        limiter.release(0.1, "ok")
+
+        for _ in range(10):
+            await limiter.acquire(llm_gateway.PRIORITY_EXTRACTION, 1)
+            limiter.release(0.1, "rate_limited")
+            await asyncio.sleep(0.06)
+        assert limiter.limit == limiter.min_concurrency
+
+    asyncio.run(scenario())
+
+
+def test_hedged_call_cancels_the_loser():
+    gateway = make_gateway(hedging=True, hedge_min_samples=5, initial_concurrency=4)
+
+    async def scenario():
+        async def fast():
+            await asyncio.sleep(0.01)
+            return "warm-up"
+
+        for _ in range(5):
+            await gateway.acall("gemini-test", llm_gateway.PRIORITY_EXTRACTION, 10, fast)
+
+        calls = []
+        loser_cancelled = asyncio.Event()
+
+        async def call():
+            calls.append(len(calls))
+            if len(calls) == 1:
+                try:
+                    await asyncio.sleep(10)
+                except asyncio.CancelledError:
+                    loser_cancelled.set()
+                    raise
+                return "primary"
+            await asyncio.sleep(0.01)
+            return "hedge"
+
+        info = {}
+        result = await asyncio.wait_for(gateway.acall("gemini-test", llm_gateway.PRIORITY_EXTRACTION, 10, call, info=info), timeout=5)
+        return result, info, calls, loser_cancelled.is_set()
+
+    result, info, calls, loser_cancelled = asyncio.run(scenario())
+    limiter = gateway.limiter("gemini-test")
+    assert result == "hedge"
+    assert info == {"attempts": 1, "hedged": True, "hedge_won": True}
+    assert len(calls) == 2
+    assert loser_cancelled
+    assert limiter.counters["cancelled"] == 1 and limiter.counters["hedge_won"] == 1
+    assert limiter.in_flight == 0
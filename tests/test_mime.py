@@ -0,0 +1,142 @@
+# File: /multi_agent_system/tests/test_mime.py
+import base64
+from email.message import EmailMessage
+from pathlib import Path
+
+import pytest
+
+from core import mime
+from core.mime import parse_email, strip_quoted
+
+SAMPLES = Path(__file__).resolve().parent.parent / "samples"
+
+
+def multipart_email(pdfs: int = 2) -> str:
+    message = EmailMessage()
+    message["From"] = "Jane Buyer <jane@example.com>"
+    message["To"] = "sales@example.com"
+    message["Subject"] = "Invoices for November"
+    message["Date"] = "Mon, 27 Nov 2023 10:00:00 +0000"
+    message.set_content("Hi,\n\nPlease find the invoices attached.\n\nThanks,\nJane\n")
+    message.add_alternative("<html><body><p>Hi,</p><p>Please find the <b>invoices</b> attached.</p></body></html>", subtype="html")
+    for i in range(pdfs):
+        message.add_attachment(b"%PDF-1.4 invoice " + str(i).encode(), maintype="application", subtype="pdf", filename=f"invoice-{i}.pdf")
+    message.add_attachment(b"id,total\n1,10\n", maintype="text", subtype="csv", filename="totals.csv")
+    # Mislabelled by the sender's client, recognised by its extension.
+    message.add_attachment(b"%PDF-1.4 scan", maintype="application", subtype="octet-stream", filename="SCAN.PDF")
+    return message.as_string()
+
+
+@pytest.mark.parametrize("sample, sender", [("complaint_email.txt", "angry.customer@example.com"), ("rfq_email.txt", "procurement@bizcorp.com")])
+def test_samples(sample, sender):
+    parsed = parse_email((SAMPLES / sample).read_text())
+    assert parsed.sender == sender
+    assert parsed.subject and parsed.body
+    assert parsed.attachments == [] and parsed.skipped_attachments == []
+    assert parsed.llm_input().startswith(f"From: {sender}")
+
+
+def test_multipart_with_attachments():
+    parsed = parse_email(multipart_email())
+    assert parsed.sender == "jane@example.com"
+    assert parsed.body == "Hi,\n\nPlease find the invoices attached.\n\nThanks,\nJane"
+    assert [(a.filename, a.data) for a in parsed.attachments] == [
+        ("invoice-0.pdf", b"%PDF-1.4 invoice 0"), ("invoice-1.pdf", b"%PDF-1.4 invoice 1"), ("SCAN.PDF", b"%PDF-1.4 scan")]
+    assert parsed.skipped_attachments == [{"filename": "totals.csv", "content_type": "text/csv"}]
+    summary = parsed.summary()
+    assert [a["filename"] for a in summary["pdf_attachments"]] == ["invoice-0.pdf", "invoice-1.pdf", "SCAN.PDF"]
+
+
+def test_pdf_attachments_beyond_the_limit_are_only_listed(monkeypatch):
+    monkeypatch.setattr(mime, "EMAIL_MAX_PDF_ATTACHMENTS", 2)
+    parsed = parse_email(multipart_email(pdfs=3))
+    assert [a.filename for a in parsed.attachments] == ["invoice-0.pdf", "invoice-1.pdf"]
+    assert [s["filename"] for s in parsed.skipped_attachments] == ["invoice-2.pdf", "totals.csv", "SCAN.PDF"]
+
+
+def test_html_only_body_is_reduced_to_text():
+    message = EmailMessage()
+    message["From"] = "a@example.com"
+    message["Subject"] = "HTML"
+    message.set_content("<html><style>p {color: red}</style><body><p>Order &amp; invoice</p></body></html>", subtype="html")
+    assert parse_email(message.as_string()).body == "Order & invoice"
+
+
+@pytest.mark.parametrize("subject, expected", [
+    ("=?UTF-8?B?" + base64.b64encode("Réclamation urgente – commande 42".encode()).decode() + "?=", "Réclamation urgente – commande 42"),
+    ("=?ISO-8859-1?Q?R=E9clamation_urgente?=", "Réclamation urgente"),
+    ("Re: =?UTF-8?Q?Devis_n=C2=B012?= (suite)", "Re: Devis n°12 (suite)"),
+    ("=?UTF-8?B?broken", "=?UTF-8?B?broken"),
+])
+def test_rfc2047_encoded_subjects(subject, expected):
+    raw = f"From: =?UTF-8?Q?Jos=C3=A9?= <jose@example.com>\nSubject: {subject}\n\nBody.\n"
+    parsed = parse_email(raw)
+    assert parsed.subject == expected
+    assert parsed.sender == "jose@example.com"
+    assert parsed.headers["from"] == "José <jose@example.com>"
+    assert f"Subject: {expected}" in parsed.llm_input()
+
+
+@pytest.mark.parametrize("charset, encoding", [("iso-8859-1", "quoted-printable"), ("windows-1252", "base64"), ("koi8-r", "8bit")])
+def test_non_utf8_charsets(charset, encoding):
+    text = "Привет" if charset == "koi8-r" else "Grüße aus Köln, 50 €" if charset == "windows-1252" else "Grüße aus Köln"
+    message = EmailMessage()
+    message["From"] = "a@example.com"
+    message["Subject"] = "Charset"
+    message.set_content(text, charset=charset, cte=encoding)
+    assert parse_email(message.as_string()).body == text
+
+
+def test_unknown_charset_falls_back_to_utf8():
+    raw = ("From: a@example.com\nSubject: x\nContent-Type: text/plain; charset=x-unknown\n"
+           "Content-Transfer-Encoding: base64\n\n" + base64.b64encode("Grüße".encode()).decode() + "\n")
+    assert parse_email(raw).body == "Grüße"
+
+
+def test_on_wrote_reply_is_stripped():
+    body = ("Thanks, the replacement arrived.\n\n"
+            "On Mon, 27 Nov 2023 at 10:00, Support <support@example.com> wrote:\n"
+            "> We have shipped a replacement.\n> Regards\n")
+    result = strip_quoted(body)
+    assert result["body"] == "Thanks, the replacement arrived."
+    assert result["quoted_chars"] == len(body) - len("Thanks, the replacement arrived.\n\n")
+
+
+def test_wrapped_on_wrote_marker_is_stripped():
+    body = "Sounds good.\n\nOn Mon, 27 Nov 2023 at 10:00, Support Team\n<support@example.com> wrote:\n> Shall we?\n"
+    assert strip_quoted(body)["body"] == "Sounds good."
+
+
+def test_interleaved_quote_lines_are_stripped():
+    body = "> Can you confirm the price?\nYes, 40 USD per unit.\n>> And delivery?\nNext week.\n"
+    result = strip_quoted(body)
+    assert result["body"] == "Yes, 40 USD per unit.\nNext week."
+    assert result["quoted_chars"] == len("> Can you confirm the price?\n>> And delivery?\n")
+
+
+@pytest.mark.parametrize("marker", [
+    "-----Original Message-----\nFrom: b@example.com\n",
+    "From: b@example.com\nSent: Monday\n",
+    "________________________________\nFrom: b@example.com\n",
+])
+def test_outlook_reply_markers_are_stripped(marker):
+    assert strip_quoted(f"New answer.\n\n{marker}Old text.\n")["body"] == "New answer."
+
+
+def test_bare_forward_keeps_the_forwarded_message():
+    body = "---------- Forwarded message ---------\nFrom: b@example.com\n\nPlease quote 10 servers.\n"
+    assert "Please quote 10 servers." in strip_quoted(body)["body"]
+
+
+def test_signature_is_stripped():
+    result = strip_quoted("Please call me back.\n\n-- \nJane Buyer\nACME Corp\n")
+    assert result["body"] == "Please call me back."
+    assert result["signature_chars"] == len("-- \nJane Buyer\nACME Corp\n")
+    assert strip_quoted("Call me.\n\nSent from my iPhone\n")["body"] == "Call me."
+
+
+def test_pasted_text_without_headers_is_the_body(monkeypatch):
+    monkeypatch.setattr(mime, "EMAIL_BODY_MAX_CHARS", 10)
+    parsed = parse_email("  Hello there, this has no header block at all.")
+    assert parsed.headers == {} and parsed.sender is None
+    assert parsed.body == "Hello ther" and parsed.body_chars == len("Hello there, this has no header block at all.")
@@ -0,0 +1,193 @@
+# File: /multi_agent_system/tests/test_ndjson.py
+import asyncio
+import json
+from typing import List
+
+import pytest
+
+from core.ndjson import aiter_line_batches, aiter_lines
+
+
+async def stream(chunks: List[bytes], delay: float = 0.0):
+    for chunk in chunks:
+        if delay:
+            await asyncio.sleep(delay)
+        yield chunk
+
+
+def split(chunks: List[bytes], max_line_bytes: int = 16):
+    async def collect():
+        return [line async for line in aiter_lines(stream(chunks), max_line_bytes)]
+    return asyncio.run(collect())
+
+
+def test_lines_in_one_chunk():
+    assert split([b'{"a":1}\n{"b":2}\n']) == [(1, b'{"a":1}'), (2, b'{"b":2}')]
+
+
+@pytest.mark.parametrize("chunks", [
+    [b'{"a":', b'1}\n{"b"', b':2}\n'],
+    [b'{', b'"', b'a', b'"', b':', b'1', b'}', b'\n', b'{"b":2}', b'\n'],
+    [b'{"a":1}', b'\n', b'{"b":2}\n'],
+])
+def test_line_split_across_chunks(chunks):
+    assert split(chunks) == [(1, b'{"a":1}'), (2, b'{"b":2}')]
+
+
+@pytest.mark.parametrize("chunks", [
+    [b'{"a":1}\r\n{"b":2}\r\n'],
+    [b'{"a":1}\r', b'\n{"b":2}\r', b'\n'],
+    [b'{"a":1}\r\n{"b":2}'],
+])
+def test_crlf_line_endings(chunks):
+    assert split(chunks) == [(1, b'{"a":1}'), (2, b'{"b":2}')]
+
+
+def test_blank_lines_are_skipped_but_counted():
+    assert split([b'\n{"a":1}\n  \n\r\n{"b":2}\n']) == [(2, b'{"a":1}'), (5, b'{"b":2}')]
+
+
+def test_line_at_the_limit_is_kept():
+    exact = b"x" * 16
+    assert split([exact + b"\n", exact + b"\r\n", exact[:7], exact[7:] + b"\n", exact]) == [
+        (1, exact), (2, exact), (3, exact), (4, exact)]
+
+
+@pytest.mark.parametrize("chunks", [
+    [b'{"a":1}\n' + b"x" * 17 + b'\n{"b":2}\n'],
+    [b'{"a":1}\n' + b"x" * 10, b"x" * 10, b"x" * 50, b'\n{"b":2}\n'],
+    [b'{"a":1}\n' + b"x" * 16, b'x\n{"b":2}\n'],
+])
+def test_oversized_middle_line(chunks):
+    assert split(chunks) == [(1, b'{"a":1}'), (2, None), (3, b'{"b":2}')]
+
+
+@pytest.mark.parametrize("chunks", [
+    [b'{"a":1}\n' + b"x" * 17],
+    [b'{"a":1}\n' + b"x" * 10, b"x" * 10],
+    [b'{"a":1}\n' + b"x" * 17 + b"\n"],
+])
+def test_oversized_final_line(chunks):
+    assert split(chunks) == [(1, b'{"a":1}'), (2, None)]
+
+
+@pytest.mark.parametrize("chunks", [
+    [b'{"a":1}\n{"b":2}', b""],
+    [b'{"a":1}\n', b"", b'{"b":2}\n', b""],
+    [b"", b'{"a":1}\n{"b":2}\n'],
+])
+def test_empty_chunks(chunks):
+    assert split(chunks) == [(1, b'{"a":1}'), (2, b'{"b":2}')]
+
+
+def test_empty_stream():
+    assert split([]) == []
+    assert split([b"", b"\n\n"]) == []
+
+
+def batches(chunks: List[bytes], batch_size: int, max_wait_seconds: float = 5.0, delay: float = 0.0):
+    async def collect():
+        return [batch async for batch in aiter_line_batches(stream(chunks, delay), 64, batch_size, max_wait_seconds)]
+    return asyncio.run(collect())
+
+
+def test_batches_are_bounded_by_size():
+    body = b"".join(b'{"n":%d}\n' % i for i in range(7))
+    result = batches([body], batch_size=3)
+    assert [[line_no for line_no, _ in batch] for batch in result] == [[1, 2, 3], [4, 5, 6], [7]]
+
+
+def test_slow_senders_get_partial_batches():
+    result = batches([b'{"n":1}\n', b'{"n":2}\n', b'{"n":3}\n'], batch_size=10, max_wait_seconds=0.05, delay=0.2)
+    assert [len(batch) for batch in result] == [1, 1, 1]
+
+
+def test_reader_waits_while_a_batch_is_processed():
+    read = []
+
+    async def counted():
+        for i in range(20):
+            read.append(i)
+            yield b'{"n":%d}\n' % i
+
+    async def scenario():
+        batches_seen = 0
+        async for batch in aiter_line_batches(counted(), 64, 2, 5.0):
+            batches_seen += 1
+            if batches_seen == 1:
+                await asyncio.sleep(0.05)
+                # Backpressure: while the first batch is held, only the queue (one batch) is read ahead.
+                assert len(read) <= 2 + 2 + 1
+        return batches_seen
+
+    assert asyncio.run(scenario()) == 10
+
+
+def test_reader_errors_end_the_stream():
+    async def failing():
+        yield b'{"n":1}\n'
+        raise ConnectionResetError("client went away")
+
+    async def scenario():
+        seen = []
+        with pytest.raises(ConnectionResetError):
+            async for batch in aiter_line_batches(failing(), 64, 10, 0.05):
+                seen.append(batch)
+        return seen
+
+    assert asyncio.run(scenario()) == [[(1, b'{"n":1}')]]
+
+
+@pytest.fixture
+def ingest(redis_backend, monkeypatch):
+    """main.ingest_webhook_batch against a fresh memory, router and JSON agent."""
+    import main
+    from agents.registry import AgentRegistry
+    from core.action_router import ActionRouter
+    from core.memory import SharedMemory
+
+    async def setup():
+        memory = SharedMemory()
+        await memory.aconnect(timeout=0.5)
+        router = ActionRouter(memory)
+        monkeypatch.setattr(main, "memory", memory)
+        monkeypatch.setattr(main, "action_router", router)
+        monkeypatch.setattr(main, "agent_registry", AgentRegistry(memory, router, schema_registry_instance=main.schema_registry))
+        return main
+
+    return setup
+
+
+def test_a_failing_line_does_not_abort_its_batch(ingest, monkeypatch):
+    webhook = {"event_type": "order_created", "timestamp": "2023-11-27T14:35:00Z",
+               "data": {"order_id": "O-1", "customer_id": "C-1", "total_amount": 9.99, "currency": "USD", "items": []}}
+    lines = [
+        (1, json.dumps(webhook).encode()),
+        (2, b'{"event_type": '),
+        (3, b'[{"event_type": "order_created"}]'),
+        (4, None),
+        (5, json.dumps({**webhook, "event_type": "explode"}).encode()),
+        (6, json.dumps(webhook).encode()),
+    ]
+
+    async def scenario():
+        main = await ingest()
+        agent = await main.agent_registry.aget("json")
+        original = agent.aprocess
+
+        async def aprocess(process_id, content, payload=None):
+            if payload is not None and payload.get("event_type") == "explode":
+                raise RuntimeError("agent crashed")
+            return await original(process_id, content, payload=payload)
+
+        monkeypatch.setattr(agent, "aprocess", aprocess)
+        results = await main.ingest_webhook_batch("stream-1", lines)
+        traces = [await main.memory.aget_all_entries_for_process(r["process_id"]) if r["process_id"] else None for r in results]
+        return results, traces
+
+    results, traces = asyncio.run(scenario())
+    assert [(r["line"], r["status"]) for r in results] == [
+        (1, "valid"), (2, "invalid"), (3, "invalid"), (4, "rejected"), (5, "failed"), (6, "valid")]
+    assert "agent crashed" in results[4]["anomalies"][0]
+    assert "failed" in traces[4]["processing_summary"]["status"]
+    assert traces[5]["processing_summary"]["status"] == "JSON processed"
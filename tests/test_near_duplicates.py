@@ -0,0 +1,149 @@
+# File: /multi_agent_system/tests/test_near_duplicates.py
+import asyncio
+
+import pytest
+from pydantic import BaseModel
+
+from core.memory import SharedMemory
+from core.near_duplicates import NearDuplicateIndex
+
+COMPLAINT = (
+    "Dear support team, I am writing to complain about order 48213 which I placed on 3 November. "
+    "The package arrived two weeks late and the box was badly damaged. Two of the four glasses inside "
+    "were broken and the remaining ones were scratched. I contacted your hotline twice and nobody called "
+    "me back as promised. I expect a full refund or a replacement shipped by express delivery within the "
+    "next five working days, otherwise I will dispute the charge with my bank. Regards, Maria Lopez"
+)
+# The same template from another customer: names, numbers and addresses are masked before shingling.
+SAME_TEMPLATE = COMPLAINT.replace("48213", "51877").replace("3 November", "12 December").replace("Maria Lopez", "Tom Becker")
+ONE_TOKEN_EDIT = COMPLAINT.replace("badly damaged", "severely damaged")
+UNRELATED = (
+    "Hello, we would like to request a quotation for 20 rack servers with dual processors, 256 GB of "
+    "memory and redundant power supplies, including installation at our data centre in Leeds and a "
+    "three year on-site maintenance contract. Please also list the lead time and payment terms. Thanks"
+)
+
+
+class Verdict(BaseModel):
+    label: str
+
+
+async def connected_index(**settings) -> NearDuplicateIndex:
+    memory = SharedMemory()
+    await memory.aconnect(timeout=0.5)
+    return NearDuplicateIndex(memory, **settings)
+
+
+def run(index_settings, scenario):
+    async def main():
+        return await scenario(await connected_index(**index_settings))
+    return asyncio.run(main())
+
+
+async def classify(index: NearDuplicateIndex, process_id: str, content: str, label: str, calls: list) -> Verdict:
+    async def compute():
+        calls.append(process_id)
+        return Verdict(label=label)
+    return await index.aget_or_compute(process_id, "classifier", content, "model", "v1", Verdict, compute)
+
+
+@pytest.mark.parametrize("content, hit", [
+    (COMPLAINT, True),
+    (SAME_TEMPLATE, True),
+    (ONE_TOKEN_EDIT, True),
+    (UNRELATED, False),
+    (COMPLAINT[:60], False),  # too short to compare
+])
+def test_lookup(redis_backend, content, hit):
+    async def scenario(index):
+        calls = []
+        await classify(index, "original", COMPLAINT, "complaint", calls)
+        result = await classify(index, "repeat", content, "fresh", calls)
+        trace = await index.memory.aget_all_entries_for_process("repeat")
+        return calls, result, trace
+
+    calls, result, trace = run({}, scenario)
+    if hit:
+        assert calls == ["original"] and result.label == "complaint"
+        entry = trace["classifier_near_duplicate"]
+        assert entry["matched_process_id"] == "original" and entry["similarity"] >= entry["threshold"]
+    else:
+        assert calls == ["original", "repeat"] and result.label == "fresh"
+        assert "classifier_near_duplicate" not in (trace or {})
+
+
+def test_similarity_estimates_jaccard():
+    index = NearDuplicateIndex(None)
+    first, second = index.shingles(COMPLAINT), index.shingles(ONE_TOKEN_EDIT)
+    jaccard = len(first & second) / len(first | second)
+    estimate = index.similarity(index.signature(COMPLAINT), index.signature(ONE_TOKEN_EDIT))
+    assert abs(estimate - jaccard) < 0.15
+    assert index.similarity(index.signature(COMPLAINT), index.signature(UNRELATED)) < 0.2
+
+
+def test_results_are_scoped_by_model_and_version(redis_backend):
+    async def scenario(index):
+        signature = index.signature(COMPLAINT)
+        await index.aadd("classifier", "model", "v1", signature, "original", Verdict(label="complaint"))
+        return [await index.alookup("classifier", model, version, signature)
+                for model, version in (("model", "v1"), ("model", "v2"), ("other-model", "v1"))]
+
+    same, new_prompt, new_model = run({}, scenario)
+    assert same.process_id == "original"
+    assert new_prompt is None and new_model is None
+
+
+def test_buckets_keep_only_the_most_recent_documents(redis_backend):
+    async def scenario(index):
+        signature = index.signature(COMPLAINT)
+        for i in range(7):
+            await index.aadd("classifier", "model", "v1", signature, f"process-{i}", Verdict(label=str(i)))
+        bucket_keys = index._bucket_keys(index._prefix("classifier", "model", "v1"), signature)
+        if index.memory.is_redis_backed:
+            redis = index.memory.async_blob_client
+            lengths = [await redis.llen(key) for key in bucket_keys]
+        else:
+            lengths = [len(index._buckets[key]) for key in bucket_keys]
+        match = await index.alookup("classifier", "model", "v1", signature)
+        return lengths, match
+
+    lengths, match = run({"bucket_size": 3}, scenario)
+    assert lengths == [3] * 16
+    # Every band agrees, so each bucket holds the same three newest documents.
+    assert match.candidates == 3
+    assert match.process_id in {"process-4", "process-5", "process-6"}
+
+
+def test_local_index_is_bounded(redis_backend):
+    if redis_backend == "fake":
+        pytest.skip("the entry bound only applies to the in-process index")
+
+    async def scenario(index):
+        for i, content in enumerate((COMPLAINT, UNRELATED, ONE_TOKEN_EDIT.replace("glasses", "plates"))):
+            await index.aadd("classifier", "model", "v1", index.signature(content), f"process-{i}", Verdict(label=str(i)))
+        evicted = await index.alookup("classifier", "model", "v1", index.signature(COMPLAINT))
+        return index, evicted
+
+    index, evicted = run({"max_entries": 2}, scenario)
+    assert len(index._documents) == 2
+    # The oldest document is gone from its buckets too: the complaint now matches its later variant.
+    assert evicted.process_id == "process-2"
+    assert all("process-0" not in "".join(bucket) for bucket in index._buckets.values())
+
+
+def test_batch_computes_only_the_misses(redis_backend):
+    async def scenario(index):
+        await classify(index, "original", COMPLAINT, "complaint", [])
+        computed = []
+
+        async def compute_many(indices):
+            computed.extend(indices)
+            return [Verdict(label="fresh") for _ in indices]
+
+        results = await index.aget_or_compute_many(["a", "b", "c"], "classifier", [SAME_TEMPLATE, UNRELATED, None],
+                                                   "model", "v1", Verdict, compute_many)
+        return computed, results
+
+    computed, results = run({}, scenario)
+    assert computed == [1, 2]
+    assert [r.label for r in results] == ["complaint", "fresh", "fresh"]
@@ -0,0 +1,87 @@
+# File: /multi_agent_system/tests/test_sniffing.py
+from pathlib import Path
+
+import pytest
+
+from core.sniffing import FormatSniffer, detect_json, detect_pdf
+
+SAMPLES = Path(__file__).resolve().parent.parent / "samples"
+
+
+@pytest.fixture(scope="module")
+def sniffer():
+    return FormatSniffer.default()
+
+
+@pytest.mark.parametrize("sample, format, route", [
+    ("invoice.pdf", "PDF", "PDF"),
+    ("regulation.pdf", "PDF", "PDF"),
+    ("complaint_email.txt", "Email", "Email"),
+    ("rfq_email.txt", "Email", "Email"),
+    ("webhook_data.json", "JSON", "JSON"),
+])
+def test_samples(sniffer, sample, format, route):
+    data = (SAMPLES / sample).read_bytes()
+    result = sniffer.sniff(data)
+    assert (result.format, result.route) == (format, route)
+    # Only a prefix is kept for uploads; the verdict must not depend on seeing the whole file.
+    prefix = sniffer.sniff(data[:512], total_size=len(data))
+    assert (prefix.format, prefix.route) == (format, route)
+
+
+@pytest.mark.parametrize("body, format, route", [
+    (b'[{"event_type": "order_created"}, {"event_type": "payment_failed"}]', "JSON", "JSON"),
+    (b"  \n[1, 2, 3]\n", "JSON", "JSON"),
+    (b'\xef\xbb\xbf{"event_type": "user_signed_up"}', "JSON", "JSON"),
+    (b"[see attached]\nThanks", "Unknown", "Unknown"),
+    (b"{not json}", "Unknown", "Unknown"),
+    (b'<?xml version="1.0"?><invoice><total>10</total></invoice>', "XML", "Unknown"),
+    (b"<invoice>\n  <total>10</total>\n</invoice>\n", "XML", "Unknown"),
+    (b"id,name,amount\n1,Widget,9.99\n2,Gadget,19.99\n3,Doohickey,4.50\n", "CSV", "Unknown"),
+    (b"id;name\r\n1;Widget\r\n2;Gadget\r\n", "CSV", "Unknown"),
+    (b"MIME-Version: 1.0\nContent-Type: multipart/mixed; boundary=x\nFrom: a@example.com\n\n--x--\n", "MIME", "Email"),
+    (b"Forwarded below.\n\nFrom: a@example.com\nSubject: Hi\n\nHello", "Email", "Email"),
+    (b"Just a plain note without structure.", "Unknown", "Unknown"),
+    (b"", "Unknown", "Unknown"),
+])
+def test_formats(sniffer, body, format, route):
+    result = sniffer.sniff(body)
+    assert (result.format, result.route) == (format, route)
+
+
+def test_json_cut_off_by_the_prefix(sniffer):
+    body = b'{"event_type": "order_created", "data": "' + b"x" * 200 + b'"}'
+    assert sniffer.sniff(body[:64], total_size=len(body)) == ("JSON", "JSON", 0.85)
+    # The whole body is there but does not close: not JSON.
+    assert detect_json(memoryview(body[:64]), 64) is None
+
+
+@pytest.mark.parametrize("junk, found", [(0, True), (1019, True), (1020, False), (1022, False), (1030, False)])
+def test_pdf_marker_at_the_prefix_limit(junk, found):
+    # detect_pdf looks at the first KiB: a marker straddling (or past) that limit does not count.
+    sniffer = FormatSniffer(prefix_bytes=1024)
+    sniffer.register("PDF", "PDF", detect_pdf)
+    body = b"\x00" * junk + b"%PDF-1.7\n" + b"\x00" * 100
+    assert (sniffer.sniff(body).format == "PDF") is found
+
+
+def test_magic_bytes_straddling_a_short_prefix():
+    sniffer = FormatSniffer(prefix_bytes=16)
+    sniffer.register("PDF", "PDF", detect_pdf)
+    assert sniffer.sniff(b"\x00" * 11 + b"%PDF-1.7").format == "PDF"
+    assert sniffer.sniff(b"\x00" * 12 + b"%PDF-1.7").format == "Unknown"
+
+
+def test_text_prefix_is_cut_in_characters_not_bytes():
+    sniffer = FormatSniffer(prefix_bytes=8)
+    sniffer.register("JSON", "JSON", detect_json)
+    text = '["é€", "' + "€" * 100 + '"]'
+    # The first 8 characters encode to more than 8 bytes; the view is cut again, mid-character.
+    assert sniffer.sniff(text).route == "JSON"
+
+
+def test_registered_detectors_extend_the_default(sniffer):
+    custom = FormatSniffer.default()
+    custom.register("YAML", "Unknown", lambda view, size: 0.99 if view[:4] == b"---\n" else None)
+    assert custom.sniff(b"---\nkey: value\n").format == "YAML"
+    assert sniffer.sniff(b"---\nkey: value\n").format == "Unknown"
@@ -0,0 +1,107 @@
+# File: /multi_agent_system/tests/test_trace_codec.py
+import json
+
+import pytest
+
+from core.trace_codec import BLOB_PREFIX, TraceCodec
+
+
+@pytest.fixture
+def codec():
+    return TraceCodec(compress_min_bytes=64, ref_min_bytes=32, max_string_chars=1000)
+
+
+def round_trip(codec, entries):
+    stored = {}
+    for key, value in entries.items():
+        stored.update(codec.encode(key, value).fields)
+    return stored, codec.decode_entries(stored)
+
+
+def test_round_trip_small_and_large_values(codec):
+    entries = {
+        "plain": {"status": "ok", "count": 3},
+        "scalar": 42,
+        "large": {"text": "lorem ipsum " * 50, "items": [{"n": i, "label": f"item-{i}"} for i in range(20)]},
+    }
+    stored, decoded = round_trip(codec, entries)
+    assert decoded == entries
+    assert any(field.startswith(BLOB_PREFIX) for field in stored)
+
+
+def test_live_json_is_the_logical_value(codec):
+    value = {"payload": {"k": "v" * 100}}
+    assert json.loads(codec.encode("entry", value).json) == value
+
+
+def test_repeated_payload_is_stored_once(codec):
+    payload = {"summary": "a fairly long agent output " * 5, "scores": [1, 2, 3]}
+    stored, decoded = round_trip(codec, {"output": payload, "action": {"kind": "emit", "data": payload}})
+    assert decoded["action"]["data"] == decoded["output"] == payload
+    digest = codec.unpack(stored["output"])["$ref"]
+    action = codec.unpack(stored[BLOB_PREFIX + codec.unpack(stored["action"])["$ref"]])
+    assert action["data"] == {"$ref": digest}
+    # The payload blob plus the action's own (it is above ref_min_bytes too).
+    assert sum(1 for field in stored if field.startswith(BLOB_PREFIX)) == 2
+
+
+def test_long_strings_are_truncated():
+    codec = TraceCodec(max_string_chars=10)
+    decoded = codec.decode_entries(codec.encode("entry", {"text": "x" * 25}).fields)
+    assert decoded["entry"]["text"] == "x" * 10 + "... [15 chars truncated]"
+
+
+def test_legacy_untagged_values_are_decoded(codec):
+    raw = {b"old": json.dumps({"status": "done", "tags": ["a"]}).encode("utf-8"), "text": json.dumps([1, 2])}
+    assert codec.decode_entries(raw) == {"old": {"status": "done", "tags": ["a"]}, "text": [1, 2]}
+
+
+def test_undecodable_values_are_returned_as_text(codec):
+    assert codec.decode_entries({b"broken": b"not json"}) == {"broken": "not json"}
+
+
+@pytest.mark.parametrize("value", [
+    {"$ref": "#/definitions/Item"},
+    {"$ref": "0123456789abcdef"},
+    {"$lit": {"$ref": "x"}},
+    {"$lit": "plain"},
+    {"schema": {"$ref": "#/definitions/Item"}, "padding": "p" * 100},
+    [{"$ref": "a"}, {"$ref": "b", "extra": 1}],
+])
+def test_reference_shaped_user_data_round_trips(codec, value):
+    _, decoded = round_trip(codec, {"entry": value})
+    assert decoded == {"entry": value}
+
+
+def test_reference_shaped_user_data_is_not_resolved_against_blobs(codec):
+    payload = {"body": "shared blob content " * 5}
+    stored, _ = round_trip(codec, {"output": payload})
+    digest = next(field[len(BLOB_PREFIX):] for field in stored if field.startswith(BLOB_PREFIX))
+    stored.update(codec.encode("user", {"$ref": digest}).fields)
+    assert codec.decode_entries(stored)["user"] == {"$ref": digest}
+
+
+def test_unreferenced_blobs_after_overwrite(codec):
+    first = {"body": "first payload " * 10}
+    second = {"body": "second payload " * 10}
+    stored, _ = round_trip(codec, {"entry": first})
+    old_blobs = {field for field in stored if field.startswith(BLOB_PREFIX)}
+    assert codec.unreferenced_blobs(stored) == []
+
+    stored.update(codec.encode("entry", second).fields)
+    assert set(codec.unreferenced_blobs(stored)) == old_blobs
+
+
+def test_blobs_shared_with_other_entries_are_kept(codec):
+    shared = {"body": "shared payload " * 10}
+    stored, _ = round_trip(codec, {"a": shared, "b": {"wrapped": shared}})
+    stored.update(codec.encode("a", "replaced").fields)
+    assert codec.unreferenced_blobs(stored) == []
+    assert codec.decode_entries(stored)["b"] == {"wrapped": shared}
+
+
+def test_blobs_reached_through_other_blobs_are_kept(codec):
+    inner = {"body": "nested payload " * 10}
+    stored, _ = round_trip(codec, {"entry": {"outer": inner, "more": "m" * 50}})
+    assert sum(1 for field in stored if field.startswith(BLOB_PREFIX)) == 2
+    assert codec.unreferenced_blobs(stored) == []
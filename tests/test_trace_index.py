@@ -0,0 +1,130 @@
+# File: /multi_agent_system/tests/test_trace_index.py
+import asyncio
+import time
+
+import pytest
+
+from core.trace_index import TraceIndex
+
+
+def redis_client(backend: str):
+    if backend == "none":
+        return None
+    fakeredis = pytest.importorskip("fakeredis")
+    return fakeredis.aioredis.FakeRedis(decode_responses=True)
+
+
+async def make_index(backend: str, **kwargs) -> TraceIndex:
+    return TraceIndex(redis_client(backend), ttl_seconds=kwargs.pop("ttl_seconds", 86400), **kwargs)
+
+
+async def add(index: TraceIndex, process_id: str, terms):
+    if index.redis is None:
+        index.add_local(process_id, terms)
+        return
+    pipe = index.redis.pipeline(transaction=False)
+    index.queue_add(pipe, process_id, terms)
+    await pipe.execute()
+
+
+async def all_pages(index: TraceIndex, filters, since: float, until: float, limit: int):
+    seen, cursor = [], None
+    while True:
+        page = await index.aquery(filters, since, until, limit=limit, cursor=cursor)
+        assert page["scan_complete"]
+        assert len(page["items"]) <= limit
+        seen.extend((item["process_id"], item["indexed_at"]) for item in page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return seen
+
+
+@pytest.fixture(params=["none", "fake"])
+def backend(request):
+    return request.param
+
+
+@pytest.mark.parametrize("ties", [5, 60])
+@pytest.mark.parametrize("limit", [1, 3, 50])
+def test_pagination_across_equal_scores(backend, ties, limit):
+    async def scenario():
+        index = await make_index(backend)
+        now = time.time()
+        for i in range(ties):
+            await add(index, f"tied-{i:03d}", [(("all", "all"), now - 60)])
+        await add(index, "newer", [(("all", "all"), now - 30)])
+        await add(index, "older", [(("all", "all"), now - 90)])
+        seen = await all_pages(index, {}, now - 3600, now, limit)
+        ids = [process_id for process_id, _ in seen]
+        assert len(ids) == len(set(ids)) == ties + 2
+        assert ids[0] == "newer" and ids[-1] == "older"
+        assert [score for _, score in seen] == sorted((score for _, score in seen), reverse=True)
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("limit", [1, 4, 100])
+def test_pagination_across_bucket_boundaries(backend, limit):
+    async def scenario():
+        index = await make_index(backend, bucket_seconds=100)
+        start = (time.time() // 100 - 10) * 100
+        # Either side of each edge, exactly on it, and a gap of empty buckets in between.
+        scores = [start - 0.5, start, start + 0.5, start + 99.5, start + 100, start + 500, start + 699.9, start + 700]
+        for i, score in enumerate(scores):
+            await add(index, f"p{i}", [(("all", "all"), score), (("intent", "Invoice" if i % 2 else "RFQ"), score)])
+        seen = await all_pages(index, {}, start - 1000, time.time(), limit)
+        assert [score for _, score in seen] == sorted(scores, reverse=True)
+        invoices = await all_pages(index, {"intent": "Invoice"}, start - 1000, time.time(), limit)
+        assert [score for _, score in invoices] == sorted(scores[1::2], reverse=True)
+        both = await all_pages(index, {"intent": "RFQ", "all": "all"}, start, start + 500, limit)
+        assert [score for _, score in both] == [start + 100, start + 0.5]
+    asyncio.run(scenario())
+
+
+def test_counts_and_groups(backend):
+    async def scenario():
+        index = await make_index(backend, max_groups=2)
+        now = time.time()
+        for i in range(6):
+            intent = ["Invoice", "RFQ", "Complaint"][i % 3]
+            await add(index, f"p{i}", [(("all", "all"), now - i), (("intent", intent), now - i), (("tone", "polite"), now - i)])
+        assert await index.acount({"intent": "RFQ"}, now - 60, now) == {"count": 2, "exact": True}
+        assert await index.acount({"intent": "RFQ", "tone": "polite"}, now - 60, now) == {"count": 2, "exact": True}
+        assert await index.acount({"intent": "RFQ", "tone": "rude"}, now - 60, now) == {"count": 0, "exact": True}
+        grouped = await index.aaggregate("intent", {}, now - 60, now)
+        assert grouped["groups"] == {"Complaint": 2, "Invoice": 2} and grouped["truncated"]
+        filtered = await index.aaggregate("intent", {"tone": "polite"}, now - 60, now)
+        assert filtered["groups"] == {"Complaint": 2, "Invoice": 2} and filtered["exact"]
+    asyncio.run(scenario())
+
+
+def test_window_is_clamped_to_the_ttl():
+    index = TraceIndex(None, ttl_seconds=3600, bucket_seconds=100)
+    now = time.time()
+    since, until = index.window(0, 1e18)
+    assert since >= now - index.ttl_seconds - 1 and until <= time.time() + 100
+    assert len(index._buckets(0, 1e18)) <= index.ttl_seconds // 100 + 3
+    with pytest.raises(ValueError):
+        index.window(float("-inf"), now)
+    with pytest.raises(ValueError):
+        index.window(0, float("nan"))
+
+
+def test_malformed_cursor_is_rejected(backend):
+    async def scenario():
+        index = await make_index(backend)
+        with pytest.raises(ValueError):
+            await index.aquery({}, 0, time.time(), cursor="not-a-cursor")
+    asyncio.run(scenario())
+
+
+def test_local_index_is_bounded():
+    index = TraceIndex(None, max_local_entries=10)
+    now = time.time()
+    for i in range(20):
+        index.add_local(f"p{i}", [(("all", "all"), now + i), (("intent", f"intent-{i}"), now + i)])
+    assert index._local_size <= 10
+    assert index.local_evictions == 15
+    assert list(index._local_processes) == [f"p{i}" for i in range(15, 20)]
+    assert sum(len(members) for members in index._local.values()) == index._local_size
+    values = asyncio.run(index.avalues("intent", now, now + 20))
+    assert values == sorted(f"intent-{i}" for i in range(15, 20))
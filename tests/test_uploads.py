@@ -0,0 +1,109 @@
+# File: /multi_agent_system/tests/test_uploads.py
+import asyncio
+import hashlib
+import os
+
+import pytest
+from fastapi import HTTPException
+
+from core import uploads
+from core.uploads import InputDocument
+
+
+class FakeUpload:
+    """The part of starlette's UploadFile that InputDocument reads."""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.offset = 0
+        self.closed = False
+
+    async def read(self, size: int = -1) -> bytes:
+        chunk = self.data[self.offset:self.offset + size]
+        self.offset += len(chunk)
+        return chunk
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    monkeypatch.setenv("UPLOAD_MAX_BYTES", "64")
+    monkeypatch.setenv("UPLOAD_SPOOL_MEMORY_BYTES", "16")
+    monkeypatch.setattr(uploads, "UPLOAD_CHUNK_BYTES", 5)
+
+
+def test_multibyte_text_is_limited_in_bytes_not_characters(limits):
+    text = "é" * 40  # 40 characters, 80 bytes
+    with pytest.raises(HTTPException) as error:
+        InputDocument.from_text(text)
+    assert error.value.status_code == 413
+
+    document = InputDocument.from_text("é" * 32)
+    assert document.size == 64
+    assert document.sha256 == hashlib.sha256(("é" * 32).encode()).hexdigest()
+
+
+def test_multibyte_upload_is_limited_in_bytes(limits):
+    upload = FakeUpload(("€" * 22).encode())  # 66 bytes
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(InputDocument.from_upload(upload))
+    assert error.value.status_code == 413
+    assert upload.closed
+
+
+def test_small_upload_stays_in_memory(limits):
+    upload = FakeUpload(b'{"event_type":1}')
+    document = asyncio.run(InputDocument.from_upload(upload))
+    assert not document.on_disk and document.path is None
+    assert document.as_bytes() == b'{"event_type":1}'
+    assert upload.closed
+
+
+def test_large_upload_is_spooled_to_disk(limits):
+    data = b"%PDF-1.4 " + bytes(range(200, 240))
+    document = asyncio.run(InputDocument.from_upload(FakeUpload(data)))
+    try:
+        assert document.on_disk and os.path.exists(document.path)
+        assert document.size == len(data)
+        assert document.sha256 == hashlib.sha256(data).hexdigest()
+        assert document.prefix == data[:document.prefix_bytes]
+        assert document.pdf_source() == document.path
+        assert document.as_bytes() == data
+        assert document.text() is None  # not UTF-8
+    finally:
+        path = document.path
+        document.close()
+    assert not os.path.exists(path)
+
+
+def test_spooled_upload_over_the_limit_removes_its_file(limits, monkeypatch):
+    created = []
+    named_temporary_file = uploads.tempfile.NamedTemporaryFile
+
+    def recording(*args, **kwargs):
+        spool = named_temporary_file(*args, **kwargs)
+        created.append(spool.name)
+        return spool
+
+    monkeypatch.setattr(uploads.tempfile, "NamedTemporaryFile", recording)
+    with pytest.raises(HTTPException):
+        asyncio.run(InputDocument.from_upload(FakeUpload(b"x" * 65)))
+    assert len(created) == 1 and not os.path.exists(created[0])
+
+
+def test_prefix_is_bounded(limits, monkeypatch):
+    monkeypatch.setattr(uploads, "SNIFF_PREFIX_BYTES", 8)
+    data = "naïve text that goes on".encode()
+    document = InputDocument.from_bytes(data)
+    assert document.prefix == data[:8]
+    assert document.prefix_text() == "naïve t"
+    assert document.text() == "naïve text that goes on"
+
+
+def test_json_payload_is_parsed_once(limits):
+    document = InputDocument.from_text('{"event_type": "x"}')
+    assert document.json_payload() == {"event_type": "x"}
+    assert document.json_payload() is document.json_payload()
+    assert InputDocument.from_text("[1, 2]").json_payload() is None
@@ -0,0 +1,35 @@
+# File: /multi_agent_system/worker.py
+# Document worker for PROCESSING_MODE=queue: consumes the jobs that /process_input enqueues and runs them
+# through the same classifier/agent pipeline. Run as many as needed, on any host that reaches Redis:
+#
+#     python worker.py
+#
+# JOB_CONCURRENCY bounds the documents processed at once, JOB_PREFETCH how many are claimed ahead.
+import asyncio
+
+
+async def run_worker():
+    # Imported here, not at module level: PDF extraction workers are spawned and re-import this module.
+    from main import memory, action_router, job_queue, agent_registry
+
+    if not await memory.aconnect():
+        print("Worker: Redis is unavailable; queued jobs are processed by the API process itself.")
+        return
+    await action_router.start()
+    # Built before the first job is claimed, so its processing time does not include them.
+    await agent_registry.awarm_up()
+    print(f"Worker {job_queue.consumer_name}: consuming {job_queue.STREAM_KEY} "
+          f"(concurrency={job_queue.concurrency}, prefetch={job_queue.prefetch})")
+    try:
+        await job_queue.run()
+    finally:
+        await action_router.stop()
+        agent_registry.close()
+        await memory.aclose()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(run_worker())
+    except KeyboardInterrupt:
+        print("Worker: stopped.")